@@ -0,0 +1,66 @@
+# --- BENCHMARK: CODELIST CACHE ---
+# Times loading every codelist defined in codelists.py
+#   - without the on-disk cache (plain CSV parsing),
+#   - with a cold cache (CSV parsing + writing the cache entries) and
+#   - with a warm cache (reading the cache entries only).
+#
+# Run from the root of the repository:
+#   python analysis/benchmark_codelist_cache.py --repeat 5
+
+import argparse
+import importlib
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import codelists  # noqa: E402
+from lazy_codelists import LazyCodelist  # noqa: E402
+
+
+def load_all_codelists(cache_dir):
+    os.environ["CODELIST_CACHE_DIR"] = cache_dir
+    module = importlib.reload(codelists)
+    start = time.perf_counter()
+    n_codes = 0
+    for value in vars(module).values():
+        if isinstance(value, LazyCodelist):
+            n_codes += len(value.load())
+    return time.perf_counter() - start, n_codes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    timings = {"no cache": [], "cold cache": [], "warm cache": []}
+    for _ in range(args.repeat):
+        cache_dir = tempfile.mkdtemp(prefix="codelist-cache-")
+        try:
+            elapsed, n_codes = load_all_codelists("")
+            timings["no cache"].append(elapsed)
+            elapsed, _ = load_all_codelists(cache_dir)
+            timings["cold cache"].append(elapsed)
+            elapsed, _ = load_all_codelists(cache_dir)
+            timings["warm cache"].append(elapsed)
+            cache_bytes = sum(
+                os.path.getsize(os.path.join(cache_dir, name))
+                for name in os.listdir(cache_dir)
+            )
+        finally:
+            shutil.rmtree(cache_dir)
+
+    print(f"{n_codes} codes, {cache_bytes / 1024:.0f} KiB cached")
+    baseline = statistics.median(timings["no cache"])
+    for label, values in timings.items():
+        median = statistics.median(values)
+        print(f"{label:>10}: {median * 1000:8.1f} ms  ({baseline / median:4.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# --- BENCHMARK: CODELIST DATES ---
+# Compares evaluating the clinical events variables of a study definition
+#   - by searching each variable's window in its codelist's EventIndex,
+#   - on a first run, recording each codelist's earliest and latest days
+#     and reading the variables they answer from them, and
+#   - on a rerun (e.g. the next period, or a rerun on a saved store), with
+#     every codelist's days already recorded
+# on synthetic coded events. test/test_clinical_events.py checks all three
+# give the same columns.
+#
+# Run from the root of the repository:
+#   python analysis/benchmark_codelist_dates.py --study-definition study_definition_ba2
+
+import argparse
+import importlib
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from local_engine.clinical_events import ClinicalEventsClassifier  # noqa: E402
+from local_engine.codelist_dates import CodelistDates  # noqa: E402
+from local_engine.dates import parse_date_expression, window_bounds  # noqa: E402
+from local_engine.synthetic import make_tables  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--study-definition", default="study_definition")
+    parser.add_argument("--patients", type=int, default=200_000)
+    parser.add_argument("--rows", type=int, default=4_000_000)
+    parser.add_argument("--seed", type=int, default=20220211)
+    args = parser.parse_args()
+
+    study = importlib.import_module(args.study_definition).study
+    rng = np.random.default_rng(args.seed)
+    patient_ids = np.arange(args.patients)
+    tables = make_tables(rng, patient_ids, args.rows, study.covariate_definitions)
+    classifier = ClinicalEventsClassifier.from_covariate_definitions(study.covariate_definitions)
+    # Windows refer to covid_test_positive_date and a few other dates (e.g.
+    # preg_36wks_date), all drawn as positive test dates
+    references = {
+        parse_date_expression(bound)[0]
+        for query_args in classifier.definitions.values()
+        for bound in window_bounds(query_args)
+        if bound is not None
+    }
+    date_columns = {
+        name: np.datetime64("2021-12-16")
+        + rng.integers(0, 60, args.patients).astype("timedelta64[D]")
+        for name in sorted(references)
+        if name in study.covariate_definitions
+    }
+    windows = classifier.resolve_windows(date_columns, args.patients, study.index_date)
+    codelist_dates = CodelistDates(args.patients)
+
+    timings = {}
+    for name, dates in (("index", None), ("first run", codelist_dates), ("rerun", codelist_dates)):
+        start = time.perf_counter()
+        classifier.values(tables, patient_ids, windows, dates)
+        timings[name] = time.perf_counter() - start
+
+    keys = classifier.codelist_keys(tables, codelist_dates)
+    answered = [
+        variable
+        for variable in classifier.variables
+        if codelist_dates.answers(
+            keys[variable], classifier.definitions[variable], *windows[variable]
+        )
+    ]
+    print(
+        f"{len(classifier.variables)} clinical events variables, {len(answered)} answered by "
+        f"{len(codelist_dates)} codelists' earliest/latest days"
+    )
+    for name, elapsed in timings.items():
+        print(f"{name + ':':<11}{elapsed * 1000:8.1f} ms  ({timings['index'] / elapsed:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
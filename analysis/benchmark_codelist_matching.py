@@ -0,0 +1,82 @@
+# --- BENCHMARK: CODELIST MATCHING ---
+# Compares matching a stream of SNOMED CT event codes against
+# opensafely-cancer-excluding-lung-and-haematological-snomed using
+#   - a set of code strings (one hash lookup per event) and
+#   - an IntegerCodelist (sorted int64 array, vectorised binary search).
+# Both give the same matches (see test/test_codelist_matching.py).
+#
+# Run from the root of the repository:
+#   python analysis/benchmark_codelist_matching.py --events 1000000
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from codelist_matching import IntegerCodelist, encode_numeric_codes  # noqa: E402
+from codelists import non_haematological_cancer_opensafely_snomed_codes  # noqa: E402
+
+
+def size_of_string_set(codes):
+    return sys.getsizeof(codes) + sum(sys.getsizeof(code) for code in codes)
+
+
+def best_of(repeat, function):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--match-rate", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=20220211)
+    args = parser.parse_args()
+
+    codelist = non_haematological_cancer_opensafely_snomed_codes
+    string_set = set(codelist)
+    integer_codelist = IntegerCodelist.from_codelist(codelist)
+
+    # Event stream: a share of codes from the codelist, the rest random SCTIDs
+    rng = np.random.default_rng(args.seed)
+    n_matching = int(args.events * args.match_rate)
+    events = np.concatenate(
+        [
+            rng.choice(integer_codelist.codes, n_matching),
+            rng.integers(10**8, 10**15, args.events - n_matching),
+        ]
+    )
+    rng.shuffle(events)
+    event_strings = events.astype(str).astype(object)
+
+    print(f"{len(codelist)} codes, {args.events} events")
+    print(f"{'string set memory:':<24}{size_of_string_set(string_set) / 1024:8.0f} KiB")
+    print(f"{'integer codelist memory:':<24}{integer_codelist.nbytes / 1024:8.0f} KiB")
+
+    set_time, _ = best_of(
+        args.repeat,
+        lambda: np.fromiter(
+            (code in string_set for code in event_strings), bool, len(event_strings)
+        ),
+    )
+    int_time, _ = best_of(
+        args.repeat, lambda: integer_codelist.contains(events)
+    )
+    encode_time, _ = best_of(args.repeat, lambda: encode_numeric_codes(event_strings))
+
+    print(f"{'string set match:':<24}{set_time * 1000:8.1f} ms")
+    print(f"{'integer codelist match:':<24}{int_time * 1000:8.1f} ms  ({set_time / int_time:.0f}x)")
+    print(f"(one-off string -> int64 encoding of the event column: {encode_time * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
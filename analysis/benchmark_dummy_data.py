@@ -0,0 +1,98 @@
+# --- BENCHMARK: DUMMY DATA ---
+# Compares generating the dummy columns of a study definition from its
+# return_expectations (see local_engine/dummy_data.py)
+#   - patient by patient, as drawing each row's values in turn does, on a
+#     sample of `--per-row` patients, and
+#   - a whole column at a time, for `--patients` patients (generated
+#     `--block` patients at a time, which keeps the columns of one block in
+#     memory only)
+# reporting the rows generated per second by each, and checking that every
+# dummy date falls within its variable's window (e.g. treatments on or
+# after the positive test, second doses 19 days or more after the first).
+#
+# Run from the root of the repository:
+#   python analysis/benchmark_dummy_data.py --patients 10000000
+
+import argparse
+import importlib
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from local_engine.dates import (  # noqa: E402
+    evaluate_date_expression,
+    in_window,
+    to_days,
+    window_bounds,
+)
+from local_engine.dummy_data import DummyGenerator  # noqa: E402
+from local_extract import output_variables  # noqa: E402
+
+
+def check_windows(generator, columns, n_patients):
+    """Check the dates of the variables with a window fall within it"""
+    checked = 0
+    for variable, values in columns.items():
+        query_type, query_args = generator.graph.definitions[variable]
+        if values.dtype.kind != "M" or query_type == "aggregate_of":
+            continue
+        lower, upper = (
+            evaluate_date_expression(bound, columns, n_patients, generator.index_date)
+            for bound in window_bounds(query_args)
+        )
+        if lower is None and upper is None:
+            continue
+        days = to_days(values)
+        outside = ~np.isnat(values) & ~in_window(days, lower, upper)
+        n_outside = np.count_nonzero(outside)
+        assert not n_outside, f"{variable}: {n_outside} dates outside its window"
+        checked += 1
+    return checked
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--study-definition", default="study_definition")
+    parser.add_argument("--patients", type=int, default=10_000_000)
+    parser.add_argument("--block", type=int, default=1_000_000)
+    parser.add_argument("--per-row", type=int, default=2_000)
+    parser.add_argument("--seed", type=int, default=20220211)
+    args = parser.parse_args()
+
+    study = importlib.import_module(args.study_definition).study
+    generator = DummyGenerator.from_study(study, today="2022-06-01")
+    written = output_variables(generator.graph)
+    rng = np.random.default_rng(args.seed)
+
+    start = time.perf_counter()
+    for _ in range(args.per_row):
+        generator.columns(1, rng, written)
+    per_row_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for block_start in range(0, args.patients, args.block):
+        n_patients = min(args.block, args.patients - block_start)
+        columns = generator.columns(n_patients, rng, written)
+        assert all(len(columns[variable]) == n_patients for variable in written)
+    columns_time = time.perf_counter() - start
+    checked = check_windows(generator, columns, n_patients)
+
+    per_row_rate = args.per_row / per_row_time
+    columns_rate = args.patients / columns_time
+    print(
+        f"{len(written)} columns, {len(generator.graph.definitions)} variables, "
+        f"{checked} windowed dates within their windows"
+    )
+    print(f"{'per row:':<12}{per_row_rate:12,.0f} rows/s  ({args.per_row} rows in {per_row_time:.1f} s)")
+    print(
+        f"{'columns:':<12}{columns_rate:12,.0f} rows/s  ({args.patients} rows in "
+        f"{columns_time:.1f} s, {columns_rate / per_row_rate:.0f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
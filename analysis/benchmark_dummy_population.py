@@ -0,0 +1,80 @@
+# --- BENCHMARK: DUMMY POPULATION ---
+# Generates `--patients` dummy patients in the population of a study
+# definition (see local_engine/dummy_data.py), reporting
+#   - the share of dummy patients in the population, drawing every
+#     variable from its expectations (rejection alone) and drawing the
+#     flags the population ANDs given it
+#   - the patients drawn per patient kept, and the rows per second of the
+#     population's patients against those of patients generated regardless
+#     of the population
+# and checking that every patient kept is in the population.
+#
+# Run from the root of the repository:
+#   python analysis/benchmark_dummy_population.py --patients 1000000
+
+import argparse
+import importlib
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from local_engine.dummy_data import CHUNK_SIZE, DummyGenerator  # noqa: E402
+from local_engine.expressions import truth  # noqa: E402
+from local_extract import POPULATION, output_variables  # noqa: E402
+
+
+def share(generator, n_patients, rng):
+    """The share of patients generated by `generator` in the population"""
+    return np.mean(truth(generator.columns(n_patients, rng, [POPULATION])[POPULATION]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--study-definition", default="study_definition")
+    parser.add_argument("--patients", type=int, default=1_000_000)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--seed", type=int, default=20220211)
+    args = parser.parse_args()
+
+    study = importlib.import_module(args.study_definition).study
+    unfiltered = DummyGenerator.from_study(study, today="2022-06-01")
+    generator = DummyGenerator.from_study(study, today="2022-06-01", population=POPULATION)
+    variables = output_variables(generator.graph) + [POPULATION]
+    rng = np.random.default_rng(args.seed)
+
+    print(f"flags drawn given the population: {', '.join(sorted(generator.given))}")
+    for label, sharing in (("rejection alone", unfiltered), ("given its flags", generator)):
+        label = f"share in the population, {label}:"
+        print(f"{label:<48}{share(sharing, CHUNK_SIZE, rng):8.1%}")
+
+    start = time.perf_counter()
+    for chunk_start in range(0, args.patients, args.chunk_size):
+        unfiltered.columns(min(args.chunk_size, args.patients - chunk_start), rng, variables)
+    unfiltered_time = time.perf_counter() - start
+
+    tally = {}
+    start = time.perf_counter()
+    for chunk_start in range(0, args.patients, args.chunk_size):
+        n_patients = min(args.chunk_size, args.patients - chunk_start)
+        columns = generator.sample(n_patients, rng, variables, tally)
+        assert all(len(columns[variable]) == n_patients for variable in variables)
+        assert truth(columns[POPULATION]).all()
+    population_time = time.perf_counter() - start
+
+    print(
+        f"{tally['drawn']:,} patients drawn for {args.patients:,} in the population "
+        f"({tally['drawn'] / args.patients:.2f} per patient)"
+    )
+    print(f"{'any patients:':<24}{args.patients / unfiltered_time:12,.0f} rows/s")
+    print(
+        f"{'population patients:':<24}{args.patients / population_time:12,.0f} rows/s "
+        f"({population_time / unfiltered_time:.2f}x the time)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# --- BENCHMARK: DUMMY SHARDS ---
+# Writes a dummy cohort of a study definition (see
+# local_engine/dummy_data.py) split into 1, 2, ... shards generated by as
+# many worker processes, reporting the rows written per second. Shards only
+# run in parallel given as many CPUs. test/test_dummy_data.py checks that a
+# cohort only depends on the seed and the number of shards.
+#
+# Run from the root of the repository:
+#   python analysis/benchmark_dummy_shards.py --patients 10000000 --workers 1 4 8
+
+import argparse
+import importlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from local_engine.dummy_data import DummyGenerator  # noqa: E402
+from local_extract import output_variables  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--study-definition", default="study_definition")
+    parser.add_argument("--patients", type=int, default=1_000_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seed", type=int, default=20220211)
+    parser.add_argument("--output-dir", help="where cohorts are written (default: a temporary directory)")
+    args = parser.parse_args()
+
+    study = importlib.import_module(args.study_definition).study
+    generator = DummyGenerator.from_study(study, today="2022-06-01")
+    written = output_variables(generator.graph)
+
+    print(f"{os.cpu_count()} CPUs, {args.patients} patients, {len(written)} columns")
+    with tempfile.TemporaryDirectory(dir=args.output_dir) as directory:
+        baseline = None
+        for workers in args.workers:
+            path = os.path.join(directory, f"input_{workers}.csv.gz")
+            start = time.perf_counter()
+            rows = generator.write_shards(path, args.patients, args.seed, written, workers)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(
+                f"{workers:>3} workers: {rows / elapsed:10,.0f} rows/s  ({elapsed:.1f} s, "
+                f"{baseline / elapsed:.1f}x)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# --- BENCHMARK: DUMMY WRITER ---
+# Writes dummy cohorts of a study definition of increasing sizes (see
+# local_engine/dummy_data.py), generated and streamed to a gzipped CSV
+# `--chunk-size` patients at a time, each in a fresh process, and reports
+# the rows written per second and the peak memory (resident set size) of
+# each, which should stay the same whatever the number of rows.
+#
+# Run from the root of the repository:
+#   python analysis/benchmark_dummy_writer.py --patients 1000000 10000000 50000000
+
+import argparse
+import importlib
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from local_engine.dummy_data import CHUNK_SIZE, DummyGenerator  # noqa: E402
+from local_extract import output_variables  # noqa: E402
+
+
+def write(study_definition, n_patients, chunk_size, seed, path):
+    """Write a dummy cohort, returning the time taken and the peak RSS (in MB)"""
+    study = importlib.import_module(study_definition).study
+    generator = DummyGenerator.from_study(study, today="2022-06-01")
+    start = time.perf_counter()
+    generator.write(
+        path,
+        n_patients,
+        np.random.default_rng(seed),
+        output_variables(generator.graph),
+        chunk_size,
+    )
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kB on Linux
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--study-definition", default="study_definition")
+    parser.add_argument("--patients", type=int, nargs="+", default=[1_000_000, 10_000_000, 50_000_000])
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--seed", type=int, default=20220211)
+    parser.add_argument("--output-dir", help="where cohorts are written (default: a temporary directory)")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(dir=args.output_dir) as directory:
+        path = os.path.join(directory, "input.csv.gz")
+        print(f"{'patients':>12}{'rows/s':>12}{'seconds':>10}{'peak RSS':>12}{'size':>12}")
+        for n_patients in args.patients:
+            # A fresh process per size, so each peak is its own
+            with context.Pool(1) as pool:
+                elapsed, peak = pool.apply(
+                    write, (args.study_definition, n_patients, args.chunk_size, args.seed, path)
+                )
+            size = os.path.getsize(path) / 2**20
+            print(
+                f"{n_patients:>12,}{n_patients / elapsed:>12,.0f}{elapsed:>10.1f}"
+                f"{peak:>9.0f} MB{size:>9.0f} MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
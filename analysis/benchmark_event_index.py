@@ -0,0 +1,84 @@
+# --- BENCHMARK: EVENT INDEX ---
+# Compares answering a first/last/count query over a per-patient window
+# (relative to a synthetic covid_test_positive_date, as most variables of
+# the study definitions are)
+#   - by filtering every event of the table against the window and
+#   - by searching an EventIndex of the table built once beforehand
+# for tables of increasing size (both give the same matches, see
+# test/test_event_index.py). The filter's time grows with the table while
+# the index's barely does.
+#
+# Run from the root of the repository:
+#   python analysis/benchmark_event_index.py
+#   python analysis/benchmark_event_index.py --rows 100000 1000000 10000000
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from local_engine.clinical_events import date_run_starts  # noqa: E402
+from local_engine.dates import in_window  # noqa: E402
+from local_engine.event_index import EventIndex  # noqa: E402
+from local_engine.synthetic import random_dates  # noqa: E402
+
+
+def filter_query(patients, dates, rows, lower, upper, n_patients):
+    """First/last row and count per patient, filtering every event"""
+    selected = in_window(dates, lower[patients], upper[patients])
+    patients, dates, rows = patients[selected], dates[selected], rows[selected]
+    order = np.lexsort((rows, dates, patients))
+    patients, dates, rows = patients[order], dates[order], rows[order]
+    count = np.bincount(patients, minlength=n_patients)
+    first = np.full(n_patients, -1)
+    last = np.full(n_patients, -1)
+    if len(patients):
+        distinct, starts = np.unique(patients, return_index=True)
+        first[distinct] = rows[starts]
+        last[distinct] = rows[date_run_starts(patients, dates)[starts + count[distinct] - 1]]
+    return first, last, count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--patients", type=int, default=200_000)
+    parser.add_argument("--rows", type=int, nargs="+", default=[200_000, 2_000_000, 8_000_000])
+    parser.add_argument("--seed", type=int, default=20220211)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    n_patients = args.patients
+    positive = random_dates(rng, n_patients, np.datetime64("2021-12-16"), 60)
+    lower = positive - 180
+    upper = positive
+
+    print(f"{'rows':>10}{'filter':>12}{'build':>12}{'index':>12}")
+    for n_rows in args.rows:
+        patients = rng.integers(0, n_patients, n_rows)
+        dates = random_dates(rng, n_rows)
+        rows = np.arange(n_rows)
+
+        start = time.perf_counter()
+        filter_query(patients, dates, rows, lower, upper, n_patients)
+        filter_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = EventIndex(patients, dates, rows, n_patients)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index.first_last_count(*index.window(lower, upper))
+        index_time = time.perf_counter() - start
+
+        print(
+            f"{n_rows:>10}{filter_time * 1000:>9.1f} ms{build_time * 1000:>9.1f} ms"
+            f"{index_time * 1000:>9.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
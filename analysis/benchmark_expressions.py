@@ -0,0 +1,67 @@
+# --- BENCHMARK: EXPRESSIONS ---
+# Times evaluating every categorised_as/satisfying variable of a study
+# definition (population, vaccination_status, imdQ5, ...) with the
+# expression compiler, for `--patients` patients. Their input columns are
+# evaluated on small synthetic tables, then repeated up to that size.
+#
+# Run from the root of the repository:
+#   python analysis/benchmark_expressions.py --patients 10000000
+
+import argparse
+import importlib
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from local_engine.dependencies import VariableGraph  # noqa: E402
+from local_engine.evaluator import VariableEvaluator  # noqa: E402
+from local_engine.expressions import categorise  # noqa: E402
+from local_engine.studies import StudyBatch  # noqa: E402
+from local_engine.synthetic import make_tables  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--study-definition", default="study_definition")
+    parser.add_argument("--patients", type=int, default=10_000_000)
+    parser.add_argument("--seed", type=int, default=20220211)
+    args = parser.parse_args()
+
+    study = importlib.import_module(args.study_definition).study
+    graph = VariableGraph.from_study(study)
+    expressions = [
+        variable
+        for variable, (query_type, _) in graph.definitions.items()
+        if query_type == "categorised_as"
+    ]
+    inputs = sorted(
+        {name for variable in expressions for name in graph.dependencies[variable]}
+        - set(expressions)
+    )
+
+    rng = np.random.default_rng(args.seed)
+    patient_ids = np.arange(20_000)
+    tables = make_tables(rng, patient_ids, 200_000, graph.definitions)
+    batch = StudyBatch({"study": graph.definitions}, {"study": study.index_date})
+    sample = batch.run(VariableEvaluator(tables, patient_ids), {"study": inputs})["study"]
+    columns = {name: np.resize(sample[name], args.patients) for name in inputs}
+
+    total = 0.0
+    others = [variable for variable in graph.definitions if variable not in expressions]
+    for level in graph.plan(expressions, known=others):
+        for variable in level:
+            start = time.perf_counter()
+            query_args = graph.definitions[variable][1]
+            columns[variable] = categorise(query_args["category_definitions"], columns, args.patients)
+            elapsed = time.perf_counter() - start
+            total += elapsed
+            print(f"{variable:<32}{elapsed * 1000:9.1f} ms")
+    print(f"{len(expressions)} expressions on {args.patients} patients: {total * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
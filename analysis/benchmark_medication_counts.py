@@ -0,0 +1,91 @@
+# --- BENCHMARK: MEDICATION COUNTS ---
+# Compares evaluating the with_these_medications variables of a study
+# definition, plus look-back counts of its oral steroid codelist over 1 to
+# `--months` months before the positive test,
+#   - one variable at a time (one pass over the medication issues each, as
+#     the separate backend queries do) and
+#   - together (one pass, one index per codelist and one search per
+#     distinct bound, every count being the difference of two searches)
+# on synthetic medication issues, checking both give the same columns.
+#
+# Run from the root of the repository:
+#   python analysis/benchmark_medication_counts.py --months 24
+
+import argparse
+import importlib
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from local_engine.clinical_events import (  # noqa: E402
+    MEDICATION_TABLES,
+    MEDICATIONS_QUERY_TYPE,
+    ClinicalEventsClassifier,
+)
+from local_engine.synthetic import make_events  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--study-definition", default="study_definition")
+    parser.add_argument("--patients", type=int, default=200_000)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=20220211)
+    args = parser.parse_args()
+
+    study = importlib.import_module(args.study_definition).study
+    definitions = {
+        name: query_args
+        for name, (query_type, query_args) in study.covariate_definitions.items()
+        if query_type == MEDICATIONS_QUERY_TYPE
+    }
+    steroids = definitions["oral_steroid_drug_nhsd_12m_count"]
+    for months in range(1, args.months + 1):
+        definitions[f"oral_steroid_{months}m_count"] = {
+            **steroids,
+            "between": [
+                f"covid_test_positive_date - {months} months",
+                "covid_test_positive_date",
+            ],
+        }
+
+    rng = np.random.default_rng(args.seed)
+    patient_ids = np.arange(args.patients)
+    codes = sorted({code for query_args in definitions.values() for code in query_args["codelist"]})
+    issues = make_events(rng, patient_ids, args.rows, codes)
+    tables = {table: issues for table in set(MEDICATION_TABLES.values())}
+    date_columns = {
+        "covid_test_positive_date": np.datetime64("2021-12-16")
+        + rng.integers(0, 60, args.patients).astype("timedelta64[D]")
+    }
+
+    start = time.perf_counter()
+    separate_columns = {}
+    for variable, query_args in definitions.items():
+        single = ClinicalEventsClassifier({variable: query_args}, MEDICATION_TABLES)
+        separate_columns.update(single.columns(tables, patient_ids, date_columns))
+    separate_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    together = ClinicalEventsClassifier(definitions, MEDICATION_TABLES)
+    together_columns = together.columns(tables, patient_ids, date_columns)
+    together_time = time.perf_counter() - start
+
+    for variable in definitions:
+        assert np.array_equal(separate_columns[variable], together_columns[variable]), variable
+
+    print(f"{len(definitions)} medication variables, {args.rows} medication issues")
+    print(f"{'separate:':<10}{separate_time * 1000:9.1f} ms")
+    print(
+        f"{'together:':<10}{together_time * 1000:9.1f} ms"
+        f"  ({separate_time / together_time:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# --- BENCHMARK: SPELL INDEX ---
+# Compares evaluating the admitted_to_hospital variables of a study
+# definition, level by level (admissions anchored on an earlier admission
+# date come a level later),
+#   - building the spells of each level's group from APCS (a pass over
+#     the table, and every codelist matched, per group) and
+#   - from SpellIndexes built once and shared by every group, as a
+#     VariableEvaluator does, the ordinary admissions (patient
+#     classification "1") being indexed on their own
+# on a synthetic APCS table, checking both give the same columns.
+#
+# Run from the root of the repository:
+#   python analysis/benchmark_spell_index.py --rows 2000000
+
+import argparse
+import importlib
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from local_engine.dependencies import VariableGraph  # noqa: E402
+from local_engine.hospital_admissions import (  # noqa: E402
+    CODE_COLUMNS,
+    QUERY_TYPE,
+    AdmissionsEngine,
+)
+from local_engine.synthetic import make_admissions  # noqa: E402
+
+
+def evaluate(graph, levels, apcs, patient_ids, date_columns, cache):
+    """Every level's group of variables, sharing `cache` if it's a dict"""
+    columns = dict(date_columns)
+    for level in levels:
+        engine = AdmissionsEngine({variable: graph.definitions[variable][1] for variable in level})
+        spells = engine.spells(apcs, patient_ids, cache)
+        for variable in level:
+            columns[variable] = engine.column(variable, spells, columns, len(patient_ids))
+    return columns
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--study-definition", default="study_definition")
+    parser.add_argument("--patients", type=int, default=200_000)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=20220211)
+    args = parser.parse_args()
+
+    study = importlib.import_module(args.study_definition).study
+    graph = VariableGraph.from_study(study)
+    variables = [
+        variable
+        for variable, (query_type, _) in graph.definitions.items()
+        if query_type == QUERY_TYPE
+    ]
+    others = [variable for variable in graph.definitions if variable not in variables]
+    levels = graph.plan(variables, known=others)
+
+    rng = np.random.default_rng(args.seed)
+    patient_ids = np.arange(args.patients)
+    codes = {}
+    for variable in variables:
+        for argument in CODE_COLUMNS:
+            codelist = graph.definitions[variable][1].get(argument)
+            if codelist is not None:
+                codes.setdefault(codelist.system, set()).update(codelist)
+    apcs = make_admissions(
+        rng,
+        patient_ids,
+        args.rows,
+        sorted(codes.get("icd10", ())),
+        sorted(codes.get("opcs4", ())),
+    )
+    date_columns = {
+        "covid_test_positive_date": np.datetime64("2021-12-16")
+        + rng.integers(0, 60, args.patients).astype("timedelta64[D]")
+    }
+
+    start = time.perf_counter()
+    separate_columns = evaluate(graph, levels, apcs, patient_ids, date_columns, None)
+    separate_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cache = {}
+    shared_columns = evaluate(graph, levels, apcs, patient_ids, date_columns, cache)
+    shared_time = time.perf_counter() - start
+
+    for variable in variables:
+        # Compared as strings so NaT == NaT
+        assert np.array_equal(
+            separate_columns[variable].astype(str), shared_columns[variable].astype(str)
+        ), variable
+
+    print(f"{len(variables)} admitted_to_hospital variables in {len(levels)} levels")
+    print(
+        f"{len(apcs['patient_id'])} APCS spells, "
+        + ", ".join(
+            f"{len(spells)} of classification {classification or 'any'}"
+            for classification, spells in cache.items()
+        )
+    )
+    print(f"{'per group:':<11}{separate_time * 1000:9.1f} ms")
+    print(f"{'shared:':<11}{shared_time * 1000:9.1f} ms  ({separate_time / shared_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# --- BENCHMARK: STUDY BATCH ---
+# Compares evaluating the variables with a local engine of the study
+# definitions of every period (see periods.py), or of the named ones,
+#   - one study after the other (each scanning every table itself) and
+#   - as one StudyBatch (each table scanned once per level for all of them)
+# on synthetic tables. test/test_studies.py checks both give the same
+# columns.
+#
+# Run from the root of the repository:
+#   python analysis/benchmark_study_batch.py
+#   python analysis/benchmark_study_batch.py --periods ba1 ba2
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from local_engine.evaluator import QUERY_TYPES, VariableEvaluator  # noqa: E402
+from local_engine.studies import StudyBatch  # noqa: E402
+from local_engine.synthetic import make_tables  # noqa: E402
+from periods import load_periods  # noqa: E402
+from study_definition_builder import build_study_definitions  # noqa: E402
+
+
+def supported_variables(graph):
+    """Variables with a local engine whose dependencies all have one too"""
+    return [
+        variable
+        for variable, (query_type, _) in graph.definitions.items()
+        if query_type in QUERY_TYPES
+        and all(graph.definitions[name][0] in QUERY_TYPES for name in graph.ancestors(variable))
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--periods", nargs="+", help="default: every period")
+    parser.add_argument("--patients", type=int, default=200_000)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--seed", type=int, default=20220211)
+    args = parser.parse_args()
+
+    periods = load_periods()
+    if args.periods:
+        periods = {name: periods[name] for name in args.periods}
+    studies = build_study_definitions(periods.values())
+    batch = StudyBatch.from_studies(studies)
+    variables = {name: supported_variables(graph) for name, graph in batch.graphs.items()}
+    rng = np.random.default_rng(args.seed)
+    patient_ids = np.arange(args.patients)
+    definitions = {}
+    for graph in batch.graphs.values():
+        definitions.update(graph.definitions)
+    tables = make_tables(rng, patient_ids, args.rows, definitions)
+    evaluate = VariableEvaluator(tables, patient_ids)
+
+    start = time.perf_counter()
+    separate_groups = 0
+    for name, study in studies.items():
+        single = StudyBatch.from_studies({name: study})
+        single.run(evaluate, {name: variables[name]})
+        separate_groups += single.groups
+    separate_time = time.perf_counter() - start
+
+    # A new evaluator, so the batch doesn't reuse the codelist dates recorded
+    # by the separate runs
+    evaluate = VariableEvaluator(tables, patient_ids)
+    start = time.perf_counter()
+    batch.run(evaluate, variables)
+    batch_time = time.perf_counter() - start
+
+    print(", ".join(f"{name}: {len(variables[name])} variables" for name in studies))
+    print(f"{'separate:':<10}{separate_groups:3d} scans {separate_time * 1000:8.1f} ms")
+    print(
+        f"{'batched:':<10}{batch.groups:3d} scans {batch_time * 1000:8.1f} ms"
+        f"  ({separate_time / batch_time:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# --- BENCHMARK: COVID THERAPEUTICS ---
+# Compares evaluating the with_covid_therapeutics variables of a study
+# definition (and date_treated/prev_treated, which combine them)
+#   - one variable at a time (one pass over the therapeutics table each, as
+#     the separate backend queries do) and
+#   - with a single TherapeuticsExtractor (one pass for all of them)
+# on a synthetic therapeutics table, checking both give the same columns.
+#
+# Run from the root of the repository:
+#   python analysis/benchmark_therapeutics.py --study-definition study_definition_ba2
+
+import argparse
+import importlib
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from local_engine.synthetic import make_therapeutics  # noqa: E402
+from local_engine.therapeutics import TherapeuticsExtractor  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--study-definition", default="study_definition")
+    parser.add_argument("--patients", type=int, default=200_000)
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--seed", type=int, default=20220211)
+    args = parser.parse_args()
+
+    study = importlib.import_module(args.study_definition).study
+    rng = np.random.default_rng(args.seed)
+    patient_ids = np.arange(args.patients)
+    table = make_therapeutics(rng, patient_ids, args.rows)
+    date_columns = {
+        "covid_test_positive_date": np.datetime64("2021-12-16")
+        + rng.integers(0, 60, args.patients).astype("timedelta64[D]")
+    }
+
+    fused = TherapeuticsExtractor.from_covariate_definitions(study.covariate_definitions)
+    print(f"{len(fused.definitions)} therapeutics variables, {len(fused.derived)} combining them")
+
+    start = time.perf_counter()
+    separate_columns = {}
+    separate_scans = 0
+    for variable in fused.definitions:
+        single = TherapeuticsExtractor({variable: fused.definitions[variable]})
+        separate_columns.update(single.columns(table, patient_ids, date_columns))
+        separate_scans += single.scans
+    separate_columns.update(fused.combine(separate_columns))
+    separate_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fused_columns = fused.columns(table, patient_ids, date_columns)
+    fused_time = time.perf_counter() - start
+
+    for variable in fused.variables:
+        # Compared as strings so NaT == NaT
+        assert np.array_equal(
+            separate_columns[variable].astype(str), fused_columns[variable].astype(str)
+        ), variable
+
+    print(f"{'separate:':<10}{separate_scans:3d} scans {separate_time * 1000:8.1f} ms")
+    print(
+        f"{'fused:':<10}{fused.scans:3d} scans {fused_time * 1000:8.1f} ms"
+        f"  ({separate_time / fused_time:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# --- CODELIST CACHE ---
+# Parsed codelists are stored on disk in a compact binary form so repeated
+# extractions (and dummy data runs) skip parsing the CSV files altogether.
+#
+# Entries are keyed by the sha that `opensafely codelists update` records for
+# every downloaded file in codelists/codelists.json (or the sha1 of the file
+# itself for codelists not listed there) and by the columns read from the
+# file. The CSV's mtime and size are stored in the entry, so an entry is
+# rebuilt when either the sha or the file on disk changes.
+#
+# The cache lives in output/.cache/codelists by default; set the environment
+# variable CODELIST_CACHE_DIR to use a different directory, or to an empty
+# string to disable the cache.
+
+import functools
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import zlib
+
+from cohortextractor import codelistlib
+
+CODELISTS_JSON = os.path.join("codelists", "codelists.json")
+DEFAULT_CACHE_DIR = os.path.join("output", ".cache", "codelists")
+
+# magic, format version, CSV mtime (ns), CSV size, number of codes, categorised
+_HEADER = struct.Struct("<4sBqqIB")
+_MAGIC = b"OSCL"
+_VERSION = 1
+
+
+def cache_dir():
+    return os.environ.get("CODELIST_CACHE_DIR", DEFAULT_CACHE_DIR)
+
+
+@functools.lru_cache(maxsize=None)
+def _recorded_shas(codelists_json, version):
+    # `version` (the file's mtime and size) makes an updated codelists.json
+    # read again
+    try:
+        with open(codelists_json, "r") as f:
+            files = json.load(f)["files"]
+    except (OSError, ValueError, KeyError):
+        return {}
+    return {name: entry["sha"] for name, entry in files.items() if "sha" in entry}
+
+
+def _file_version(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def codelist_sha(filename, codelists_json=CODELISTS_JSON):
+    """Sha of a codelist CSV as recorded in codelists.json"""
+    shas = _recorded_shas(codelists_json, _file_version(codelists_json))
+    sha = shas.get(os.path.basename(filename))
+    if sha is None:
+        with open(filename, "rb") as f:
+            sha = hashlib.sha1(f.read()).hexdigest()
+    return sha
+
+
+def cache_path(filename, column, category_column=None, directory=None):
+    columns = f"{column}\0{category_column or ''}".encode("utf-8")
+    columns_key = hashlib.sha1(columns).hexdigest()[:8]
+    return os.path.join(
+        directory or cache_dir(), f"{codelist_sha(filename)}-{columns_key}.bin"
+    )
+
+
+def encode_codes(codes, has_categories, stat):
+    if has_categories:
+        values = [code for code, _ in codes] + [category for _, category in codes]
+    else:
+        values = list(codes)
+    header = _HEADER.pack(
+        _MAGIC, _VERSION, stat.st_mtime_ns, stat.st_size, len(codes), has_categories
+    )
+    return header + zlib.compress("\n".join(values).encode("utf-8"))
+
+
+def decode_codes(data, stat):
+    """Return (codes, has_categories), or None if the entry is stale or invalid"""
+    try:
+        magic, version, mtime_ns, size, n_codes, has_categories = _HEADER.unpack_from(
+            data
+        )
+    except struct.error:
+        return None
+    if (magic, version) != (_MAGIC, _VERSION):
+        return None
+    if (mtime_ns, size) != (stat.st_mtime_ns, stat.st_size):
+        return None
+    values = zlib.decompress(data[_HEADER.size :]).decode("utf-8").split("\n")
+    if has_categories:
+        return list(zip(values[:n_codes], values[n_codes:])), True
+    return values, False
+
+
+def _write_atomic(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def codelist_from_csv(filename, system, column="code", category_column=None):
+    """
+    Drop-in replacement for `cohortextractor.codelist_from_csv` which reads
+    from and populates the on-disk cache
+    """
+    directory = cache_dir()
+    if not directory:
+        return codelistlib.codelist_from_csv(
+            filename, system, column=column, category_column=category_column
+        )
+    stat = os.stat(filename)
+    path = cache_path(filename, column, category_column, directory=directory)
+    try:
+        with open(path, "rb") as f:
+            cached = decode_codes(f.read(), stat)
+    except (OSError, zlib.error, UnicodeDecodeError):
+        cached = None
+    if cached is not None:
+        codes, has_categories = cached
+        codes = codelistlib.Codelist(codes)
+        codes.system = system
+        codes.has_categories = has_categories
+        return codes
+
+    codes = codelistlib.codelist_from_csv(
+        filename, system, column=column, category_column=category_column
+    )
+    try:
+        _write_atomic(path, encode_codes(codes, codes.has_categories, stat))
+    except OSError:
+        # A read-only workspace shouldn't stop the extraction
+        pass
+    return codes
@@ -0,0 +1,252 @@
+# --- CODELIST MATCHING ---
+# Vectorised matching of event codes against codelists, for evaluating
+# variables outside the database backend (where cohortextractor matches
+# codes in SQL).
+#
+# SNOMED CT and dm+d identifiers are numeric, so instead of holding them as a
+# set of Python strings an IntegerCodelist holds them as a sorted int64 array
+# (8 bytes per code) and tests membership of a whole column of event codes at
+# once. Most event codes don't match, so a small hashed bitmap of the codelist
+# rules out the bulk of them with a single gather and the exact binary search
+# only runs on the remaining candidates.
+#
+# ICD-10 and OPCS-4 codes are hierarchical and matched by prefix. A
+# PrefixIndex holds every hospital codelist of a study definition in one
+# prefix lookup, so one pass over a diagnosis or procedure column classifies
+# each code against all of the codelists at once.
+
+import re
+
+import numpy as np
+
+# Coding systems whose codes are (SCTID-style) integers
+NUMERIC_SYSTEMS = frozenset({"snomed", "dmd"})
+
+# Event codes that aren't valid integers are encoded as this value, which
+# never matches a codelist
+NOT_A_CODE = -1
+
+# Fibonacci hashing multiplier used to spread codes over the bitmap
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def encode_numeric_codes(values):
+    """
+    Encode an array-like of codes (strings or integers) as int64
+
+    Codes which aren't non-negative integers are encoded as NOT_A_CODE.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in "iu":
+        return values.astype(np.int64, copy=False)
+    values = values.astype(str)
+    # SCTIDs have at most 18 digits, so anything that fits is safe in int64
+    valid = np.char.isdigit(values) & (np.char.str_len(values) <= 18)
+    encoded = np.full(values.shape, NOT_A_CODE, dtype=np.int64)
+    encoded[valid] = values[valid].astype(np.int64)
+    return encoded
+
+
+class IntegerCodelist:
+    """
+    A codelist from a numeric coding system stored as a sorted int64 array
+
+    For categorised codelists the categories are held in a parallel array so
+    `categories_of` can look up the category of every matching event code.
+    """
+
+    def __init__(self, codes, system, categories=None):
+        if system not in NUMERIC_SYSTEMS:
+            raise ValueError(f"'{system}' is not a numeric coding system")
+        codes = encode_numeric_codes(codes)
+        if (codes == NOT_A_CODE).any():
+            raise ValueError(f"Codelist contains codes which aren't valid {system} ids")
+        order = np.argsort(codes, kind="stable")
+        self.codes = codes[order]
+        self.system = system
+        self.categories = None
+        if categories is not None:
+            self.categories = np.asarray(categories, dtype=str)[order]
+        # Duplicate codes are allowed (combined codelists often have them) but
+        # only the first is used for lookups
+        if len(self.codes) > 1:
+            unique = np.concatenate(([True], self.codes[1:] != self.codes[:-1]))
+            self.codes = self.codes[unique]
+            if self.categories is not None:
+                self.categories = self.categories[unique]
+        # ~16 filter bytes per code keeps false candidates to a few % of events
+        self._filter_bits = int(np.clip(np.ceil(np.log2(len(self.codes) * 16 + 1)), 10, 24))
+        self._filter = np.zeros(1 << self._filter_bits, dtype=bool)
+        self._filter[self._hash(self.codes)] = True
+
+    @classmethod
+    def from_codelist(cls, codelist):
+        """Build from a cohortextractor Codelist (including lazy codelists)"""
+        if codelist.has_categories:
+            codes = [code for code, _ in codelist]
+            categories = [category for _, category in codelist]
+            return cls(codes, codelist.system, categories=categories)
+        return cls(list(codelist), codelist.system)
+
+    @property
+    def has_categories(self):
+        return self.categories is not None
+
+    @property
+    def nbytes(self):
+        nbytes = self.codes.nbytes + self._filter.nbytes
+        if self.categories is not None:
+            nbytes += self.categories.nbytes
+        return nbytes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return bool(self.contains([code])[0])
+
+    def _hash(self, codes):
+        shift = np.uint64(64 - self._filter_bits)
+        return (codes.view(np.uint64) * _HASH_MULTIPLIER) >> shift
+
+    def lookup(self, column):
+        """
+        Indices of the candidate events in `column`, their positions in
+        `codes` and whether they actually match
+        """
+        column = encode_numeric_codes(column)
+        candidates = np.flatnonzero(self._filter[self._hash(column)])
+        candidate_codes = column[candidates]
+        positions = np.searchsorted(self.codes, candidate_codes)
+        np.minimum(positions, len(self.codes) - 1, out=positions)
+        return candidates, positions, self.codes[positions] == candidate_codes
+
+    def contains(self, column):
+        """Boolean mask of the event codes in `column` which are in the codelist"""
+        matched = np.zeros(len(column), dtype=bool)
+        if len(self.codes):
+            candidates, _, is_match = self.lookup(column)
+            matched[candidates] = is_match
+        return matched
+
+    def categories_of(self, column, missing=""):
+        """Category of each event code in `column`, or `missing` if not matched"""
+        if self.categories is None:
+            raise ValueError("Codelist has no categories")
+        categories = np.full(len(column), missing, dtype=object)
+        if len(self.codes):
+            candidates, positions, is_match = self.lookup(column)
+            categories[candidates[is_match]] = self.categories[positions[is_match]]
+        return categories
+
+
+# Coding systems whose codes are hierarchical, so a codelist entry matches
+# every event code that starts with it (e.g. U071 matches U071X). This is how
+# the TPP backend matches hospital diagnoses and procedures (`LIKE 'U071%'`).
+HIERARCHICAL_SYSTEMS = frozenset({"icd10", "opcs4"})
+
+# Variable arguments holding codelists matched by prefix against SUS/APCS
+HIERARCHICAL_CODELIST_ARGUMENTS = (
+    "with_these_diagnoses",
+    "with_these_primary_diagnoses",
+    "with_these_procedures",
+)
+
+
+# Characters separating the codes of Der_Diagnosis_All and Der_Procedure_All
+_SEPARATORS = re.compile(r"[^A-Za-z0-9]+")
+
+
+def separated_codes(value):
+    """
+    The codes of a column holding several codes per row that the backend
+    matches: `LIKE '%[^A-Za-z0-9]U071%'` needs a separator before the code,
+    so a code at the very start of the value (TPP's values start with "||")
+    doesn't match
+    """
+    return [code for code in _SEPARATORS.split(value)[1:] if code]
+
+
+class PrefixIndex:
+    """
+    Classifies hierarchical codes against many codelists in a single pass
+
+    Every code of every codelist is stored once in a prefix -> codelists
+    lookup. Classifying an event code then costs one lookup per distinct
+    prefix length (ICD-10 and OPCS-4 codes are at most a handful of
+    characters) however many codelists are indexed, instead of one
+    `startswith` test per codelist entry. Event columns are classified per
+    distinct code and the result broadcast back to the rows.
+    """
+
+    def __init__(self, codelists):
+        """`codelists` maps a name to a cohortextractor Codelist"""
+        self.names = list(codelists)
+        systems = {codelist.system for codelist in codelists.values()}
+        if not systems <= HIERARCHICAL_SYSTEMS:
+            raise ValueError(f"Not hierarchical coding systems: {systems - HIERARCHICAL_SYSTEMS}")
+        if len(systems) > 1:
+            raise ValueError(f"Cannot index codelists from different systems: {systems}")
+        self.system = systems.pop() if systems else None
+        prefixes = {}
+        for position, codelist in enumerate(codelists.values()):
+            for code in codelist:
+                code = code[0] if codelist.has_categories else code
+                prefixes.setdefault(code, set()).add(position)
+        self._prefixes = {
+            prefix: np.array(sorted(positions)) for prefix, positions in prefixes.items()
+        }
+        self._lengths = sorted({len(prefix) for prefix in self._prefixes})
+
+    @classmethod
+    def from_covariate_definitions(cls, covariate_definitions, system):
+        """
+        Index every `system` codelist used by a hospital variable of a study
+        definition, named "<variable>.<argument>"
+        """
+        codelists = {}
+        for name, (_, query_args) in covariate_definitions.items():
+            for argument in HIERARCHICAL_CODELIST_ARGUMENTS:
+                codelist = query_args.get(argument)
+                if codelist is not None and codelist.system == system:
+                    codelists[f"{name}.{argument}"] = codelist
+        return cls(codelists)
+
+    def positions_of(self, code):
+        """Positions (in `names`) of the codelists which match a single code"""
+        matched = [
+            self._prefixes[code[:length]]
+            for length in self._lengths
+            if length <= len(code) and code[:length] in self._prefixes
+        ]
+        if not matched:
+            return np.array([], dtype=int)
+        return np.unique(np.concatenate(matched))
+
+    def classify(self, column):
+        """
+        Boolean matrix with one row per event code in `column` and one column
+        per indexed codelist
+        """
+        distinct, inverse = np.unique(np.asarray(column, dtype=str), return_inverse=True)
+        matrix = np.zeros((len(distinct), len(self.names)), dtype=bool)
+        for row, code in enumerate(distinct):
+            matrix[row, self.positions_of(code)] = True
+        return matrix[inverse.reshape(-1)]
+
+    def classify_all(self, column):
+        """
+        As `classify` but for columns holding several codes per row, such as
+        APCS `Der_Diagnosis_All`, where a row matches a codelist if any of its
+        codes does (see `separated_codes`)
+        """
+        distinct, inverse = np.unique(np.asarray(column, dtype=str), return_inverse=True)
+        matrix = np.zeros((len(distinct), len(self.names)), dtype=bool)
+        for row, codes in enumerate(distinct):
+            for code in separated_codes(codes):
+                matrix[row, self.positions_of(code)] = True
+        return matrix[inverse.reshape(-1)]
+
+    def matches(self, column, name):
+        """Boolean mask of the event codes in `column` matched by codelist `name`"""
+        return self.classify(column)[:, self.names.index(name)]
@@ -2,7 +2,9 @@
 # --- IMPORT STATEMENTS ---
 
 ## Import code building blocks from cohort extractor package
-from cohortextractor import (codelist, codelist_from_csv, combine_codelists)
+from cohortextractor import codelist
+## Codelists are read from their CSV file on first use (see lazy_codelists.py)
+from lazy_codelists import (codelist_from_csv, combine_codelists)
 
 
 # --- CODELISTS ---
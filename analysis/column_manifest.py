@@ -0,0 +1,52 @@
+# --- COLUMN MANIFEST ---
+# Prints which variables of a study definition a consumer's column manifest
+# needs written, which are only needed in memory (as inputs of those, or of
+# the population) and which needn't be extracted at all. With --output, the
+# manifest is also saved as a YAML list, e.g. to generate it from the
+# cols_only(...) spec of data_process.R.
+#
+# Run from the root of the repository:
+#   python analysis/column_manifest.py analysis/data_process.R --study-definition study_definition
+#   python analysis/column_manifest.py analysis/data_process.R --output output/data_process_columns.yaml
+
+import argparse
+import importlib
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from local_engine.dependencies import VariableGraph  # noqa: E402
+from local_engine.manifest import load_manifest, plan_columns  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("manifest", help="R script with a cols_only(...) spec, or a YAML list")
+    parser.add_argument("--study-definition", default="study_definition")
+    parser.add_argument("--output", help="save the manifest as a YAML list")
+    parser.add_argument("--explain", action="store_true", help="list the variables of each group")
+    args = parser.parse_args()
+
+    manifest = load_manifest(args.manifest)
+    if args.output:
+        import yaml
+
+        with open(args.output, "w") as f:
+            yaml.safe_dump(manifest, f, default_flow_style=False, sort_keys=False)
+
+    study = importlib.import_module(args.study_definition).study
+    plan = plan_columns(VariableGraph.from_study(study), manifest)
+    for label, variables in (
+        ("written", plan.written),
+        ("in memory only", plan.in_memory),
+        ("not extracted", plan.skipped),
+    ):
+        print(f"{label + ':':<16}{len(variables):4d}")
+        if args.explain:
+            for variable in variables:
+                print(f"  {variable}")
+
+
+if __name__ == "__main__":
+    main()
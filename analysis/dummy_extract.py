@@ -0,0 +1,81 @@
+# --- DUMMY EXTRACT ---
+# Writes a dummy cohort for every period (see periods.py), or for the named
+# ones, from the return_expectations of its study definition (see
+# local_engine/dummy_data.py): <output-dir>/input<suffix>.csv.gz, with the
+# columns cohortextractor writes, for `--population-size` patients (by
+# default the population_size of project.yaml's expectations) in the
+# study's population, as the backend's cohorts only hold those. Every column
+# is generated at once, so national scale cohorts for trying out
+# data_process.R and the models take seconds to generate, and patients are
+# generated and written `--chunk-size` at a time, in bounded memory. With
+# `--workers`, the patients are split into that many shards, generated in
+# parallel; a cohort is the same for the same `--seed` and `--workers`.
+#
+# Run from the root of the repository:
+#   python analysis/dummy_extract.py
+#   python analysis/dummy_extract.py --periods ba2 --population-size 10000000 --workers 8
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from local_engine.dummy_data import CHUNK_SIZE, DummyGenerator  # noqa: E402
+from local_extract import POPULATION, at_least_one, output_variables  # noqa: E402
+from periods import cohort_filename, load_periods, study_name  # noqa: E402
+from study_definition_builder import build_study_definitions  # noqa: E402
+
+PROJECT = "project.yaml"
+
+
+def population_size(path=PROJECT):
+    """The population_size of the project's expectations"""
+    import yaml
+
+    with open(path) as f:
+        return int(yaml.safe_load(f)["expectations"]["population_size"])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--periods", nargs="+", help="default: every period")
+    parser.add_argument("--population-size", type=int, help=f"default: that of {PROJECT}")
+    parser.add_argument("--seed", type=int, default=20220211)
+    parser.add_argument("--today", help="date of the expectations' \"today\" (default: today)")
+    parser.add_argument("--workers", type=at_least_one, default=1, help="shards generated in parallel")
+    parser.add_argument("--chunk-size", type=at_least_one, default=CHUNK_SIZE)
+    parser.add_argument("--compresslevel", type=int, default=1, help="gzip level (default: 1)")
+    parser.add_argument("--output-dir", default="output")
+    args = parser.parse_args()
+
+    periods = load_periods()
+    if args.periods:
+        periods = {name: periods[name] for name in args.periods}
+    studies = build_study_definitions(periods.values())
+    n_patients = args.population_size or population_size()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for period in periods.values():
+        generator = DummyGenerator.from_study(studies[study_name(period)], args.today, POPULATION)
+        written = output_variables(generator.graph)
+        path = os.path.join(args.output_dir, cohort_filename(period))
+        start = time.perf_counter()
+        generator.write_shards(
+            path,
+            n_patients,
+            args.seed,
+            written,
+            args.workers,
+            args.chunk_size,
+            args.compresslevel,
+        )
+        print(
+            f"{path}: {n_patients} patients, {len(written)} columns "
+            f"({time.perf_counter() - start:.1f} s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
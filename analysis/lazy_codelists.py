@@ -0,0 +1,121 @@
+# --- LAZY CODELISTS ---
+# codelists.py defines every codelist used by the study definitions at module
+# level, but each study definition only uses a subset of them. The functions
+# below return proxies that only read their CSV file once cohortextractor
+# first touches the codes (e.g. to log the codelist size or build a query),
+# so importing codelists.py is cheap and unused codelists are never parsed.
+# Codelists that are used are read through the on-disk cache in
+# codelist_cache.py. Codes are loaded under a lock, so that threads
+# evaluating variables at the same time (see local_engine/studies.py) never
+# see a codelist another is still loading.
+
+import os
+import threading
+
+import codelist_cache
+from cohortextractor import codelistlib
+from cohortextractor.codelistlib import Codelist
+
+# Reentrant: loading a combined codelist loads the codelists it combines
+_LOADING = threading.RLock()
+
+
+class LazyCodelist(Codelist):
+    """
+    A Codelist whose codes are produced by `loader` on first access
+
+    `system` and `has_categories` are known up front, so cohortextractor can
+    validate a variable definition without forcing the codes to be loaded.
+    """
+
+    def __init__(self, loader, system, has_categories=False):
+        super().__init__()
+        self.system = system
+        self.has_categories = has_categories
+        self._loader = loader
+
+    @property
+    def is_loaded(self):
+        return self._loader is None
+
+    def load(self):
+        if self._loader is not None:
+            with _LOADING:
+                if self._loader is not None:
+                    # Only marked as loaded once the codes are in
+                    list.extend(self, self._loader())
+                    self._loader = None
+        return self
+
+    def __reduce_ex__(self, protocol):
+        # Pickle (and deepcopy) as a plain, fully loaded Codelist
+        return (_rebuild_codelist, (list(self), self.system, self.has_categories))
+
+
+def _rebuild_codelist(codes, system, has_categories):
+    codes = Codelist(codes)
+    codes.system = system
+    codes.has_categories = has_categories
+    return codes
+
+
+def _load_then(name):
+    list_method = getattr(list, name)
+
+    def method(self, *args, **kwargs):
+        self.load()
+        for arg in args:
+            if isinstance(arg, LazyCodelist):
+                arg.load()
+        return list_method(self, *args, **kwargs)
+
+    method.__name__ = name
+    return method
+
+
+# Every list method that reads or modifies the codes must load them first
+for _name in (
+    "__iter__", "__reversed__", "__len__", "__getitem__", "__contains__",
+    "__eq__", "__ne__", "__lt__", "__le__", "__gt__", "__ge__",
+    "__add__", "__iadd__", "__mul__", "__imul__", "__rmul__",
+    "__setitem__", "__delitem__", "__repr__",
+    "append", "extend", "insert", "remove", "pop", "clear",
+    "index", "count", "sort", "reverse", "copy",
+):
+    setattr(LazyCodelist, _name, _load_then(_name))
+del _name
+
+
+def codelist_from_csv(filename, system, column="code", category_column=None):
+    """Lazy equivalent of `cohortextractor.codelist_from_csv`"""
+    if not os.path.exists(filename):
+        raise FileNotFoundError(f"Codelist file not found: {filename}")
+    return LazyCodelist(
+        lambda: codelist_cache.codelist_from_csv(
+            filename, system, column=column, category_column=category_column
+        ),
+        system=system,
+        has_categories=bool(category_column),
+    )
+
+
+def combine_codelists(first_codelist, *other_codelists):
+    """
+    Lazy equivalent of `cohortextractor.combine_codelists`
+
+    Systems and categorisation are checked straight away; the codes of the
+    combined codelist are only merged once it is used.
+    """
+    for other in other_codelists:
+        if first_codelist.system != other.system:
+            raise ValueError(
+                f"Cannot combine codelists from different systems: "
+                f"'{first_codelist.system}' and '{other.system}'"
+            )
+        if first_codelist.has_categories != other.has_categories:
+            raise ValueError("Cannot combine categorised and uncategorised codelists")
+    return LazyCodelist(
+        lambda: codelistlib.combine_codelists(first_codelist, *other_codelists),
+        system=first_codelist.system,
+        has_categories=first_codelist.has_categories,
+    )
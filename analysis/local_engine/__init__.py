@@ -0,0 +1,15 @@
+# --- LOCAL ENGINE ---
+# Building blocks for evaluating the variables of a cohortextractor
+# StudyDefinition in-process, on NumPy columns instead of in SQL. Variable
+# definitions are read from `study.covariate_definitions` (i.e. after
+# cohortextractor has processed them), so the same study definition files
+# drive both the backend extraction and the local evaluation.
+#
+# Conventions used throughout:
+#   - patients are identified by their position in a sorted array of
+#     patient_ids, and every per-patient result is an array of that length
+#   - event tables are dicts of equal length NumPy arrays, keyed by the name
+#     of the TPP table they stand in for, with lower case column names
+#     (patient_id, date, code, ...)
+#   - table dates are int32 day numbers (MISSING_DAY for missing values) and
+#     evaluated date variables datetime64[D] arrays with NaT (see dates.py)
@@ -0,0 +1,310 @@
+# --- CLINICAL EVENTS ---
+# Single pass evaluation of all `with_these_clinical_events` variables.
+#
+# Rather than scanning the coded events table once per variable, every code
+# of every codelist goes into one lookup table per coding system, mapping
+# the code to a bitmask of the variables whose codelist contains it. One
+# pass over the events table then classifies each event against all of the
+# variables at once. The (much smaller) set of matching events is indexed
+# by patient and date (see event_index.py), and each variable's flags,
+# counts and earliest/latest dates are read from the index of its codelist
+# with a search per distinct bound: a count over any window (e.g. the 3 and
+# 12 month oral steroid counts, from one pass over the medication issues)
+# is the difference of two searches. Given CodelistDates (see
+# codelist_dates.py), the earliest and latest days of each indexed
+# codelist are recorded, and the variables they answer (e.g. "ever before
+# the index date" flags) skip the search, or the pass over the table
+# altogether once every codelist of its coding system has been recorded.
+
+import collections
+
+import numpy as np
+from codelist_matching import NUMERIC_SYSTEMS, IntegerCodelist
+
+from .dates import evaluate_date_expression, from_days, parse_date_expression, window_bounds
+from .event_index import EventIndex
+
+QUERY_TYPE = "with_these_clinical_events"
+
+# with_these_medications variables are evaluated in the same way, from the
+# medication issues (coded with dm+d codes, which are SNOMED CT concepts)
+MEDICATIONS_QUERY_TYPE = "with_these_medications"
+
+# TPP table holding the coded events of each coding system
+EVENT_TABLES = {"ctv3": "CodedEvent", "snomed": "CodedEvent_SNOMED"}
+MEDICATION_TABLES = {"snomed": "MedicationIssue", "dmd": "MedicationIssue"}
+
+# For every patient, the rows (in `table`) of their first and last matching
+# event, or -1 if they have none, and their number of matching events
+EventMatches = collections.namedtuple("EventMatches", ["table", "first", "last", "count"])
+
+
+def patient_positions(patient_ids, event_patient_ids):
+    """Position of each event's patient in sorted `patient_ids` (-1 if absent)"""
+    if not len(patient_ids):
+        return np.full(len(event_patient_ids), -1)
+    positions = np.searchsorted(patient_ids, event_patient_ids)
+    np.minimum(positions, len(patient_ids) - 1, out=positions)
+    return np.where(patient_ids[positions] == event_patient_ids, positions, -1)
+
+
+def date_run_starts(patients, dates):
+    """
+    For events sorted by patient then date, the position of the first event
+    with the same patient and date as each event
+
+    The backend picks the last match of a patient with `ORDER BY date DESC`
+    followed by its tie breaks, which is the first event of their last run.
+    """
+    new_run = np.ones(len(patients), dtype=bool)
+    new_run[1:] = (patients[1:] != patients[:-1]) | (dates[1:] != dates[:-1])
+    return np.maximum.accumulate(np.where(new_run, np.arange(len(patients)), 0))
+
+
+def window_of(query_args, columns, n_patients, index_date=None, bounds=None):
+    """
+    Per-patient (lower, upper) day number bounds of a variable's window
+
+    `bounds` optionally caches evaluated bounds across variables, so that
+    the same expression of the same column is evaluated once and is the
+    same array (whose index searches are then shared, see EventIndex).
+    """
+    return tuple(
+        _bound_of(expression, columns, n_patients, index_date, bounds)
+        for expression in window_bounds(query_args)
+    )
+
+
+def _bound_of(expression, columns, n_patients, index_date, bounds):
+    if bounds is None or expression is None:
+        return evaluate_date_expression(expression, columns, n_patients, index_date)
+    column = columns.get(parse_date_expression(expression)[0])
+    key = (expression, index_date, id(column))
+    if key not in bounds:
+        # The column is kept so its id isn't reused while cached
+        days = evaluate_date_expression(expression, columns, n_patients, index_date)
+        bounds[key] = (column, days)
+    return bounds[key][1]
+
+
+class _CodeTable:
+    """
+    The distinct codes of one coding system across several codelists, each
+    with a bitmask (split into 64-bit words) of the variables that use it
+    """
+
+    def __init__(self, system, code_variables, n_variables):
+        self.system = system
+        self.numeric = system in NUMERIC_SYSTEMS
+        if self.numeric:
+            code_variables = {int(code): bits for code, bits in code_variables.items()}
+        codes = sorted(code_variables)
+        if self.numeric:
+            self.index = IntegerCodelist(codes, system)
+            self.codes = self.index.codes
+        else:
+            self.codes = np.array(codes, dtype=str)
+        self.masks = np.zeros((len(codes), -(-n_variables // 64)), dtype=np.uint64)
+        for row, code in enumerate(codes):
+            for position in code_variables[code]:
+                word, bit = divmod(position, 64)
+                self.masks[row, word] |= np.uint64(1) << np.uint64(bit)
+
+    def lookup(self, column):
+        """Rows of `column` holding a known code, and the position of that code"""
+        if not len(self.codes):
+            return np.array([], dtype=int), np.array([], dtype=int)
+        if self.numeric:
+            candidates, positions, matched = self.index.lookup(column)
+            return candidates[matched], positions[matched]
+        column = np.asarray(column, dtype=str)
+        positions = np.searchsorted(self.codes, column)
+        np.minimum(positions, len(self.codes) - 1, out=positions)
+        rows = np.flatnonzero(self.codes[positions] == column)
+        return rows, positions[rows]
+
+
+class ClinicalEventsClassifier:
+    """
+    Evaluates many clinical events variables with one pass over each coded
+    events table
+
+    `definitions` maps variable names to their (processed) cohortextractor
+    query arguments, which must include a `codelist`, and `event_tables`
+    maps coding systems to the table of their events (MEDICATION_TABLES for
+    with_these_medications variables).
+    """
+
+    def __init__(self, definitions, event_tables=EVENT_TABLES):
+        self.definitions = dict(definitions)
+        self.event_tables = event_tables
+        self.variables = list(self.definitions)
+        by_system = {}
+        for position, (variable, query_args) in enumerate(self.definitions.items()):
+            if query_args.get("ignore_days_where_these_codes_occur"):
+                raise NotImplementedError(
+                    f"{variable}: ignore_days_where_these_codes_occur is not supported"
+                )
+            codelist = query_args["codelist"]
+            if codelist.system not in event_tables:
+                raise ValueError(f"{variable}: unsupported coding system {codelist.system}")
+            code_variables = by_system.setdefault(codelist.system, {})
+            for item in codelist:
+                code = item[0] if codelist.has_categories else item
+                code_variables.setdefault(code, set()).add(position)
+        self._code_tables = {
+            system: _CodeTable(system, code_variables, len(self.variables))
+            for system, code_variables in by_system.items()
+        }
+        self._categories = {
+            variable: dict(query_args["codelist"])
+            for variable, query_args in self.definitions.items()
+            if query_args["codelist"].has_categories
+        }
+
+    @classmethod
+    def from_covariate_definitions(cls, covariate_definitions, variables=None):
+        """All (or the named) clinical events variables of a study definition"""
+        return cls(
+            {
+                name: query_args
+                for name, (query_type, query_args) in covariate_definitions.items()
+                if query_type == QUERY_TYPE and (variables is None or name in variables)
+            }
+        )
+
+    def resolve_windows(self, columns, n_patients, index_date=None):
+        """Per-patient (lower, upper) date bounds of every variable"""
+        bounds = {}
+        return {
+            variable: window_of(query_args, columns, n_patients, index_date, bounds)
+            for variable, query_args in self.definitions.items()
+        }
+
+    def codelist_keys(self, tables, codelist_dates):
+        """The key of every variable's codelist column in `codelist_dates`"""
+        keys = {}
+        by_codelist = {}
+        for variable, query_args in self.definitions.items():
+            codelist = query_args["codelist"]
+            if id(codelist) not in by_codelist:
+                table_name = self.event_tables[codelist.system]
+                by_codelist[id(codelist)] = codelist_dates.key(
+                    table_name, tables[table_name], codelist
+                )
+            keys[variable] = by_codelist[id(codelist)]
+        return keys
+
+    def match(self, tables, patient_ids, windows, codelist_dates=None):
+        """
+        Find every variable's matching events for every patient
+
+        `tables` maps TPP table names to event tables with `patient_id`,
+        `date` (day numbers) and `code` columns, and `windows` maps
+        variables to their per-patient (lower, upper) bounds (see
+        `resolve_windows`). Variables answered by `codelist_dates` (see
+        `values`) are left out.
+        """
+        n_patients = len(patient_ids)
+        keys = self.codelist_keys(tables, codelist_dates) if codelist_dates is not None else {}
+
+        def answered(variable):
+            if codelist_dates is None:
+                return False
+            lower, upper = windows.get(variable, (None, None))
+            return codelist_dates.answers(keys[variable], self.definitions[variable], lower, upper)
+
+        matches = {}
+        for system, code_table in self._code_tables.items():
+            table_name = self.event_tables[system]
+            table = tables[table_name]
+            variables = [
+                variable
+                for variable in self.variables
+                if self.definitions[variable]["codelist"].system == system
+            ]
+            if all(answered(variable) for variable in variables):
+                continue
+            # The single pass over the table: everything after this works on
+            # matching events only
+            rows, code_positions = code_table.lookup(table["code"])
+            patients = patient_positions(patient_ids, table["patient_id"][rows])
+            known = patients >= 0
+            rows, code_positions, patients = rows[known], code_positions[known], patients[known]
+            # Index matching events by patient then date, so each window is
+            # found by searching the index rather than filtering the events
+            index = EventIndex(patients, table["date"][rows], rows, n_patients)
+            masks = code_table.masks[code_positions[index.source]]
+
+            # Variables sharing a codelist (e.g. across periods) share its
+            # events, whatever their windows
+            codelist_indexes = {}
+            for variable in variables:
+                codelist = self.definitions[variable]["codelist"]
+                if id(codelist) not in codelist_indexes:
+                    word, bit = divmod(self.variables.index(variable), 64)
+                    selected = ((masks[:, word] >> np.uint64(bit)) & np.uint64(1)) == 1
+                    codelist_indexes[id(codelist)] = index.subset(selected)
+                    if codelist_dates is not None and keys[variable] not in codelist_dates:
+                        codelist_dates.add(keys[variable], codelist_indexes[id(codelist)])
+                if answered(variable):
+                    continue
+                codelist_index = codelist_indexes[id(codelist)]
+                lower, upper = windows.get(variable, (None, None))
+                first, last, count = codelist_index.first_last_count(
+                    *codelist_index.window(lower, upper)
+                )
+                matches[variable] = EventMatches(table_name, first, last, count)
+        return matches
+
+    def column(self, variable, matches, tables):
+        """The value `returning` asks for, from a variable's matching events"""
+        query_args = self.definitions[variable]
+        returning = query_args.get("returning", "binary_flag")
+        if returning == "binary_flag":
+            return (matches.count > 0).astype(int)
+        if returning == "number_of_matches_in_period":
+            return matches.count
+        rows = matches.first if query_args.get("find_first_match_in_period") else matches.last
+        found = rows >= 0
+        table = tables[matches.table]
+        if returning == "date":
+            values = np.full(len(rows), np.datetime64("NaT", "D"))
+            values[found] = from_days(table["date"][rows[found]])
+            return values
+        values = np.full(len(rows), "", dtype=object)
+        codes = table["code"][rows[found]].astype(str)
+        if returning == "code":
+            values[found] = codes
+        elif returning == "category":
+            categories = self._categories[variable]
+            values[found] = [categories.get(code, "") for code in codes]
+        else:
+            raise ValueError(f"{variable}: unsupported `returning` value: {returning}")
+        return values
+
+    def values(self, tables, patient_ids, windows, codelist_dates=None):
+        """
+        Every variable's per-patient column, for the given windows
+
+        With `codelist_dates`, variables whose codelist's earliest or latest
+        days answer them are read from those days, which are recorded for
+        every codelist indexed along the way.
+        """
+        matches = self.match(tables, patient_ids, windows, codelist_dates)
+        keys = self.codelist_keys(tables, codelist_dates) if codelist_dates is not None else {}
+        values = {}
+        for variable in self.variables:
+            if variable in matches:
+                values[variable] = self.column(variable, matches[variable], tables)
+            else:
+                lower, upper = windows.get(variable, (None, None))
+                values[variable] = codelist_dates.column(
+                    keys[variable], self.definitions[variable], lower, upper
+                )
+        return values
+
+    def columns(self, tables, patient_ids, date_columns, index_date=None, codelist_dates=None):
+        """Evaluate every variable, returning a dict of per-patient columns"""
+        windows = self.resolve_windows(date_columns, len(patient_ids), index_date)
+        return self.values(tables, patient_ids, windows, codelist_dates)
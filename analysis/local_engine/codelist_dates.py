@@ -0,0 +1,188 @@
+# --- CODELIST DATES ---
+# Each patient's earliest and latest matching event date per codelist.
+#
+# Most clinical events variables are "ever before the index date" flags,
+# e.g. `diabetes` (on_or_before="covid_test_positive_date"), and a few are
+# "ever after" flags or first/last dates with an open-ended window. These
+# only need a patient's earliest (or latest) matching date: a flag is a
+# single vectorised comparison of that date with the bound, whatever the
+# number of events. The (patient x codelist) matrices of earliest and
+# latest days are filled as a by-product of indexing each codelist's
+# events (see clinical_events.py), so they are built once per codelist and
+# reused by every period (e.g. ba1 and ba2, whose windows differ) and, when
+# saved alongside a store, by later runs without scanning the coded events
+# again.
+#
+# A codelist's column is keyed by its table, coding system and codes, and
+# by a fingerprint of the table's contents (a hash of its patient_id, date
+# and code columns, computed once per table and run), so that a table
+# regenerated or edited since the columns were saved, even keeping its
+# number of rows, isn't answered from stale columns. Saved matrices also
+# carry a hash of the patient ids their rows are aligned on, and are only
+# loaded for the same patient ids.
+
+import hashlib
+import os
+
+import numpy as np
+
+from .dates import DAY_DTYPE, NAT, from_days, present
+
+CODELIST_DATES = "codelist_dates.npz"
+
+
+# Columns of an events table its fingerprint covers
+FINGERPRINT_COLUMNS = ("patient_id", "date", "code")
+
+
+def table_fingerprint(table):
+    """Hash of the contents of an events table's patient_id, date and code columns"""
+    digest = hashlib.sha1()
+    for column in FINGERPRINT_COLUMNS:
+        values = np.asarray(table[column])
+        if values.dtype.kind == "O":
+            # Codes are object arrays of strings: hashed as their text, with
+            # a separator no code holds
+            data = "\x00".join(map(str, values.tolist())).encode()
+        else:
+            data = np.ascontiguousarray(values).tobytes()
+        digest.update(f"{column}:{values.dtype}:{len(values)}:".encode())
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def patients_fingerprint(patient_ids):
+    """Hash of the (sorted) patient ids the rows of the matrices are aligned on"""
+    patient_ids = np.ascontiguousarray(patient_ids, dtype=np.int64)
+    return hashlib.sha1(f"{len(patient_ids)}:".encode() + patient_ids.tobytes()).hexdigest()
+
+
+def codelist_key(table_name, fingerprint, codelist):
+    """Key of a codelist's column, for the events of a table with `fingerprint`"""
+    codes = sorted(str(item[0] if codelist.has_categories else item) for item in codelist)
+    text = f"{table_name}:{fingerprint}:{codelist.system}:" + ",".join(codes)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class CodelistDates:
+    """
+    Per-codelist columns of each patient's earliest and latest matching day
+    (MISSING_DAY for patients without a matching event)
+    """
+
+    def __init__(self, n_patients):
+        self.n_patients = n_patients
+        self.earliest = {}
+        self.latest = {}
+        # Fingerprints of the tables keyed so far, by table name
+        self.fingerprints = {}
+
+    def __contains__(self, key):
+        return key in self.earliest
+
+    def __len__(self):
+        return len(self.earliest)
+
+    def key(self, table_name, table, codelist):
+        """
+        Key of a codelist's column for the events of `table`, fingerprinting
+        each table the first time one of its codelists is keyed
+        """
+        if table_name not in self.fingerprints:
+            self.fingerprints[table_name] = table_fingerprint(table)
+        return codelist_key(table_name, self.fingerprints[table_name], codelist)
+
+    def add(self, key, index):
+        """Record the earliest and latest days of a codelist's EventIndex"""
+        self.earliest[key], self.latest[key] = index.first_last_days()
+
+    def answers(self, key, query_args, lower=None, upper=None):
+        """Whether a variable can be answered from its codelist's days"""
+        return key in self and _extreme(query_args, lower, upper) is not None
+
+    def column(self, key, query_args, lower=None, upper=None):
+        """
+        A variable's per-patient column from its codelist's earliest or
+        latest days (see `answers`)
+        """
+        returning = query_args.get("returning", "binary_flag")
+        if _extreme(query_args, lower, upper) == "earliest":
+            days = self.earliest[key]
+            found = present(days)
+            if upper is not None:
+                found &= present(upper) & (days <= upper)
+        else:
+            days = self.latest[key]
+            found = present(days)
+            if lower is not None:
+                found &= present(lower) & (days >= lower)
+        if returning == "binary_flag":
+            return found.astype(int)
+        return np.where(found, from_days(days), NAT)
+
+    def save(self, directory, patient_ids):
+        """
+        Save the (patient x codelist) matrices to `directory`, with a hash of
+        the `patient_ids` their rows are aligned on
+        """
+        if len(patient_ids) != self.n_patients:
+            raise ValueError(f"{len(patient_ids)} patient ids for {self.n_patients} patients")
+        keys = sorted(self.earliest)
+        earliest = np.empty((self.n_patients, len(keys)), dtype=DAY_DTYPE)
+        latest = np.empty_like(earliest)
+        for position, key in enumerate(keys):
+            earliest[:, position] = self.earliest[key]
+            latest[:, position] = self.latest[key]
+        np.savez_compressed(
+            os.path.join(directory, CODELIST_DATES),
+            keys=np.array(keys, dtype=str),
+            earliest=earliest,
+            latest=latest,
+            patients=np.array(patients_fingerprint(patient_ids)),
+        )
+
+    @classmethod
+    def load(cls, directory, patient_ids):
+        """
+        The codelist dates saved in `directory` (empty if there are none,
+        or if they were saved for different patient ids)
+        """
+        dates = cls(len(patient_ids))
+        path = os.path.join(directory, CODELIST_DATES)
+        if not os.path.exists(path):
+            return dates
+        with np.load(path) as saved:
+            # Matrices saved without the hash are for unknown patients
+            patients = str(saved["patients"]) if "patients" in saved else None
+            if patients != patients_fingerprint(patient_ids):
+                return dates
+            keys, earliest, latest = saved["keys"], saved["earliest"], saved["latest"]
+        for position, key in enumerate(keys):
+            dates.earliest[str(key)] = np.ascontiguousarray(earliest[:, position])
+            dates.latest[str(key)] = np.ascontiguousarray(latest[:, position])
+        return dates
+
+
+def _extreme(query_args, lower, upper):
+    """
+    Which of the earliest or latest matching days answers a variable, if
+    either does: a flag needs an open-ended window (either bound None), a
+    first match date an open lower bound and a last match date an open
+    upper one. Without any window, events without a date match too, so the
+    days (of dated events) answer nothing.
+    """
+    if lower is None and upper is None:
+        return None
+    returning = query_args.get("returning", "binary_flag")
+    if returning == "binary_flag":
+        if lower is None:
+            return "earliest"
+        if upper is None:
+            return "latest"
+    elif returning == "date":
+        if query_args.get("find_first_match_in_period"):
+            if lower is None:
+                return "earliest"
+        elif upper is None:
+            return "latest"
+    return None
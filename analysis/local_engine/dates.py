@@ -0,0 +1,197 @@
+# --- DATES ---
+# Evaluation of cohortextractor date expressions (e.g. "index_date",
+# "covid_test_positive_date - 6 months", "2020-06-08") to per-patient day
+# numbers. Expressions are parsed with cohortextractor's own grammar, once
+# per distinct expression; month and year arithmetic clamps to the end of
+# the month as DATEADD does on the backend.
+#
+# Inside the engine, the dates of tables and of window bounds are int32
+# days since 1970-01-01, with MISSING_DAY for missing dates: half the size
+# of datetime64[D], and every window test an integer comparison. Evaluated
+# date variables stay datetime64[D] (with NaT), whose dtype is what marks
+# them as dates for expressions and for the output.
+
+import datetime
+import functools
+
+import numpy as np
+from cohortextractor.date_expressions import DateExpressionEvaluator
+
+NAT = np.datetime64("NaT", "D")
+
+DAY_DTYPE = np.int32
+MISSING_DAY = np.iinfo(DAY_DTYPE).min
+
+_UNITS = {
+    "day": "days",
+    "days": "days",
+    "month": "months",
+    "months": "months",
+    "year": "years",
+    "years": "years",
+}
+
+
+def to_days(dates):
+    """Day numbers (MISSING_DAY for NaT) of datetime64 dates or ISO strings"""
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    days = dates.astype(np.int64)
+    return np.where(np.isnat(dates), MISSING_DAY, days).astype(DAY_DTYPE)
+
+
+def from_days(days):
+    """datetime64[D] dates (NaT for MISSING_DAY) of day numbers"""
+    days = np.asarray(days)
+    dates = days.astype(np.int64).astype("datetime64[D]")
+    return np.where(days == MISSING_DAY, NAT, dates)
+
+
+def present(days):
+    return np.asarray(days) != MISSING_DAY
+
+
+@functools.lru_cache(maxsize=None)
+def parse_date_expression(expression):
+    """
+    Split a date expression into (reference, offset, unit)
+
+    `reference` is a column name, "index_date" or an ISO date, e.g.
+    "covid_vax_1 + 19 days" -> ("covid_vax_1", 19, "days"). Parsed once
+    per expression.
+    """
+    expression = str(expression)
+    try:
+        datetime.date.fromisoformat(expression)
+        return expression, 0, "days"
+    except ValueError:
+        pass
+    match = DateExpressionEvaluator.regex.match(expression.replace(" ", ""))
+    if not match:
+        raise ValueError(f"Unparseable date expression: {expression}")
+    parts = match.groupdict()
+    if parts["function"]:
+        raise NotImplementedError(
+            f"Date functions are not supported locally: {expression}"
+        )
+    offset = 0
+    unit = "days"
+    if parts["operator"]:
+        offset = int(parts["quantity"])
+        if parts["operator"] == "-":
+            offset = -offset
+        try:
+            unit = _UNITS[parts["units"]]
+        except KeyError:
+            raise ValueError(f"Unknown date unit '{parts['units']}' in: {expression}")
+    return parts["name"], offset, unit
+
+
+def window_bounds(query_args):
+    """
+    The (lower, upper) date expressions of a variable's window, from
+    `between` or from `on_or_after`/`on_or_before` (None: open-ended)
+    """
+    between = query_args.get("between")
+    if between:
+        return tuple(between)
+    return query_args.get("on_or_after"), query_args.get("on_or_before")
+
+
+def add_months(dates, months):
+    """Add a number of months to a datetime64[D] array, clamping the day"""
+    month_starts = dates.astype("datetime64[M]")
+    day_of_month = dates - month_starts.astype("datetime64[D]")
+    shifted = month_starts + np.timedelta64(months, "M")
+    last_day = (shifted + np.timedelta64(1, "M")).astype("datetime64[D]") - 1
+    return np.minimum(shifted.astype("datetime64[D]") + day_of_month, last_day)
+
+
+def shift_dates(dates, offset, unit):
+    if not offset:
+        return dates
+    if unit == "days":
+        return dates + np.timedelta64(offset, "D")
+    if unit == "months":
+        return add_months(dates, offset)
+    return add_months(dates, 12 * offset)
+
+
+def shift_days(days, offset, unit):
+    """Day numbers shifted by a date expression's offset, keeping MISSING_DAY"""
+    if not offset:
+        return days
+    if unit == "days":
+        return np.where(present(days), days + DAY_DTYPE(offset), MISSING_DAY).astype(DAY_DTYPE)
+    return to_days(shift_dates(from_days(days), offset, unit))
+
+
+def evaluate_date_expression(expression, columns, n_patients, index_date=None):
+    """
+    Evaluate a date expression to per-patient day numbers
+
+    `columns` maps variable names to already evaluated per-patient date
+    columns. Returns None for a None expression (i.e. an open-ended bound).
+    """
+    if expression is None:
+        return None
+    reference, offset, unit = parse_date_expression(expression)
+    if reference == "index_date":
+        if index_date is None:
+            raise ValueError("index_date not defined")
+        reference = index_date
+    if reference in columns:
+        days = to_days(columns[reference])
+    else:
+        try:
+            date = np.datetime64(reference, "D")
+        except ValueError:
+            raise ValueError(f"Unknown date column '{reference}' in: {expression}")
+        days = np.full(n_patients, to_days(date))
+    return shift_days(days, offset, unit)
+
+
+def in_window(days, lower, upper):
+    """
+    Mask of day numbers `days` within the inclusive [lower, upper] window,
+    where either bound may be None (open-ended). A missing date never falls
+    within a window, nor does any date of a window with a missing bound.
+    """
+    mask = present(days)
+    if lower is not None:
+        mask &= (days >= lower) & present(lower)
+    if upper is not None:
+        mask &= (days <= upper) & present(upper)
+    return mask
+
+
+def bound_for(bound, patients):
+    """
+    A window bound (per-patient day numbers, a scalar or None) for rows of
+    the patients at positions `patients`
+    """
+    if bound is None or np.ndim(bound) == 0:
+        return bound
+    return bound[patients]
+
+
+def to_list(value):
+    """A query argument holding one value or several as a list (None as [])"""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+
+def earliest(columns):
+    """Per-patient earliest of several day number columns, ignoring missing ones"""
+    latest_day = np.iinfo(DAY_DTYPE).max
+    earliest_days = np.minimum.reduce(
+        [np.where(present(days), days, latest_day) for days in columns]
+    )
+    return np.where(earliest_days == latest_day, MISSING_DAY, earliest_days).astype(DAY_DTYPE)
+
+
+def latest(columns):
+    """Per-patient latest of several day number columns (MISSING_DAY is the least)"""
+    return np.maximum.reduce(list(columns)).astype(DAY_DTYPE)
@@ -0,0 +1,338 @@
+# --- DEMOGRAPHICS ---
+# Evaluation of the patient level variables of a study definition: sex,
+# age, deaths, practice registrations, addresses, SUS ethnicity and BMI.
+#
+# These read small tables (at most a few rows per patient), so each variable
+# is one vectorised pass over its table. Values follow the TPP backend:
+#   - registrations and addresses cover [start_date, end_date), with a
+#     missing end date standing in for the backend's 9999-12-31 "still
+#     current" one;
+#     when several cover a date the one that started last is used
+#   - ages are whole years on the reference date
+#   - missing values are "" for strings, 0 for numbers, NaT for dates and
+#     -1 for IMD and rural/urban classification, whose 0 is a valid value
+
+import numpy as np
+
+from .clinical_events import date_run_starts, patient_positions
+from .dates import (
+    DAY_DTYPE,
+    MISSING_DAY,
+    NAT,
+    bound_for,
+    evaluate_date_expression,
+    from_days,
+    in_window,
+    present,
+    window_bounds,
+)
+
+# TPP-like tables read by this module
+PATIENT = "Patient"
+DEATHS = "ONS_Deaths"
+REGISTRATIONS = "RegistrationHistory"
+ADDRESSES = "PatientAddress"
+SUS_ETHNICITY = "SUS_Ethnicity"
+# Recorded BMI values are coded events with a numeric value
+CODED_EVENTS = "CodedEvent"
+BMI_CODE = "22K.."
+
+# SUS ethnic category codes of each 6 level group
+ETHNICITY_GROUP_6 = {
+    **dict.fromkeys("ABC", "1"),
+    **dict.fromkeys("DEFG", "2"),
+    **dict.fromkeys("HJKL", "3"),
+    **dict.fromkeys("MNP", "4"),
+    **dict.fromkeys("RS", "5"),
+}
+
+QUERY_TYPES = (
+    "sex",
+    "age_as_of",
+    "died_from_any_cause",
+    "with_these_codes_on_death_certificate",
+    "registered_as_of",
+    "registered_practice_as_of",
+    "date_deregistered_from_all_supported_practices",
+    "address_as_of",
+    "with_ethnicity_from_sus",
+    "most_recent_bmi",
+)
+
+
+def _per_patient(values, patient_ids, table):
+    """A column of a one-row-per-patient table, aligned on `patient_ids`"""
+    positions = patient_positions(table["patient_id"], patient_ids)
+    found = positions >= 0
+    return values[positions[found]], found
+
+
+def _date_of(expression, date_columns, n_patients, index_date):
+    return evaluate_date_expression(expression, date_columns, n_patients, index_date)
+
+
+def sex(query_args, tables, patient_ids, date_columns, index_date=None):
+    values = np.full(len(patient_ids), "", dtype=object)
+    patient = tables[PATIENT]
+    found_values, found = _per_patient(patient["sex"], patient_ids, patient)
+    values[found] = found_values
+    return values
+
+
+def age_as_of(query_args, tables, patient_ids, date_columns, index_date=None):
+    n_patients = len(patient_ids)
+    reference = from_days(
+        _date_of(query_args["reference_date"], date_columns, n_patients, index_date)
+    )
+    patient = tables[PATIENT]
+    birth = np.full(n_patients, NAT)
+    found_values, found = _per_patient(patient["date_of_birth"], patient_ids, patient)
+    birth[found] = from_days(found_values)
+    known = ~np.isnat(birth) & ~np.isnat(reference)
+    ages = np.zeros(n_patients, dtype=int)
+    birth, reference = birth[known], reference[known]
+    birth_months = birth.astype("datetime64[M]")
+    reference_months = reference.astype("datetime64[M]")
+    months = (reference_months - birth_months).astype(int)
+    # Not yet reached the birthday in the reference month
+    months -= (reference - reference_months.astype("datetime64[D]")) < (
+        birth - birth_months.astype("datetime64[D]")
+    )
+    ages[known] = months // 12
+    return ages
+
+
+def _deaths_in_window(query_args, tables, patient_ids, date_columns, index_date, codes=None):
+    """Per-patient row of their (first) matching death, or -1"""
+    deaths = tables[DEATHS]
+    n_patients = len(patient_ids)
+    patients = patient_positions(patient_ids, deaths["patient_id"])
+    rows = np.flatnonzero(patients >= 0)
+    if codes is not None:
+        codes = list(codes)
+        matched = np.isin(deaths["underlying_cause"][rows], codes)
+        if not query_args.get("match_only_underlying_cause"):
+            matched |= np.array(
+                [
+                    any(code in codes for code in causes.split(","))
+                    for causes in deaths["causes_all"][rows]
+                ],
+                dtype=bool,
+            )
+        rows = rows[matched]
+    patients = patients[rows]
+    lower, upper = window_bounds(query_args)
+    lower = _date_of(lower, date_columns, n_patients, index_date)
+    upper = _date_of(upper, date_columns, n_patients, index_date)
+    selected = in_window(
+        deaths["date"][rows], bound_for(lower, patients), bound_for(upper, patients)
+    )
+    # The first death row of each patient, in table order
+    distinct, first = np.unique(patients[selected], return_index=True)
+    death_rows = np.full(n_patients, -1)
+    death_rows[distinct] = rows[selected][first]
+    return death_rows
+
+
+def _death_values(query_args, tables, death_rows):
+    returning = query_args.get("returning", "binary_flag")
+    found = death_rows >= 0
+    if returning == "binary_flag":
+        return found.astype(int)
+    deaths = tables[DEATHS]
+    if returning == "date_of_death":
+        values = np.full(len(death_rows), NAT)
+        values[found] = from_days(deaths["date"][death_rows[found]])
+        return values
+    if returning == "underlying_cause_of_death":
+        values = np.full(len(death_rows), "", dtype=object)
+        values[found] = deaths["underlying_cause"][death_rows[found]]
+        return values
+    raise ValueError(f"Unsupported `returning` value: {returning}")
+
+
+def died_from_any_cause(query_args, tables, patient_ids, date_columns, index_date=None):
+    death_rows = _deaths_in_window(query_args, tables, patient_ids, date_columns, index_date)
+    return _death_values(query_args, tables, death_rows)
+
+
+def with_these_codes_on_death_certificate(
+    query_args, tables, patient_ids, date_columns, index_date=None
+):
+    codelist = query_args["codelist"]
+    codes = [item[0] if codelist.has_categories else item for item in codelist]
+    death_rows = _deaths_in_window(query_args, tables, patient_ids, date_columns, index_date, codes)
+    return _death_values(query_args, tables, death_rows)
+
+
+def _covering(table, patient_ids, dates):
+    """
+    Per-patient row of `table` covering their day number in `dates` (the
+    one that started last when several do), or -1
+    """
+    patients = patient_positions(patient_ids, table["patient_id"])
+    rows = np.flatnonzero(patients >= 0)
+    patients = patients[rows]
+    on = dates[patients]
+    start = table["start_date"][rows]
+    end = table["end_date"][rows]
+    covers = present(on) & present(start) & (start <= on) & (~present(end) | (end > on))
+    rows, patients = rows[covers], patients[covers]
+    # The last row of each patient by start date (then table order)
+    order = np.lexsort((table["start_date"][rows], patients))
+    distinct, last = _last_of_each(patients[order], rows[order])
+    covering = np.full(len(patient_ids), -1)
+    covering[distinct] = last
+    return covering
+
+
+def _last_of_each(patients, values):
+    """The distinct `patients` and the last of `values` of each, in the order given"""
+    distinct, last = np.unique(patients[::-1], return_index=True)
+    return distinct, values[::-1][last]
+
+
+def registered_as_of(query_args, tables, patient_ids, date_columns, index_date=None):
+    n_patients = len(patient_ids)
+    dates = _date_of(query_args["reference_date"], date_columns, n_patients, index_date)
+    return (_covering(tables[REGISTRATIONS], patient_ids, dates) >= 0).astype(int)
+
+
+_PRACTICE_COLUMNS = {
+    "stp_code": "stp_code",
+    "nuts1_region_name": "region",
+    "pseudo_id": "practice_id",
+}
+
+
+def registered_practice_as_of(query_args, tables, patient_ids, date_columns, index_date=None):
+    n_patients = len(patient_ids)
+    returning = query_args["returning"]
+    if returning not in _PRACTICE_COLUMNS:
+        raise ValueError(f"Unsupported `returning` value: {returning}")
+    registrations = tables[REGISTRATIONS]
+    dates = _date_of(query_args["date"], date_columns, n_patients, index_date)
+    covering = _covering(registrations, patient_ids, dates)
+    found = covering >= 0
+    column = registrations[_PRACTICE_COLUMNS[returning]]
+    if returning == "pseudo_id":
+        values = np.zeros(n_patients, dtype=int)
+    else:
+        values = np.full(n_patients, "", dtype=object)
+    values[found] = column[covering[found]]
+    return values
+
+
+def date_deregistered_from_all_supported_practices(
+    query_args, tables, patient_ids, date_columns, index_date=None
+):
+    """The end of a patient's last registration, unless one is still current"""
+    n_patients = len(patient_ids)
+    registrations = tables[REGISTRATIONS]
+    patients = patient_positions(patient_ids, registrations["patient_id"])
+    rows = np.flatnonzero(patients >= 0)
+    patients = patients[rows]
+    end = registrations["end_date"][rows]
+    current = np.zeros(n_patients, dtype=bool)
+    ended = present(end)
+    current[patients[~ended]] = True
+    last_end = np.full(n_patients, MISSING_DAY, dtype=DAY_DTYPE)
+    order = np.argsort(end[ended], kind="stable")
+    distinct, last = _last_of_each(patients[ended][order], end[ended][order])
+    last_end[distinct] = last
+    last_end[current] = MISSING_DAY
+    lower, upper = window_bounds(query_args)
+    lower = _date_of(lower, date_columns, n_patients, index_date)
+    upper = _date_of(upper, date_columns, n_patients, index_date)
+    return np.where(in_window(last_end, lower, upper), from_days(last_end), NAT)
+
+
+def address_as_of(query_args, tables, patient_ids, date_columns, index_date=None):
+    n_patients = len(patient_ids)
+    returning = query_args["returning"]
+    addresses = tables[ADDRESSES]
+    dates = _date_of(query_args["date"], date_columns, n_patients, index_date)
+    covering = _covering(addresses, patient_ids, dates)
+    found = covering >= 0
+    if returning == "index_of_multiple_deprivation":
+        values = np.full(n_patients, -1)
+        imd = addresses["imd"][covering[found]]
+        round_to_nearest = query_args.get("round_to_nearest")
+        if round_to_nearest:
+            imd = np.where(
+                imd >= 0, (np.round(imd / round_to_nearest) * round_to_nearest).astype(int), -1
+            )
+        values[found] = imd
+        return values
+    if returning == "rural_urban_classification":
+        values = np.full(n_patients, -1)
+        values[found] = addresses["rural_urban"][covering[found]]
+        return values
+    if returning == "msoa":
+        values = np.full(n_patients, "", dtype=object)
+        values[found] = addresses["msoa"][covering[found]]
+        return values
+    raise ValueError(f"Unsupported `returning` value: {returning}")
+
+
+def with_ethnicity_from_sus(query_args, tables, patient_ids, date_columns, index_date=None):
+    """The 6 level group of a patient's most frequent SUS ethnic category"""
+    if query_args.get("returning", "group_6") != "group_6":
+        raise ValueError(f"Unsupported `returning` value: {query_args['returning']}")
+    sus = tables[SUS_ETHNICITY]
+    patients = patient_positions(patient_ids, sus["patient_id"])
+    rows = np.flatnonzero(patients >= 0)
+    patients = patients[rows]
+    groups = np.array([ETHNICITY_GROUP_6.get(code, "") for code in sus["code"][rows]], dtype=object)
+    known = groups != ""
+    patients, groups = patients[known], groups[known].astype(str)
+    values = np.full(len(patient_ids), "", dtype=object)
+    if not len(patients):
+        return values
+    # Count each (patient, group); the most frequent (ties: lowest group)
+    # wins
+    pairs, counts = np.unique(
+        np.rec.fromarrays([patients, groups], names="patient,group"), return_counts=True
+    )
+    order = np.lexsort((pairs["group"], -counts, pairs["patient"]))
+    pairs = pairs[order]
+    first = np.ones(len(pairs), dtype=bool)
+    first[1:] = pairs["patient"][1:] != pairs["patient"][:-1]
+    values[pairs["patient"][first]] = pairs["group"][first]
+    return values
+
+
+def most_recent_bmi(query_args, tables, patient_ids, date_columns, index_date=None):
+    """The latest recorded BMI in the window, of patients old enough then"""
+    n_patients = len(patient_ids)
+    events = tables[CODED_EVENTS]
+    rows = np.flatnonzero(
+        (np.asarray(events["code"], dtype=str) == BMI_CODE) & (events["numeric_value"] > 0)
+    )
+    patients = patient_positions(patient_ids, events["patient_id"][rows])
+    known = patients >= 0
+    rows, patients = rows[known], patients[known]
+    dates = events["date"][rows]
+    lower, upper = window_bounds(query_args)
+    lower = _date_of(lower, date_columns, n_patients, index_date)
+    upper = _date_of(upper, date_columns, n_patients, index_date)
+    selected = in_window(dates, bound_for(lower, patients), bound_for(upper, patients))
+    minimum_age = query_args.get("minimum_age_at_measurement")
+    if minimum_age:
+        ages = age_as_of(
+            {"reference_date": "measured"},
+            tables,
+            patient_ids[patients],
+            {"measured": from_days(dates)},
+        )
+        selected &= ages >= int(minimum_age)
+    rows, patients, dates = rows[selected], patients[selected], dates[selected]
+    order = np.lexsort((rows, dates, patients))
+    rows, patients, dates = rows[order], patients[order], dates[order]
+    values = np.zeros(n_patients)
+    if len(rows):
+        count = np.bincount(patients, minlength=n_patients)
+        distinct, starts = np.unique(patients, return_index=True)
+        last = date_run_starts(patients, dates)[starts + count[distinct] - 1]
+        values[distinct] = np.round(events["numeric_value"][rows[last]].astype(float), 1)
+    return values
@@ -0,0 +1,289 @@
+# --- DEPENDENCIES ---
+# The dependency graph of the variables of a study definition.
+#
+# Variables refer to each other only inside strings: date arguments such as
+# `between=["covid_vax_1 + 19 days", ...]` or
+# `on_or_before="covid_test_positive_date - 1 day"`, the expressions of
+# `satisfying`/`categorised_as` (population, vaccination_status, ...), and
+# the column names combined by `minimum_of` or read by `date_of`. These are
+# parsed into an explicit DAG, which is grouped into levels: every variable
+# of a level depends only on variables of earlier levels, so the variables
+# of one level can be evaluated independently of each other. The transitive
+# dependents of a variable are what must be recomputed when it changes.
+
+import re
+
+from cohortextractor.codelistlib import Codelist
+from cohortextractor.date_expressions import DateExpressionEvaluator
+
+# Query arguments which never refer to other variables
+_NON_REFERENCE_ARGUMENTS = {
+    "returning",
+    "return_expectations",
+    "date_format",
+    "include_date_of_match",
+    "include_month",
+    "include_day",
+    "find_first_match_in_period",
+    "find_last_match_in_period",
+    "ignore_missing_values",
+    "aggregate_function",
+    "category_definitions",
+    "hidden",
+}
+
+_KEYWORDS = {"AND", "OR", "NOT", "DEFAULT"}
+
+_STRING_LITERAL = re.compile(r"'[^']*'|\"[^\"]*\"")
+_IDENTIFIER = re.compile(r"\b[A-Za-z_][A-Za-z0-9_]*\b")
+
+
+def expression_references(expression):
+    """
+    Names referred to by a categorised_as/satisfying expression, e.g.
+    "covid_vax_1 AND NOT covid_vax_2" -> ["covid_vax_1", "covid_vax_2"]
+    """
+    expression = _STRING_LITERAL.sub(" ", str(expression))
+    names = []
+    for name in _IDENTIFIER.findall(expression):
+        if name.upper() not in _KEYWORDS and name not in names:
+            names.append(name)
+    return names
+
+
+def date_reference(expression):
+    """
+    The name a date expression is relative to, e.g.
+    "covid_test_positive_date - 1 day" -> "covid_test_positive_date", or None
+    """
+    match = DateExpressionEvaluator.regex.match(str(expression).replace(" ", ""))
+    if not match:
+        return None
+    return match.groupdict()["name"]
+
+
+def _strings(value):
+    # Codelists are never iterated, which would force lazy ones to load
+    if isinstance(value, Codelist):
+        return
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _strings(item)
+
+
+def _is_definition(value):
+    return (
+        isinstance(value, tuple)
+        and len(value) == 2
+        and isinstance(value[0], str)
+        and isinstance(value[1], dict)
+    )
+
+
+def flatten_definitions(covariate_definitions):
+    """
+    Covariate definitions with the inline variables of categorised_as
+    (e.g. `severely_clinically_vulnerable` in the high risk block) hoisted to
+    the top level, as cohortextractor does when processing them
+
+    `date_of(source)` variables become their source's query returning the
+    date of its match, so they depend on what the source depends on.
+    """
+    flat = {}
+
+    def add(name, definition):
+        query_type, query_args = definition
+        inline = {key: value for key, value in query_args.items() if _is_definition(value)}
+        for key, value in inline.items():
+            add(key, value)
+        flat[name] = (
+            query_type,
+            {key: value for key, value in query_args.items() if key not in inline},
+        )
+
+    for name, definition in covariate_definitions.items():
+        add(name, definition)
+    for name, (query_type, query_args) in flat.items():
+        if query_type == "value_from" and query_args["source"] in flat:
+            source_type, source_args = flat[query_args["source"]]
+            flat[name] = (
+                source_type,
+                {
+                    **source_args,
+                    "returning": "date",
+                    "date_format": query_args.get("date_format"),
+                    "include_date_of_match": False,
+                    "hidden": query_args.get("hidden", False),
+                },
+            )
+    return flat
+
+
+def references_of(query_type, query_args):
+    """
+    Every name a variable's definition refers to (other variables, but also
+    "index_date" and anything else a date argument is relative to)
+    """
+    names = []
+    if query_type == "categorised_as":
+        for expression in query_args["category_definitions"].values():
+            names.extend(expression_references(expression))
+    for argument, value in query_args.items():
+        if argument in _NON_REFERENCE_ARGUMENTS:
+            continue
+        for string in _strings(value):
+            name = date_reference(string)
+            if name is not None:
+                names.append(name)
+    return list(dict.fromkeys(names))
+
+
+class VariableGraph:
+    """
+    Dependency DAG of the variables of a study definition
+
+    `dependencies` maps every variable to the variables it refers to directly.
+    Raises ValueError if a satisfying/categorised_as expression refers to an
+    unknown name or if the variables refer to each other in a cycle.
+    """
+
+    def __init__(self, covariate_definitions):
+        self.definitions = flatten_definitions(covariate_definitions)
+        self.dependencies = {}
+        for variable, (query_type, query_args) in self.definitions.items():
+            references = references_of(query_type, query_args)
+            if query_type == "categorised_as":
+                unknown = [
+                    name
+                    for category in query_args["category_definitions"].values()
+                    for name in expression_references(category)
+                    if self._resolve(name) is None
+                ]
+                if unknown:
+                    raise ValueError(f"{variable}: unknown variables {', '.join(unknown)}")
+            # Anything else a date argument is relative to (index_date, an
+            # ISO date, or a value such as test_result="positive") isn't a
+            # variable and is no dependency
+            self.dependencies[variable] = [
+                name
+                for name in dict.fromkeys(self._resolve(reference) for reference in references)
+                if name is not None
+            ]
+        self.dependents = {variable: [] for variable in self.definitions}
+        for variable, dependencies in self.dependencies.items():
+            for dependency in dependencies:
+                self.dependents[dependency].append(variable)
+        self.levels = self._levels()
+
+    @classmethod
+    def from_study(cls, study):
+        return cls(study.covariate_definitions)
+
+    def _resolve(self, name):
+        """
+        The variable a name refers to: the variable of that name, or for
+        `x_date` the variable `x` when it includes the date of its match
+        """
+        if name in self.definitions:
+            return name
+        if name.endswith("_date"):
+            base = self.definitions.get(name[: -len("_date")])
+            if base is not None and base[1].get("include_date_of_match"):
+                return name[: -len("_date")]
+        return None
+
+    def _levels(self):
+        """Variables grouped so each only depends on those of earlier levels"""
+        remaining = {variable: len(dependencies) for variable, dependencies in self.dependencies.items()}
+        level = [variable for variable, count in remaining.items() if count == 0]
+        levels = []
+        while level:
+            levels.append(level)
+            following = []
+            for variable in level:
+                del remaining[variable]
+                for dependent in self.dependents[variable]:
+                    remaining[dependent] -= 1
+                    if remaining[dependent] == 0:
+                        following.append(dependent)
+            level = following
+        if remaining:
+            raise ValueError(f"Variables depend on each other in a cycle: {self._cycle(remaining)}")
+        return levels
+
+    def _cycle(self, variables):
+        """A cycle among `variables` (which all lie on or lead to a cycle)"""
+        path = [next(iter(variables))]
+        while True:
+            following = next(name for name in self.dependencies[path[-1]] if name in variables)
+            if following in path:
+                return " -> ".join(path[path.index(following) :] + [following])
+            path.append(following)
+
+    @property
+    def variables(self):
+        return list(self.definitions)
+
+    def level_of(self, variable):
+        for position, level in enumerate(self.levels):
+            if variable in level:
+                return position
+        raise KeyError(variable)
+
+    def ancestors(self, variables):
+        """Every variable the named variables depend on, directly or not"""
+        return self._closure(variables, self.dependencies)
+
+    def descendants(self, variables):
+        """
+        Every variable depending on the named variables, directly or not,
+        i.e. what must be recomputed when their definitions change
+        """
+        return self._closure(variables, self.dependents)
+
+    def plan(self, variables=None, known=()):
+        """
+        The levels to evaluate for the named variables (default: all), with
+        their dependencies, leaving out those already `known`
+        """
+        if variables is None:
+            needed = set(self.definitions)
+        else:
+            needed = set(variables) | set(self.ancestors(variables))
+        needed -= set(known)
+        levels = [[variable for variable in level if variable in needed] for level in self.levels]
+        return [level for level in levels if level]
+
+    def _closure(self, variables, edges):
+        if isinstance(variables, str):
+            variables = [variables]
+        seen = set()
+        stack = list(variables)
+        while stack:
+            for name in edges[stack.pop()]:
+                if name not in seen:
+                    seen.add(name)
+                    stack.append(name)
+        # In evaluation order
+        return [variable for level in self.levels for variable in level if variable in seen]
+
+    def explain(self):
+        """Human readable dump of the levels and each variable's dependencies"""
+        lines = [f"{len(self.definitions)} variables in {len(self.levels)} levels"]
+        for position, level in enumerate(self.levels):
+            lines.append("")
+            lines.append(f"Level {position} ({len(level)} variables)")
+            for variable in level:
+                query_type = self.definitions[variable][0]
+                dependencies = self.dependencies[variable]
+                line = f"  {variable} [{query_type}]"
+                if dependencies:
+                    line += f" <- {', '.join(dependencies)}"
+                lines.append(line)
+        return "\n".join(lines)
+
+    def summary(self):
+        widths = ", ".join(str(len(level)) for level in self.levels)
+        return f"{len(self.definitions)} variables in {len(self.levels)} levels ({widths})"
@@ -0,0 +1,530 @@
+# --- DUMMY DATA ---
+# Dummy cohorts generated from the variables' return_expectations, as
+# cohortextractor generates them for `--expectations-population`, but a
+# whole column at a time: every variable is a handful of vectorised NumPy
+# draws over all the patients, so millions of rows take seconds rather than
+# the hours of drawing value by value.
+#
+# Each variable's expectations are the study's default_expectations updated
+# with its own return_expectations (the "date" ranges merged key by key),
+# and read as cohortextractor reads them:
+#   - `incidence` is the share of patients with a value (a flag of 1, a
+#     date, a category, a number), the others getting the variable's
+#     missing value (0, NaT, "" or the DEFAULT category); a `rate` of
+#     "universal" gives every patient a value
+#   - dates fall between the `earliest` and `latest` of "date" (either may be
+#     "today" or "index_date"), uniformly or, for a `rate` of
+#     "exponential_increase", more and more often towards `latest`
+#   - "category" draws values in the proportions of its `ratios`
+#   - "int" and "float" draw from a normal `distribution` (`mean`,
+#     `stddev`), or for ints from the ages of the population
+#     ("population_ages")
+# A categorised_as variable without expectations of its categories is
+# evaluated from their expressions, and an aggregate_of (`date_treated`)
+# from its columns, on the dummy values of their dependencies, so variables
+# are generated in the levels of their VariableGraph. That includes every
+# `satisfying` variable (e.g. `pregnancy`, `prev_treated`): cohortextractor
+# fills in category ratios of {1: 1, 0: 0} for them, which would make every
+# patient satisfy them, pregnant men included, so those ratios (and any
+# incidence given with them) are ignored.
+#
+# Values are also drawn conditionally on the dates their window refers to,
+# so rows are ones the backend could return: a window's bounds (`between`,
+# `on_or_after`, `on_or_before`) are evaluated on the dummy dates of the
+# variable's dependencies, and
+#   - a window relative to a missing date, or empty (e.g. covid_vax_2's,
+#     starting 19 days after covid_vax_1, for a first dose less than 19
+#     days before the positive test), matches nothing, so the variable is
+#     missing
+#   - dates fall within their window: between its bounds where it has both
+#     (e.g. the day of covid_hosp_admission_date2, the fortnight of a
+#     treatment), otherwise between its bound and the other end of the
+#     expectations' range
+#
+# With a `population`, cohorts only hold patients in it, as the backend's
+# do: patients are drawn in batches, the population evaluated on each (from
+# its expression, whatever its expectations say) and the others dropped,
+# until there are enough (see `DummyGenerator.sample`). Each batch is as
+# large as the share of patients kept so far says the rest need, so N
+# patients cost about N / share to generate, rather than however many
+# rounds of rejection it takes. To keep that share high, the flags the
+# population ANDs (e.g. `covid_test_positive`, `NOT has_died`), directly
+# or through satisfying variables (`NOT prev_treated`, i.e. none of
+# paxlovid_covid_prev, sotrovimab_covid_prev, ...), are drawn given it:
+# present, or missing, for every patient. Only flags drawn from their
+# incidence alone are, so patients are distributed as they would be by
+# rejection, and the rest of the population (`age >= 18`,
+# `high_risk_group`, a flag's window, ...) is left to the rejection.
+#
+# Large cohorts are generated and written a chunk of patients at a time
+# (see `DummyGenerator.write`), the chunks going through a streaming
+# CohortWriter, so memory doesn't grow with the number of patients. They
+# can also be split into shards of consecutive patients, written by a pool
+# of worker processes (see `DummyGenerator.write_shards`) and concatenated.
+# Each shard draws from its own stream, spawned from the seed with a NumPy
+# SeedSequence, so a cohort only depends on the seed and the number of
+# shards, not on which worker ran first.
+
+import concurrent.futures
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from . import expressions
+from .dates import NAT, evaluate_date_expression, present, to_days, window_bounds
+from .dependencies import VariableGraph
+from .output import CohortWriter
+
+# Patients generated at once when writing a cohort
+CHUNK_SIZE = 100_000
+
+# Patients drawn without finding any in the population before giving up
+_GIVE_UP = 1_000_000
+
+# The category ratios patients.satisfying gives every variable
+_SATISFYING_RATIOS = {1: 1, 0: 0}
+
+# Query types whose value is a date without `returning` saying so
+_DATE_QUERY_TYPES = {"date_deregistered_from_all_supported_practices"}
+
+# How much more often dates fall on `latest` than on `earliest` with an
+# "exponential_increase" rate is e**_GROWTH
+_GROWTH = 3.0
+
+# Share of the population of England in each 5 year age band (0-4 to
+# 100-104), from the ONS mid-2020 population estimates
+_AGE_BANDS = np.array(
+    [5.7, 6.1, 6.0, 5.6, 6.0, 6.7, 6.8, 6.6, 6.2, 6.6, 6.9, 6.6, 5.8, 5.0, 5.0, 3.6, 2.5]
+    + [1.6, 0.7, 0.2, 0.04]
+)
+
+
+# The generator of a worker process
+_worker = {}
+
+
+def _install(generator):
+    _worker["generator"] = generator
+
+
+def _write_installed(seed, arguments):
+    return _worker["generator"].write(rng=np.random.default_rng(seed), **arguments)
+
+
+def shard_sizes(n_patients, shards):
+    """The numbers of patients of `shards` shards, differing by one at most"""
+    return [n_patients // shards + (shard < n_patients % shards) for shard in range(shards)]
+
+
+class DummyGenerator:
+    """
+    Generates dummy columns for the variables of a study definition
+
+    `default_expectations` are the study's, `index_date` resolves the
+    "index_date" of date ranges and `today` (default: the current date)
+    their "today". `population` names the variable selecting the patients
+    of the cohorts written (default: all of them).
+    """
+
+    def __init__(
+        self,
+        covariate_definitions,
+        default_expectations=None,
+        index_date=None,
+        today=None,
+        population=None,
+    ):
+        self.graph = VariableGraph(covariate_definitions)
+        self.default_expectations = dict(default_expectations or {})
+        self.index_date = index_date
+        self.today = np.datetime64(today or "today", "D")
+        self.population = population
+        self.given = self.population_flags() if population else {}
+
+    @classmethod
+    def from_study(cls, study, today=None, population=None):
+        return cls(
+            study.covariate_definitions,
+            getattr(study, "default_expectations", None),
+            study.index_date,
+            today,
+            population,
+        )
+
+    def expectations(self, variable):
+        """A variable's return_expectations, updated from the defaults"""
+        query_args = self.graph.definitions[variable][1]
+        own = query_args.get("return_expectations") or {}
+        expectations = {**self.default_expectations, **own}
+        if "date" in self.default_expectations and "date" in own:
+            expectations["date"] = {**self.default_expectations["date"], **own["date"]}
+        return expectations
+
+    def population_flags(self):
+        """
+        The flags the population requires (True) or excludes (False): those
+        its expression ANDs, bare or negated, which are drawn from their
+        incidence alone, including through the satisfying variables it ANDs
+        (e.g. the paxlovid_covid_prev, sotrovimab_covid_prev, ... of
+        `NOT prev_treated`)
+        """
+        flags = {}
+        self._require(("name", self.population), True, flags)
+        return flags
+
+    def _require(self, node, value, flags):
+        """Add the flags an expression node's being `value` requires to `flags`"""
+        kind = node[0]
+        if kind == "not":
+            self._require(node[1], not value, flags)
+        elif (kind == "and" and value) or (kind == "or" and not value):
+            self._require(node[1], value, flags)
+            self._require(node[2], value, flags)
+        elif kind == "name" and node[1] in self.graph.definitions:
+            variable = node[1]
+            expression = self._satisfying_expression(variable)
+            if expression is not None:
+                self._require(expressions.parse(expression), value, flags)
+            elif self._incidence_flag(variable):
+                flags[variable] = value
+
+    def _satisfying_expression(self, variable):
+        """
+        The expression of an evaluated categorised_as variable which is true
+        exactly when it is, as a satisfying variable's, or None
+        """
+        if not self.evaluated(variable):
+            return None
+        definitions = self.graph.definitions[variable][1]["category_definitions"]
+        included = [
+            (category, expression)
+            for category, expression in definitions.items()
+            if expression != expressions.DEFAULT
+        ]
+        defaults = [
+            category
+            for category, expression in definitions.items()
+            if expression == expressions.DEFAULT
+        ]
+        if len(included) != 1 or not included[0][0] or any(defaults):
+            return None
+        return included[0][1]
+
+    def _incidence_flag(self, variable):
+        """Whether a variable holds a value exactly for the patients its incidence draws"""
+        query_type, query_args = self.graph.definitions[variable]
+        if query_type == "aggregate_of":
+            return False
+        if self.evaluated(variable):
+            return False
+        expectations = self.expectations(variable)
+        if expectations.get("rate") == "universal":
+            return False
+        if any(kind in expectations for kind in ("float", "int", "category")):
+            return False
+        if query_type == "categorised_as":
+            # Its categories must be true, and its DEFAULT false
+            return all(
+                bool(category) == (expression != expressions.DEFAULT)
+                for category, expression in query_args["category_definitions"].items()
+            )
+        return True
+
+    def evaluated(self, variable):
+        """
+        Whether a categorised_as variable is evaluated from its categories'
+        expressions: the population whatever its expectations, others when
+        they have no expectations, or only the category ratios
+        patients.satisfying fills in
+        """
+        query_type, query_args = self.graph.definitions[variable]
+        if query_type != "categorised_as":
+            return False
+        own = query_args.get("return_expectations")
+        if not own or variable == self.population:
+            return True
+        return own.get("category", {}).get("ratios") == _SATISFYING_RATIOS
+
+    def columns(self, n_patients, rng, variables=None):
+        """
+        Dummy columns of the named variables (default: all) and of their
+        dependencies, for `n_patients` patients, drawn from `rng` (a NumPy
+        Generator)
+
+        The population's flags (see `population_flags`) are drawn given it,
+        so patients not in the population are only dropped by `sample`.
+        """
+        columns = {}
+        # Window bounds by date expression, shared by the variables with
+        # the same bound (e.g. the many ending on covid_test_positive_date)
+        bounds = {}
+        for level in self.graph.plan(variables):
+            for variable in level:
+                columns[variable] = self.column(variable, columns, n_patients, rng, bounds)
+        return columns
+
+    def sample(self, n_patients, rng, variables=None, tally=None):
+        """
+        Dummy columns of the named variables (default: all) for `n_patients`
+        patients in the population (any patients, without one), drawn from
+        `rng`
+
+        Patients are drawn in batches as large as the share of patients in
+        the population so far says the rest need (plus a little slack), the
+        others dropped. `tally` optionally holds the numbers of patients
+        "drawn" and "kept" so far, e.g. by the chunks before, and is updated.
+        """
+        if self.population is None:
+            return self.columns(n_patients, rng, variables)
+        variables = list(self.graph.definitions if variables is None else variables)
+        tally = {} if tally is None else tally
+        batches = []
+        kept = 0
+        while kept < n_patients:
+            drawn_so_far = tally.get("drawn", 0)
+            if drawn_so_far >= _GIVE_UP and not tally.get("kept"):
+                raise ValueError(f"No dummy patient in the population ({drawn_so_far} drawn)")
+            share = (tally.get("kept", 0) + 1) / (drawn_so_far + 1)
+            size = int(np.ceil((n_patients - kept) / share * 1.02)) + 8
+            size = min(size, 4 * max(n_patients, CHUNK_SIZE))
+            columns = self.columns(size, rng, variables + [self.population])
+            selected = expressions.truth(columns[self.population])
+            n_selected = int(np.count_nonzero(selected))
+            tally["drawn"] = drawn_so_far + size
+            tally["kept"] = tally.get("kept", 0) + n_selected
+            batches.append({variable: columns[variable][selected] for variable in variables})
+            kept += n_selected
+        if len(batches) == 1:
+            return {variable: values[:n_patients] for variable, values in batches[0].items()}
+        return {
+            variable: np.concatenate([batch[variable] for batch in batches])[:n_patients]
+            for variable in variables
+        }
+
+    def write(
+        self,
+        path,
+        n_patients,
+        rng,
+        variables,
+        chunk_size=CHUNK_SIZE,
+        compresslevel=1,
+        first_id=1,
+        header=True,
+    ):
+        """
+        Write a dummy cohort of `n_patients` patients (with ids from
+        `first_id`) in the population and the named variables to `path`, a
+        chunk of patients at a time
+
+        Dummy cohorts are regenerated at will, so they are compressed for
+        speed rather than size.
+        """
+        date_formats = {
+            variable: query_args.get("date_format")
+            for variable, (_, query_args) in self.graph.definitions.items()
+        }
+        # Shares of patients in the population, carried from chunk to chunk
+        tally = {}
+        with CohortWriter(path, variables, date_formats, compresslevel, header) as writer:
+            for start in range(0, n_patients, chunk_size):
+                size = min(chunk_size, n_patients - start)
+                columns = self.sample(size, rng, variables, tally)
+                writer.write(np.arange(first_id + start, first_id + start + size), columns)
+        return writer.rows
+
+    def write_shards(
+        self, path, n_patients, seed, variables, shards, chunk_size=CHUNK_SIZE, compresslevel=1
+    ):
+        """
+        Write a dummy cohort as `write` does, as `shards` shards of
+        consecutive patients written in parallel (one worker process per
+        shard) and concatenated
+
+        Shard i draws from the i-th stream spawned from `seed`, so the same
+        seed and number of shards always give the same file.
+        """
+        if shards < 1:
+            raise ValueError(f"At least one shard is needed, not {shards}")
+        seeds = np.random.SeedSequence(seed).spawn(shards)
+        sizes = shard_sizes(n_patients, shards)
+        first_ids = np.cumsum([1] + sizes[:-1]).tolist()
+        directory = os.path.dirname(os.path.abspath(path))
+        with tempfile.TemporaryDirectory(dir=directory) as shards_directory:
+            paths = [
+                os.path.join(shards_directory, f"{shard}-{os.path.basename(path)}")
+                for shard in range(shards)
+            ]
+            arguments = [
+                {
+                    "path": paths[shard],
+                    "n_patients": sizes[shard],
+                    "variables": variables,
+                    "chunk_size": chunk_size,
+                    "compresslevel": compresslevel,
+                    "first_id": first_ids[shard],
+                    "header": shard == 0,
+                }
+                for shard in range(shards)
+            ]
+            if shards <= 1:
+                rows = [self.write(rng=np.random.default_rng(seeds[0]), **arguments[0])]
+            else:
+                with concurrent.futures.ProcessPoolExecutor(
+                    shards, initializer=_install, initargs=(self,)
+                ) as executor:
+                    rows = list(executor.map(_write_installed, seeds, arguments))
+            with open(path, "wb") as f:
+                for shard_path in paths:
+                    with open(shard_path, "rb") as shard:
+                        shutil.copyfileobj(shard, f)
+        return sum(rows)
+
+    def column(self, variable, columns, n_patients, rng, bounds=None):
+        """
+        A variable's dummy column, given those of its dependencies (and
+        optionally a dict of the window bounds evaluated on them so far)
+        """
+        bounds = {} if bounds is None else bounds
+        query_type, query_args = self.graph.definitions[variable]
+        if query_type == "aggregate_of":
+            aggregate = np.fmin if query_args["aggregate_function"] == "MIN" else np.fmax
+            return aggregate.reduce([columns[name] for name in query_args["column_names"]])
+        if self.evaluated(variable):
+            return expressions.categorise(query_args["category_definitions"], columns, n_patients)
+
+        expectations = self.expectations(variable)
+        if variable in self.given:
+            found = np.full(n_patients, self.given[variable])
+        elif expectations.get("rate") == "universal":
+            found = np.ones(n_patients, dtype=bool)
+        else:
+            found = _uniform(n_patients, rng) < expectations.get("incidence", 1.0)
+        for bound in window_bounds(query_args):
+            if bound is not None and bound not in bounds:
+                bounds[bound] = evaluate_date_expression(
+                    bound, columns, n_patients, self.index_date
+                )
+        lower, upper = (bounds.get(bound) for bound in window_bounds(query_args))
+        for bound in (lower, upper):
+            if bound is not None:
+                found &= present(bound)
+        if lower is not None and upper is not None:
+            found &= lower <= upper
+        if "float" in expectations:
+            values = np.round(_normal(expectations["float"], n_patients, rng), 1)
+            return np.where(found, values, 0.0)
+        if "int" in expectations:
+            if expectations["int"].get("distribution") == "population_ages":
+                values = _population_ages(n_patients, rng)
+            else:
+                values = np.round(_normal(expectations["int"], n_patients, rng)).astype(int)
+            return np.where(found, values, 0)
+        if "category" in expectations:
+            return _categories(expectations["category"]["ratios"], found, rng)
+        if query_type == "categorised_as":
+            return _flag_categories(query_args["category_definitions"], found, rng)
+        returning = query_args.get("returning", "binary_flag")
+        if returning.startswith("date") or query_type in _DATE_QUERY_TYPES:
+            days = self._days(expectations, lower, upper, n_patients, rng)
+            dates = days.astype("datetime64[D]")
+            dates[~found] = NAT
+            return dates
+        return found.astype(int)
+
+    def _days(self, expectations, lower, upper, n_patients, rng):
+        """
+        Day numbers within a variable's window (whose `lower` and `upper`
+        bounds are day numbers, or None) and the expectations' date range,
+        at their rate
+        """
+        date_range = expectations.get("date", {})
+        earliest = to_days(self._date(date_range.get("earliest", "1900-01-01")))
+        latest = to_days(self._date(date_range.get("latest", "today")))
+        if lower is not None:
+            earliest = lower
+            latest = np.maximum(latest, lower)
+        if upper is not None:
+            latest = upper
+            if lower is None:
+                earliest = np.minimum(earliest, upper)
+        earliest = np.asarray(earliest, dtype=np.int64)
+        span = np.maximum(np.asarray(latest, dtype=np.int64) - earliest, 0)
+        if expectations.get("rate") == "exponential_increase":
+            # Inverse of the CDF of a density growing as e**(_GROWTH * x / span)
+            offsets = np.log1p(_uniform(n_patients, rng) * np.expm1(_GROWTH)) / _GROWTH * span
+            return earliest + np.floor(offsets).astype(np.int64)
+        # Scaled uniform draws: much faster than integers() with per-patient spans
+        offsets = np.floor(rng.random(n_patients) * (span + 1)).astype(np.int64)
+        return earliest + np.minimum(offsets, span)
+
+    def _date(self, expression):
+        if expression == "today":
+            return self.today
+        if expression == "index_date":
+            if self.index_date is None:
+                raise ValueError("index_date not defined")
+            return np.datetime64(self.index_date, "D")
+        return np.datetime64(expression, "D")
+
+
+def _uniform(n_patients, rng):
+    """Uniform draws in [0, 1), in single precision, which is plenty for ratios and twice as fast"""
+    return rng.random(n_patients, dtype=np.float32)
+
+
+def _normal(expectation, n_patients, rng):
+    if expectation.get("distribution", "normal") != "normal":
+        raise ValueError(f"Unsupported distribution: {expectation['distribution']}")
+    return rng.normal(expectation.get("mean", 0.0), expectation.get("stddev", 1.0), n_patients)
+
+
+def _population_ages(n_patients, rng):
+    """Ages drawn from the population's 5 year age bands"""
+    weights = np.cumsum(_AGE_BANDS / _AGE_BANDS.sum()).astype(np.float32)
+    bands = np.minimum(np.searchsorted(weights, _uniform(n_patients, rng)), len(weights) - 1)
+    return bands * 5 + rng.integers(0, 5, n_patients)
+
+
+def _categories(ratios, found, rng):
+    """
+    Categories drawn in the proportions of `ratios` for the patients
+    `found`, "" (0 for integer categories) for the others
+    """
+    categories = list(ratios)
+    positions = np.zeros(len(found), dtype=np.intp)
+    if len(categories) > 1:
+        weights = np.cumsum(np.array([ratios[category] for category in categories], dtype=float))
+        weights = (weights / weights[-1]).astype(np.float32)
+        positions = np.searchsorted(weights, _uniform(len(found), rng), side="right")
+        positions = np.minimum(positions, len(categories) - 1)
+    # Missing values take the extra last position
+    positions[~found] = len(categories)
+    if all(isinstance(category, (int, np.integer)) for category in categories):
+        return np.array(categories + [0], dtype=int)[positions]
+    return np.array([str(category) for category in categories] + [""], dtype=object)[positions]
+
+
+def _flag_categories(category_definitions, found, rng):
+    """
+    Categories of a categorised_as variable with an incidence only: one of
+    its (non DEFAULT) categories, at random, for the patients `found`, its
+    DEFAULT category for the others
+    """
+    ratios = {
+        category: 1.0
+        for category, expression in category_definitions.items()
+        if expression != expressions.DEFAULT
+    }
+    defaults = [
+        category
+        for category, expression in category_definitions.items()
+        if expression == expressions.DEFAULT
+    ]
+    values = _categories(ratios, found, rng)
+    if defaults:
+        default = defaults[0] if values.dtype.kind == "i" else str(defaults[0])
+        values[~found] = default
+    return values
@@ -0,0 +1,172 @@
+# --- EVALUATOR ---
+# Evaluation of variables from local TPP-like tables, for StudyBatch (see
+# studies.py).
+#
+# Each query type is evaluated by the engine of its family. A StudyBatch
+# runs the variables of one level and query type, from several study
+# definitions, as one group, so their shared tables are scanned once. Every
+# variable of a group brings its own input columns, so variables of
+# different studies (with different index dates) can share a scan. The
+# patient level query types (see demographics.py) read small tables and are
+# evaluated one variable at a time. Query types without a local engine
+# raise NotImplementedError.
+
+import numpy as np
+
+from . import (
+    clinical_events,
+    demographics,
+    expressions,
+    hospital_admissions,
+    sgss,
+    therapeutics,
+    vaccinations,
+)
+from .codelist_dates import CodelistDates
+
+
+class VariableEvaluator:
+    """
+    Evaluates variables one at a time or in groups of one query type
+
+    `tables` maps TPP table names to local tables (dicts of NumPy columns)
+    and `patient_ids` is the sorted array of patient ids every column is
+    aligned on. Clinical events and medications variables answered by the
+    earliest or latest matching day of their codelist are read from
+    `codelist_dates` (see codelist_dates.py), which is filled as codelists
+    are indexed; by default, a new CodelistDates shared by every group.
+    """
+
+    def __init__(self, tables, patient_ids, index_date=None, codelist_dates=None):
+        self.tables = tables
+        self.patient_ids = patient_ids
+        self.index_date = index_date
+        if codelist_dates is None:
+            codelist_dates = CodelistDates(len(patient_ids))
+        self.codelist_dates = codelist_dates
+        # SpellIndexes of APCS by patient classification, built by the first
+        # group of admitted_to_hospital variables that needs them
+        self.spell_indexes = {}
+
+    def __call__(self, variable, query_type, query_args, columns):
+        return self.evaluate_group(query_type, {variable: (query_args, columns)})[variable]
+
+    def evaluate_group(self, query_type, variables, index_dates=None):
+        """
+        Evaluate variables of one query type together
+
+        `variables` maps keys (variable names, or any hashable such as
+        (study, variable)) to (query_args, columns), where `columns` holds
+        the columns the variable refers to. `index_dates` optionally maps
+        keys to their own index date (default: the evaluator's). Returns a
+        column per key.
+        """
+        index_dates = {key: (index_dates or {}).get(key, self.index_date) for key in variables}
+        if query_type in demographics.QUERY_TYPES:
+            return self.demographics(query_type, variables, index_dates)
+        try:
+            method = getattr(self, _METHODS[query_type])
+        except KeyError:
+            names = ", ".join(map(str, variables))
+            raise NotImplementedError(f"{names}: {query_type} can't be evaluated locally")
+        return method(variables, index_dates)
+
+    def clinical_events(self, variables, index_dates, event_tables=clinical_events.EVENT_TABLES):
+        classifier = clinical_events.ClinicalEventsClassifier(
+            {key: query_args for key, (query_args, _) in variables.items()}, event_tables
+        )
+        n_patients = len(self.patient_ids)
+        # Variables (of any study) with the same bound of the same column
+        # share its evaluation and its searches
+        bounds = {}
+        windows = {
+            key: clinical_events.window_of(
+                query_args, columns, n_patients, index_dates[key], bounds
+            )
+            for key, (query_args, columns) in variables.items()
+        }
+        return classifier.values(self.tables, self.patient_ids, windows, self.codelist_dates)
+
+    def medications(self, variables, index_dates):
+        return self.clinical_events(variables, index_dates, clinical_events.MEDICATION_TABLES)
+
+    def test_result_in_sgss(self, variables, index_dates):
+        engine = sgss.SGSSEngine({key: query_args for key, (query_args, _) in variables.items()})
+        indexes = engine.index(self.tables, self.patient_ids)
+        return {
+            key: engine.column(key, indexes, columns, len(self.patient_ids), index_dates[key])
+            for key, (_, columns) in variables.items()
+        }
+
+    def covid_therapeutics(self, variables, index_dates):
+        extractor = therapeutics.TherapeuticsExtractor(
+            {key: query_args for key, (query_args, _) in variables.items()}
+        )
+        table = self.tables[therapeutics.THERAPEUTICS]
+        scanned = extractor.scan(table, self.patient_ids)
+        return {
+            key: extractor.column(
+                key, table, scanned, columns, len(self.patient_ids), index_dates[key]
+            )
+            for key, (_, columns) in variables.items()
+        }
+
+    def admitted_to_hospital(self, variables, index_dates):
+        engine = hospital_admissions.AdmissionsEngine(
+            {key: query_args for key, (query_args, _) in variables.items()}
+        )
+        apcs = self.tables[hospital_admissions.APCS]
+        spells = engine.spells(apcs, self.patient_ids, self.spell_indexes)
+        return {
+            key: engine.column(key, spells, columns, len(self.patient_ids), index_dates[key])
+            for key, (_, columns) in variables.items()
+        }
+
+    def vaccination_record(self, variables, index_dates):
+        engine = vaccinations.VaccinationsEngine(
+            {key: query_args for key, (query_args, _) in variables.items()}
+        )
+        table = self.tables[vaccinations.VACCINATIONS]
+        scanned = engine.scan(table, self.patient_ids)
+        return {
+            key: engine.column(
+                key, table, scanned, columns, len(self.patient_ids), index_dates[key]
+            )
+            for key, (_, columns) in variables.items()
+        }
+
+    def demographics(self, query_type, variables, index_dates):
+        evaluate = getattr(demographics, query_type)
+        return {
+            key: evaluate(query_args, self.tables, self.patient_ids, columns, index_dates[key])
+            for key, (query_args, columns) in variables.items()
+        }
+
+    def categorised_as(self, variables, index_dates):
+        return {
+            key: expressions.categorise(
+                query_args["category_definitions"], columns, len(self.patient_ids)
+            )
+            for key, (query_args, columns) in variables.items()
+        }
+
+    def aggregate_of(self, variables, index_dates):
+        values = {}
+        for key, (query_args, columns) in variables.items():
+            aggregate = np.fmin if query_args["aggregate_function"] == "MIN" else np.fmax
+            values[key] = aggregate.reduce([columns[name] for name in query_args["column_names"]])
+        return values
+
+
+_METHODS = {
+    clinical_events.QUERY_TYPE: "clinical_events",
+    clinical_events.MEDICATIONS_QUERY_TYPE: "medications",
+    sgss.QUERY_TYPE: "test_result_in_sgss",
+    therapeutics.QUERY_TYPE: "covid_therapeutics",
+    hospital_admissions.QUERY_TYPE: "admitted_to_hospital",
+    vaccinations.QUERY_TYPE: "vaccination_record",
+    "categorised_as": "categorised_as",
+    "aggregate_of": "aggregate_of",
+}
+
+QUERY_TYPES = tuple(_METHODS) + demographics.QUERY_TYPES
@@ -0,0 +1,146 @@
+# --- EVENT INDEX ---
+# Per-patient index of events for windowed first/last/count queries.
+#
+# Events are sorted by (patient, date, row) once, in CSR layout: the events
+# of the patient at position p are events[offsets[p]:offsets[p + 1]], in
+# date order (events without a date first). Each event also gets an int64
+# key combining its patient and day number (see dates.py), which increases
+# along the sorted events, so the ends of every patient's window
+# [lower, upper] are found with two vectorised `searchsorted` calls over
+# the keys, in O(n_patients * log(n_events)). The first and last matches
+# and the count follow from those ends, without filtering the events
+# again. As in the backend, events without a date match when there is no
+# window at all, and never once a bound applies; the last match is the
+# first event (in table order) of the latest day, as `ORDER BY
+# ConsultationDate DESC, id` picks it. Built once per codelist, an index answers
+# any number of windows (e.g. the same codelist relative to each period's
+# covid_test_positive_date) in time independent of the size of the table.
+# Searches are kept per bound array, so windows sharing a bound (e.g. the
+# 3 and 12 month look-back counts of a medication, both ending on the
+# positive test date) search for it once.
+
+import numpy as np
+
+from .dates import DAY_DTYPE, MISSING_DAY, present
+
+# Days are offset into [0, _DAY_SPAN) before combining with the patient
+_DAY_OFFSET = 2**20
+_DAY_SPAN = 2**21
+
+
+class EventIndex:
+    """
+    Events sorted by patient and date with per-patient offsets
+
+    `patients` are the positions (in the sorted patient ids) of each event's
+    patient, `days` their dates as day numbers and `rows` the events' rows in
+    their table (MISSING_DAY for events without a date); `source` holds the
+    position of each indexed event in the arrays it was built from.
+    """
+
+    def __init__(self, patients, days, rows, n_patients):
+        order = np.lexsort((rows, days, patients))
+        self.source = order
+        self.patients = patients[order]
+        self.days = days[order]
+        self.rows = rows[order]
+        self.n_patients = n_patients
+        self.offsets = np.zeros(n_patients + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.patients, minlength=n_patients), out=self.offsets[1:])
+        self.keys = self._keys(self.patients, self.days)
+        self._searches = {}
+
+    @staticmethod
+    def _keys(patients, days):
+        # Events without a date (MISSING_DAY) come before every day, at 0
+        days = np.clip(days.astype(np.int64) + _DAY_OFFSET, 0, _DAY_SPAN - 1)
+        return patients.astype(np.int64) * _DAY_SPAN + days
+
+    def __len__(self):
+        return len(self.rows)
+
+    def subset(self, mask):
+        """The index of the events selected by `mask` (over the sorted events)"""
+        index = EventIndex.__new__(EventIndex)
+        index.source = self.source[mask]
+        index.patients = self.patients[mask]
+        index.days = self.days[mask]
+        index.rows = self.rows[mask]
+        index.n_patients = self.n_patients
+        index.offsets = np.zeros(self.n_patients + 1, dtype=np.int64)
+        np.cumsum(np.bincount(index.patients, minlength=self.n_patients), out=index.offsets[1:])
+        index.keys = self.keys[mask]
+        index._searches = {}
+        return index
+
+    def window(self, lower=None, upper=None):
+        """
+        Per-patient (start, end) positions of the events within the inclusive
+        window [lower, upper] of day numbers, where either bound may be None
+        (open-ended), one day or a per-patient array. A missing bound matches
+        nothing. Events without a date only fall within a window without
+        either bound.
+        """
+        start = self.offsets[:-1]
+        end = self.offsets[1:]
+        empty = np.zeros(self.n_patients, dtype=bool)
+        if lower is not None:
+            start, missing = self._search(lower, "left")
+            empty = empty | missing
+        elif upper is not None:
+            start = self._dated_starts()
+        if upper is not None:
+            end, missing = self._search(upper, "right")
+            empty = empty | missing
+        # A missing bound is clipped to day 0 of the patient, keep it from
+        # matching anything, as empty windows (lower > upper) don't either
+        end = np.where(empty, start, np.maximum(end, start))
+        return start, end
+
+    def _search(self, bound, side):
+        """
+        Positions of a bound's day for every patient, and which patients'
+        bound is missing; searched once per bound array
+        """
+        key = (id(bound), side)
+        if key not in self._searches:
+            days = np.broadcast_to(bound, (self.n_patients,))
+            patients = np.arange(self.n_patients, dtype=np.int64)
+            positions = np.searchsorted(self.keys, self._keys(patients, days), side)
+            # The bound is kept so its id isn't reused while cached
+            self._searches[key] = (bound, positions, ~present(days))
+        _, positions, missing = self._searches[key]
+        return positions, missing
+
+    def _dated_starts(self):
+        """Position of every patient's first event with a date"""
+        if "dated" not in self._searches:
+            patients = np.arange(self.n_patients, dtype=np.int64)
+            self._searches["dated"] = np.searchsorted(self.keys, patients * _DAY_SPAN + 1)
+        return self._searches["dated"]
+
+    def first_last_count(self, start, end):
+        """
+        For every patient, the rows of their first and last events between
+        `start` and `end` (see `window`), or -1, and their number
+        """
+        count = end - start
+        found = count > 0
+        first = np.full(self.n_patients, -1)
+        last = np.full(self.n_patients, -1)
+        first[found] = self.rows[start[found]]
+        # The first event of the last day (windows start on a day boundary,
+        # so its run starts within the window)
+        last_keys = self.keys[end[found] - 1]
+        last[found] = self.rows[np.searchsorted(self.keys, last_keys, "left")]
+        return first, last, count
+
+    def first_last_days(self):
+        """Every patient's earliest and latest day (of events with a date), or MISSING_DAY"""
+        start = self._dated_starts()
+        found = self.offsets[1:] > start
+        earliest = np.full(self.n_patients, MISSING_DAY, dtype=DAY_DTYPE)
+        latest = np.full(self.n_patients, MISSING_DAY, dtype=DAY_DTYPE)
+        earliest[found] = self.days[start[found]]
+        latest[found] = self.days[self.offsets[1:][found] - 1]
+        return earliest, latest
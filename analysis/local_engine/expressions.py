@@ -0,0 +1,303 @@
+# --- EXPRESSIONS ---
+# Evaluation of the `categorised_as`/`satisfying` expressions of a study
+# definition (population, vaccination_status, imdQ5, ...).
+#
+# An expression such as "age >= 18 AND NOT has_died AND sex = 'F'" is
+# parsed once into a small AST, which is evaluated as NumPy operations over
+# whole columns: a handful of vectorised comparisons and boolean operations
+# whatever the number of patients. A categorised_as variable is an ordered
+# `np.select` of its categories' conditions, with the DEFAULT category (if
+# any) as its default. Parsing is memoised on the expression's text, so
+# the same expression evaluated for every study, chunk or category (e.g.
+# `NOT ethnicity_primis`) is only parsed the first time.
+#
+# As in the backend's SQL:
+#   - a column used as a condition is true when it holds a value: a
+#     non-zero number, a non-empty string or a date
+#   - comparisons with a missing date (NaT) are false
+#   - dates compare with 'YYYY-MM-DD' strings
+#   - dividing integers truncates (e.g. "imd < 32800*1/5")
+
+import functools
+import operator
+import re
+
+import numpy as np
+
+from .dependencies import expression_references
+
+DEFAULT = "DEFAULT"
+
+_TOKEN = re.compile(
+    r"""\s*(?:
+        (?P<string>'[^']*'|"[^"]*")
+        | (?P<number>\d+(?:\.\d+)?)
+        | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+        | (?P<operator><=|>=|!=|<>|=|<|>|\(|\)|\*|/|\+|-)
+    )""",
+    re.VERBOSE,
+)
+
+_COMPARISONS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<>": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+_ARITHMETIC = {"+": operator.add, "-": operator.sub, "*": operator.mul, "/": operator.truediv}
+
+
+def tokenize(expression):
+    """(kind, token) pairs of an expression; AND/OR/NOT are upper-cased keywords"""
+    tokens = []
+    position = 0
+    expression = str(expression).rstrip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if not match or match.end() == position:
+            raise ValueError(f"Can't parse expression at {expression[position:]!r}: {expression}")
+        position = match.end()
+        kind = match.lastgroup
+        token = match.group(kind)
+        if kind == "name" and token.upper() in ("AND", "OR", "NOT"):
+            kind, token = "keyword", token.upper()
+        tokens.append((kind, token))
+    return tokens
+
+
+class _Parser:
+    """
+    Recursive descent parser of an expression into nested tuples:
+    ("name", name), ("number", value), ("string", value), ("not", node),
+    ("and"/"or", left, right), ("compare"/"arithmetic", operator, left,
+    right) and ("negate", node)
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = tokenize(expression)
+        self.position = 0
+
+    def parse(self):
+        node = self.disjunction()
+        if self.position < len(self.tokens):
+            self.error()
+        return node
+
+    def error(self):
+        found = self.tokens[self.position][1] if self.position < len(self.tokens) else "end"
+        raise ValueError(f"Unexpected {found!r} in expression: {self.expression}")
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position][1]
+        return None
+
+    def take(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def disjunction(self):
+        node = self.conjunction()
+        while self.peek() == "OR":
+            self.take()
+            node = ("or", node, self.conjunction())
+        return node
+
+    def conjunction(self):
+        node = self.negation()
+        while self.peek() == "AND":
+            self.take()
+            node = ("and", node, self.negation())
+        return node
+
+    def negation(self):
+        if self.peek() == "NOT":
+            self.take()
+            return ("not", self.negation())
+        return self.comparison()
+
+    def comparison(self):
+        node = self.sum()
+        if self.peek() in _COMPARISONS:
+            return ("compare", self.take()[1], node, self.sum())
+        return node
+
+    def sum(self):
+        node = self.product()
+        while self.peek() in ("+", "-"):
+            node = ("arithmetic", self.take()[1], node, self.product())
+        return node
+
+    def product(self):
+        node = self.unary()
+        while self.peek() in ("*", "/"):
+            node = ("arithmetic", self.take()[1], node, self.unary())
+        return node
+
+    def unary(self):
+        if self.peek() == "-":
+            self.take()
+            return ("negate", self.unary())
+        return self.atom()
+
+    def atom(self):
+        if self.position >= len(self.tokens):
+            self.error()
+        kind, token = self.take()
+        if kind == "name":
+            return ("name", token)
+        if kind == "number":
+            return ("number", float(token) if "." in token else int(token))
+        if kind == "string":
+            return ("string", token[1:-1])
+        if token == "(":
+            node = self.disjunction()
+            if self.peek() != ")":
+                self.error()
+            self.take()
+            return node
+        self.position -= 1
+        self.error()
+
+
+@functools.lru_cache(maxsize=None)
+def parse(expression):
+    """The tree of an expression, parsed once however often it's evaluated"""
+    return _Parser(expression).parse()
+
+
+def truth(values):
+    """Whether each value counts as true when used as a condition"""
+    values = np.asarray(values)
+    if values.dtype.kind == "b":
+        return values
+    if values.dtype.kind == "M":
+        return ~np.isnat(values)
+    if values.dtype.kind == "f":
+        return (values != 0) & ~np.isnan(values)
+    if values.dtype.kind in "iu":
+        return values != 0
+    # Strings: "" and None are false
+    return values.astype(bool)
+
+
+def _is_dates(values):
+    return isinstance(values, np.ndarray) and values.dtype.kind == "M"
+
+
+def _compare(op, left, right):
+    if _is_dates(left) or _is_dates(right):
+        left, right = (
+            value if _is_dates(value) else np.asarray(value, dtype="datetime64[D]")
+            for value in (left, right)
+        )
+        return _COMPARISONS[op](left, right) & ~np.isnat(left) & ~np.isnat(right)
+    return np.asarray(_COMPARISONS[op](left, right), dtype=bool)
+
+
+def _arithmetic(op, left, right):
+    if op == "/" and all(np.asarray(value).dtype.kind in "iub" for value in (left, right)):
+        # Integer division truncates towards zero
+        return np.trunc(np.divide(left, right)).astype(np.int64)
+    return _ARITHMETIC[op](left, right)
+
+
+def _values(node, columns, cache):
+    """The value of a node: a column, a scalar or a boolean mask"""
+    kind = node[0]
+    if kind == "name":
+        return np.asarray(columns[node[1]])
+    if kind in ("number", "string"):
+        return node[1]
+    if kind == "negate":
+        return -_values(node[1], columns, cache)
+    if kind == "arithmetic":
+        return _arithmetic(
+            node[1], _values(node[2], columns, cache), _values(node[3], columns, cache)
+        )
+    return _condition(node, columns, cache)
+
+
+def _condition(node, columns, cache):
+    """
+    The boolean mask (or boolean scalar) of a node used as a condition
+
+    Nodes are tuples, so equal subexpressions (such as the
+    `NOT ethnicity_primis` of every ethnicity category) share their entry
+    in `cache` and are evaluated once.
+    """
+    if node in cache:
+        return cache[node]
+    kind = node[0]
+    if kind == "and":
+        mask = _condition(node[1], columns, cache) & _condition(node[2], columns, cache)
+    elif kind == "or":
+        mask = _condition(node[1], columns, cache) | _condition(node[2], columns, cache)
+    elif kind == "not":
+        mask = ~_condition(node[1], columns, cache)
+    elif kind == "compare":
+        mask = _compare(
+            node[1], _values(node[2], columns, cache), _values(node[3], columns, cache)
+        )
+    else:
+        mask = truth(_values(node, columns, cache))
+    cache[node] = mask
+    return mask
+
+
+class CompiledExpression:
+    """An expression parsed once, for evaluation on whole columns"""
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.names = expression_references(expression)
+        self.tree = parse(expression)
+
+    def evaluate(self, columns, n_patients, cache=None):
+        """
+        Per-patient truth values of the expression
+
+        `cache` optionally holds the masks of subexpressions already
+        evaluated on the same `columns`, e.g. by other categories.
+        """
+        mask = _condition(self.tree, columns, {} if cache is None else cache)
+        return np.broadcast_to(mask, (n_patients,))
+
+
+@functools.lru_cache(maxsize=None)
+def compile_expression(expression):
+    """The CompiledExpression of an expression, compiled once per expression"""
+    return CompiledExpression(expression)
+
+
+def categorise(category_definitions, columns, n_patients):
+    """
+    Each patient's category: the first whose expression they satisfy (in
+    definition order), otherwise the DEFAULT category ("" if none)
+    """
+    categories = [
+        category for category, expression in category_definitions.items() if expression != DEFAULT
+    ]
+    defaults = [
+        category for category, expression in category_definitions.items() if expression == DEFAULT
+    ]
+    cache = {}
+    conditions = [
+        compile_expression(category_definitions[category]).evaluate(columns, n_patients, cache)
+        for category in categories
+    ]
+    # Categories are selected by position (np.select needs a condition), so
+    # string categories stay Python strings
+    positions = np.full(n_patients, len(categories))
+    if conditions:
+        positions = np.select(conditions, np.arange(len(categories)), len(categories))
+    if all(isinstance(category, (int, np.integer)) for category in category_definitions):
+        return np.array(categories + [defaults[0] if defaults else 0], dtype=int)[positions]
+    labels = [str(category) for category in categories]
+    labels.append(str(defaults[0]) if defaults else "")
+    return np.array(labels, dtype=object)[positions]
@@ -0,0 +1,388 @@
+# --- HOSPITAL ADMISSIONS ---
+# Evaluation of `admitted_to_hospital` variables.
+#
+# study_definition.py extracts the outcome admissions as many one-day windows
+# relative to the positive test (`{prefix}_hosp_admission_date{day}` and
+# `allcause_hosp_admission_diagnosis{day}`), plus a day 7-27 window and the
+# discharge within 7 days of a day 0 admission. AdmissionsEngine evaluates
+# them from SpellIndexes: the spells of each patient classification used
+# (almost always ["1"], ordinary admissions, excluding day cases and regular
+# attenders) pre-filtered and sorted once per evaluation, carrying their
+# admission and discharge dates, primary diagnosis and admission method,
+# and pointing into diagnosis and procedure codes split once per column.
+# Every diagnosis and procedure codelist is matched once, however many
+# variables use it, and every variable is reduced from its own mask of
+# spells, keeping its own name, so the output has exactly the columns
+# data_process.R reads.
+#
+# Variables whose window is a fixed number of days from a date column (the
+# one-day windows, day 7-27 and the discharge within 7 days of admission)
+# are day-bucketed: the spells admitted within the span of all such windows
+# of the group are selected once per column, with their day offset from it
+# (DayBuckets), and each variable only tests the offsets of those few spells.
+#
+# Values follow the TPP backend's SQL: diagnoses and procedures match the
+# codes of Der_Diagnosis_All/Der_Procedure_All that follow a separator (see
+# codelist_matching.separated_codes), windows apply to the admission date,
+# `date_admitted`/`date_discharged` are the MIN (with find_first_match_in_period)
+# or MAX over the matching spells, and `primary_diagnosis` is taken from the
+# first (or last) matching spell ordered by admission date.
+
+import numpy as np
+from codelist_matching import PrefixIndex, separated_codes
+
+from .clinical_events import date_run_starts, patient_positions
+from .dates import (
+    NAT,
+    bound_for,
+    evaluate_date_expression,
+    from_days,
+    in_window,
+    parse_date_expression,
+    present,
+    to_days,
+    window_bounds,
+)
+
+QUERY_TYPE = "admitted_to_hospital"
+
+# TPP table of hospital spells (APCS joined to APCS_Der)
+APCS = "APCS"
+
+SUPPORTED_RETURNING = ("binary_flag", "date_admitted", "date_discharged", "primary_diagnosis")
+
+# Filters no study definition uses, which aren't supported
+_UNSUPPORTED_FILTERS = (
+    "with_source_of_admission",
+    "with_discharge_destination",
+    "with_admission_treatment_function_code",
+    "with_administrative_category",
+    "with_at_least_one_day_in_critical_care",
+)
+
+
+def _reduce_spells(apcs, query_args, rows, patients, n_patients):
+    """
+    One value per patient from their matching spells (sorted by patient,
+    admission date and row), as the TPP backend computes it
+    """
+    returning = query_args.get("returning", "binary_flag")
+    count = np.bincount(patients, minlength=n_patients)
+    if returning == "binary_flag":
+        return (count > 0).astype(int)
+    # Without find_first_match_in_period the backend returns the last match
+    find_first = bool(query_args.get("find_first_match_in_period"))
+    distinct, starts = np.unique(patients, return_index=True)
+    if returning == "primary_diagnosis":
+        if find_first:
+            picked = starts
+        else:
+            # Latest admission date, ties going to the lowest row
+            dates = apcs["admission_date"][rows]
+            picked = date_run_starts(patients, dates)[starts + count[distinct] - 1]
+        values = np.full(n_patients, "", dtype=object)
+        values[distinct] = apcs["primary_diagnosis"][rows[picked]]
+        return values
+    column = "admission_date" if returning == "date_admitted" else "discharge_date"
+    aggregate = np.fmin if find_first else np.fmax
+    values = np.full(n_patients, NAT)
+    if len(rows):
+        values[distinct] = aggregate.reduceat(from_days(apcs[column][rows]), starts)
+    return values
+
+
+def _codelist_key(codelist):
+    return f"{codelist.system}:" + ",".join(sorted(map(str, codelist)))
+
+
+# APCS columns holding the codes matched by each codelist argument
+CODE_COLUMNS = {
+    "with_these_primary_diagnoses": "primary_diagnosis",
+    "with_these_diagnoses": "diagnoses_all",
+    "with_these_procedures": "procedures_all",
+}
+# Of which those holding several codes per row (the primary diagnosis is
+# matched as a whole, as `LIKE 'U071%'`)
+SEVERAL_CODES_COLUMNS = ("diagnoses_all", "procedures_all")
+
+# Columns kept for every spell of a SpellIndex
+_SPELL_COLUMNS = (
+    "admission_date",
+    "discharge_date",
+    "primary_diagnosis",
+    "admission_method",
+    "patient_classification",
+)
+
+
+class _SpellCodes:
+    """
+    The codes of an APCS column (`several` per row, or one), split once:
+    the column's distinct values, each with a range of a flat array of codes
+    (as positions in the sorted distinct codes), and each row's value.
+    Codelists are matched against the distinct codes, once per codelist.
+    """
+
+    def __init__(self, values, several=True):
+        distinct, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+        if several:
+            split = [separated_codes(value) for value in distinct]
+        else:
+            split = [[value] if value else [] for value in distinct]
+        self.values = inverse.reshape(-1)
+        self.offsets = np.zeros(len(distinct) + 1, dtype=np.int64)
+        np.cumsum([len(codes) for codes in split], out=self.offsets[1:])
+        self.codes, self.flat = np.unique(
+            np.array([code for codes in split for code in codes], dtype=str), return_inverse=True
+        )
+        self._matched = {}
+
+    def match(self, codelists):
+        """
+        For each of `codelists` (keys mapped to codelists of one coding
+        system), whether any code of each distinct value matches it
+        """
+        pending = {key: codelist for key, codelist in codelists.items() if key not in self._matched}
+        if pending:
+            index = PrefixIndex(pending)
+            matched = np.zeros((len(self.offsets) - 1, len(index.names)), dtype=bool)
+            if len(self.codes):
+                flat = index.classify(self.codes)[self.flat.reshape(-1)]
+                found = self.offsets[1:] > self.offsets[:-1]
+                matched[found] = np.logical_or.reduceat(flat, self.offsets[:-1][found], axis=0)
+            for position, key in enumerate(index.names):
+                self._matched[key] = matched[:, position]
+        return {key: self._matched[key] for key in codelists}
+
+
+class SpellIndex:
+    """
+    The spells of APCS for known patients (of the given patient
+    classifications only, or all of them), sorted by patient, admission date
+    and row (standing in for APCS_Ident)
+
+    Only the columns variables read are kept, aligned on the sorted spells.
+    Diagnoses and procedures are split into codes once per APCS column, in
+    `codes`, which the SpellIndexes of one APCS table share (along with the
+    codelists matched against them). Each codelist is matched once, however
+    many variables (and groups) use it.
+    """
+
+    def __init__(self, apcs, patient_ids, patient_classification=None, codes=None):
+        patients = patient_positions(patient_ids, apcs["patient_id"])
+        selected = patients >= 0
+        if patient_classification is not None:
+            selected &= np.isin(apcs["patient_classification"], list(patient_classification))
+        rows = np.flatnonzero(selected)
+        patients = patients[rows]
+        order = np.lexsort((rows, apcs["admission_date"][rows], patients))
+        self.patient_classification = patient_classification
+        self.rows = rows[order]
+        self.patients = patients[order]
+        self.columns = {column: apcs[column][self.rows] for column in _SPELL_COLUMNS}
+        self.codes = {} if codes is None else codes
+        self._apcs = apcs
+        self._matched = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def matched(self, argument, codelist):
+        """Mask of the spells whose codes (of `argument`) match `codelist`"""
+        return self.match(argument, {_codelist_key(codelist): codelist})[_codelist_key(codelist)]
+
+    def match(self, argument, codelists):
+        """
+        Masks of the spells matching each of `codelists` (keys mapped to
+        codelists of one coding system), matching any not yet matched with
+        one PrefixIndex
+        """
+        pending = [key for key in codelists if (argument, key) not in self._matched]
+        if pending:
+            column = CODE_COLUMNS[argument]
+            if column not in self.codes:
+                self.codes[column] = _SpellCodes(
+                    self._apcs[column], several=column in SEVERAL_CODES_COLUMNS
+                )
+            codes = self.codes[column]
+            values = codes.values[self.rows]
+            matched = codes.match({key: codelists[key] for key in pending})
+            for key, by_value in matched.items():
+                self._matched[argument, key] = by_value[values]
+        return {key: self._matched[argument, key] for key in codelists}
+
+
+def _day_window(query_args):
+    """
+    (reference, first, last) of a window from `reference + first days` to
+    `reference + last days`, or None for any other window
+    """
+    bounds = window_bounds(query_args)
+    if None in bounds:
+        return None
+    (lower, first, lower_unit), (upper, last, upper_unit) = map(parse_date_expression, bounds)
+    if lower != upper or lower_unit != "days" or upper_unit != "days":
+        return None
+    return lower, first, last
+
+
+class DayBuckets:
+    """
+    The spells of a SpellIndex admitted from `first` to `last` days after a
+    per-patient date (`reference`, day numbers), as positions in the
+    SpellIndex (in its order) and their day offsets from the date
+    """
+
+    def __init__(self, spells, reference, first, last):
+        admitted = spells.columns["admission_date"]
+        reference = reference[spells.patients]
+        offsets = admitted.astype(np.int64) - reference
+        selected = present(admitted) & present(reference) & (offsets >= first) & (offsets <= last)
+        self.positions = np.flatnonzero(selected)
+        self.offsets = offsets[self.positions]
+
+    def within(self, first, last):
+        """Mask of the bucketed spells admitted from `first` to `last` days after the date"""
+        return (self.offsets >= first) & (self.offsets <= last)
+
+
+def _classification_of(query_args):
+    classification = query_args.get("with_patient_classification")
+    return tuple(sorted(classification)) if classification else None
+
+
+class AdmissionsEngine:
+    """
+    Evaluates any admitted_to_hospital variables from SpellIndexes of APCS
+
+    Windows may be anywhere (e.g. `on_or_before` the index date) and
+    variables may filter on diagnoses, procedures and admission method.
+    Variables read the SpellIndex of their patient classification: for
+    almost every variable of the study definitions, the ordinary admissions
+    (classification "1") only, a fraction of APCS. Every codelist of the
+    group is matched once per SpellIndex (one PrefixIndex per argument and
+    coding system), and each variable reduced from its own mask of spells.
+
+    With `day_buckets`, variables with a window of a fixed number of days
+    from a date column are reduced from the DayBuckets of their
+    classification and column instead.
+    """
+
+    def __init__(self, definitions, day_buckets=True):
+        self.definitions = dict(definitions)
+        for variable, query_args in self.definitions.items():
+            returning = query_args.get("returning", "binary_flag")
+            if returning not in SUPPORTED_RETURNING:
+                raise ValueError(f"{variable}: unsupported `returning` value: {returning}")
+            unsupported = [name for name in _UNSUPPORTED_FILTERS if query_args.get(name)]
+            if unsupported:
+                raise NotImplementedError(f"{variable}: {', '.join(unsupported)} not supported")
+        self.classifications = sorted(
+            {_classification_of(query_args) for query_args in self.definitions.values()},
+            key=str,
+        )
+        # (argument, system) -> the group's codelists, matched together
+        self._codelists = {}
+        for query_args in self.definitions.values():
+            for argument in CODE_COLUMNS:
+                codelist = query_args.get(argument)
+                if codelist is not None:
+                    key = (argument, codelist.system)
+                    self._codelists.setdefault(key, {})[_codelist_key(codelist)] = codelist
+        # variable -> (reference, first, last) of its day-bucketed window, and
+        # (classification, reference) -> the span of the windows from it
+        self.day_windows = {}
+        self._spans = {}
+        for variable, query_args in self.definitions.items():
+            day_window = _day_window(query_args) if day_buckets else None
+            if day_window is None:
+                continue
+            reference, first, last = day_window
+            self.day_windows[variable] = day_window
+            key = (_classification_of(query_args), reference)
+            span_first, span_last = self._spans.get(key, (first, last))
+            self._spans[key] = (min(span_first, first), max(span_last, last))
+        # (classification, reference) -> (SpellIndex, column, its DayBuckets)
+        self._buckets = {}
+
+    @property
+    def variables(self):
+        return list(self.definitions)
+
+    def spells(self, apcs, patient_ids, cache=None):
+        """
+        The SpellIndex of every patient classification of the group, from
+        `cache` (a dict, which they are added to) when it holds them
+        """
+        cache = {} if cache is None else cache
+        codes = next((spells.codes for spells in cache.values()), {})
+        for classification in self.classifications:
+            if classification not in cache:
+                cache[classification] = SpellIndex(apcs, patient_ids, classification, codes)
+            for (argument, _), codelists in self._codelists.items():
+                cache[classification].match(argument, codelists)
+        return cache
+
+    def column(self, variable, spells, date_columns, n_patients, index_date=None):
+        """One variable's per-patient column, from `spells` (see `spells`)"""
+        query_args = self.definitions[variable]
+        classification = _classification_of(query_args)
+        spells = spells[classification]
+        buckets = None
+        if variable in self.day_windows:
+            reference, first, last = self.day_windows[variable]
+            buckets = self.day_buckets(spells, classification, reference, date_columns, index_date)
+        if buckets is None:
+            positions = np.arange(len(spells))
+            lower, upper = window_bounds(query_args)
+            lower = evaluate_date_expression(lower, date_columns, n_patients, index_date)
+            upper = evaluate_date_expression(upper, date_columns, n_patients, index_date)
+            selected = in_window(
+                spells.columns["admission_date"],
+                bound_for(lower, spells.patients),
+                bound_for(upper, spells.patients),
+            )
+        else:
+            positions = buckets.positions
+            selected = buckets.within(first, last)
+        admission_method = query_args.get("with_admission_method")
+        if admission_method:
+            if isinstance(admission_method, str):
+                admission_method = [admission_method]
+            selected &= np.isin(
+                spells.columns["admission_method"][positions], list(admission_method)
+            )
+        for argument in CODE_COLUMNS:
+            codelist = query_args.get(argument)
+            if codelist is not None:
+                selected &= spells.matched(argument, codelist)[positions]
+        positions = positions[selected]
+        return _reduce_spells(
+            spells.columns, query_args, positions, spells.patients[positions], n_patients
+        )
+
+    def day_buckets(self, spells, classification, reference, date_columns, index_date=None):
+        """
+        The DayBuckets of `spells` over the span of the group's windows from
+        the `reference` column, selected once per evaluated column (None
+        when `reference` isn't a column, e.g. a fixed date)
+        """
+        key = (classification, reference)
+        if reference == "index_date":
+            reference = index_date
+        if reference not in date_columns:
+            return None
+        column = date_columns[reference]
+        cached = self._buckets.get(key)
+        if cached is None or cached[0] is not spells or cached[1] is not column:
+            buckets = DayBuckets(spells, to_days(column), *self._spans[key])
+            cached = self._buckets[key] = (spells, column, buckets)
+        return cached[2]
+
+    def columns(self, apcs, patient_ids, date_columns, index_date=None):
+        """Evaluate every variable of the group, returning per-patient columns"""
+        spells = self.spells(apcs, patient_ids)
+        return {
+            variable: self.column(variable, spells, date_columns, len(patient_ids), index_date)
+            for variable in self.definitions
+        }
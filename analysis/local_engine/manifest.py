@@ -0,0 +1,98 @@
+# --- COLUMN MANIFEST ---
+# The columns a consumer of the extracted cohort actually reads.
+#
+# data_process.R reads output/input.csv.gz with `cols_only(...)`, so any
+# other column of the study definition (downs_syndrome_nhsd_snomed, the
+# transplant OPCS-4 flags, preg_36wks_date, bmi_value, ...) is extracted,
+# written and gzipped only to be dropped. Given a manifest of the columns
+# read (parsed from the R `col_types` spec or listed in a YAML file), the
+# variables of a study definition fall into those to write, those only
+# needed in memory as inputs of others (including the population), and
+# those which needn't be evaluated at all.
+
+import collections
+import os
+import re
+
+# Always written, but never a variable of the study definition
+PATIENT_ID = "patient_id"
+
+_COLS_ONLY = re.compile(r"\bcols_only\s*\(")
+_COLUMN_SPEC = re.compile(r"(?m)^\s*([A-Za-z_.][A-Za-z0-9_.]*)\s*=\s*col_\w+\s*\(")
+
+ColumnPlan = collections.namedtuple("ColumnPlan", ["written", "in_memory", "skipped"])
+
+
+def _balanced_call(text, start):
+    """The text of a call from `start` (just after its "(") to its ")" """
+    depth = 1
+    position = start
+    while depth:
+        if position >= len(text):
+            raise ValueError("Unbalanced parentheses in cols_only(...)")
+        character = text[position]
+        if character in "\"'":
+            position = text.index(character, position + 1)
+        elif character == "#":
+            position = text.index("\n", position)
+        elif character == "(":
+            depth += 1
+        elif character == ")":
+            depth -= 1
+        position += 1
+    return text[start : position - 1]
+
+
+def columns_from_r_spec(path):
+    """Column names of the (first) `cols_only(...)` spec of an R script"""
+    with open(path) as f:
+        text = f.read()
+    match = _COLS_ONLY.search(text)
+    if match is None:
+        raise ValueError(f"No cols_only(...) spec in {path}")
+    spec = _balanced_call(text, match.end())
+    # Drop comments so commented out columns aren't read
+    spec = "\n".join(line.split("#", 1)[0] for line in spec.splitlines())
+    return list(dict.fromkeys(_COLUMN_SPEC.findall(spec)))
+
+
+def columns_from_yaml(path):
+    """Column names of a YAML manifest: a list of names"""
+    import yaml
+
+    with open(path) as f:
+        columns = yaml.safe_load(f)
+    if not isinstance(columns, list) or not all(isinstance(column, str) for column in columns):
+        raise ValueError(f"{path} isn't a YAML list of column names")
+    return list(dict.fromkeys(columns))
+
+
+def load_manifest(path):
+    """Column names from an R script (.R) or a YAML list (.yaml/.yml)"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".r":
+        return columns_from_r_spec(path)
+    if extension in (".yaml", ".yml"):
+        return columns_from_yaml(path)
+    raise ValueError(f"Unsupported column manifest {path}: expected .R, .yaml or .yml")
+
+
+def plan_columns(graph, manifest, population="population"):
+    """
+    Split the variables of a VariableGraph into a ColumnPlan for a manifest
+
+    `written` keeps the manifest's order; `in_memory` and `skipped` keep the
+    study definition's. Raises ValueError for manifest columns the study
+    definition doesn't define.
+    """
+    written = [column for column in manifest if column != PATIENT_ID]
+    unknown = [column for column in written if column not in graph.definitions]
+    if unknown:
+        raise ValueError(f"Columns not defined by the study definition: {', '.join(unknown)}")
+    required = list(written)
+    if population in graph.definitions:
+        required.append(population)
+    needed = set(required) | set(graph.ancestors(required))
+    in_memory = [variable for variable in graph.definitions if variable in needed and variable not in written]
+    skipped = [variable for variable in graph.definitions if variable not in needed]
+    return ColumnPlan(written, in_memory, skipped)
@@ -0,0 +1,200 @@
+# --- OUTPUT ---
+# Writing evaluated columns as the cohort file cohortextractor writes
+# (output/input.csv.gz): a patient_id column followed by one column per
+# variable, dates as YYYY-MM-DD (or the variable's `date_format`) and missing
+# values as empty fields.
+#
+# A CohortWriter streams the file a block of patients at a time, so memory
+# stays bounded whatever the number of patients (e.g. a dummy cohort of
+# tens of millions, generated chunk by chunk). The lines of a block are
+# assembled without a Python loop over its rows: every column is formatted
+# to fixed width bytes, padded with NULs, the columns of the block are laid
+# side by side with the commas and line ends between them, and dropping the
+# NULs leaves the CSV text, as the csv module writes it (\r\n line ends,
+# fields quoted only where needed).
+
+import gzip
+
+import numpy as np
+
+from .manifest import PATIENT_ID
+
+# cohortextractor date formats -> NumPy datetime units
+DATE_UNITS = {"YYYY-MM-DD": "D", "YYYY-MM": "M", "YYYY": "Y"}
+
+# Patients formatted at once by a CohortWriter
+BLOCK_SIZE = 100_000
+
+# Bytes which make the csv module quote a field
+_SPECIAL = np.frombuffer(b',"\r\n', dtype=np.uint8)
+
+
+def format_column(values, date_format=None):
+    """A column of per-patient values as strings, as written to the CSV"""
+    values = np.asarray(values)
+    if values.dtype.kind == "M":
+        unit = DATE_UNITS[date_format or "YYYY-MM-DD"]
+        formatted = np.datetime_as_string(values.astype(f"datetime64[{unit}]"), unit=unit)
+        return np.where(np.isnat(values), "", formatted)
+    if values.dtype.kind == "b":
+        return values.astype(int).astype(str)
+    if values.dtype.kind == "f":
+        return np.where(np.isnan(values), "", values.astype(str))
+    if values.dtype.kind == "O":
+        return np.array(["" if value is None else str(value) for value in values], dtype=str)
+    return values.astype(str)
+
+
+def _field_bytes(strings):
+    """
+    Strings as a matrix of NUL padded bytes, one row per string, quoted as
+    the csv module quotes them
+    """
+    codes = strings.view(np.uint32).reshape(len(strings), -1)
+    if codes.size and codes.max() >= 128:
+        encoded = np.char.encode(strings, "utf-8")
+        matrix = encoded.view(np.uint8).reshape(len(strings), -1)
+    else:
+        matrix = codes.astype(np.uint8)
+    # NumPy sizes strings for any value of their type (21 characters for
+    # an int64), keep only as many bytes as the longest one takes
+    matrix = matrix[:, : np.flatnonzero(matrix.any(axis=0)).max(initial=-1) + 1]
+    special = np.isin(matrix, _SPECIAL).any(axis=1)
+    if special.any():
+        values = [row.tobytes().rstrip(b"\0") for row in matrix[special]]
+        quoted = [b'"' + value.replace(b'"', b'""') + b'"' for value in values]
+        width = max(matrix.shape[1], *map(len, quoted))
+        matrix = np.pad(matrix, ((0, 0), (0, width - matrix.shape[1])))
+        padded = b"".join(value.ljust(width, b"\0") for value in quoted)
+        matrix[special] = np.frombuffer(padded, dtype=np.uint8).reshape(-1, width)
+    return matrix
+
+
+def column_bytes(values, date_format=None):
+    """
+    A column's CSV fields as a matrix of NUL padded bytes (see
+    `format_column`), formatting each distinct value once
+    """
+    values = np.asarray(values)
+    distinct, inverse = _distinct(values)
+    return _field_bytes(format_column(distinct, date_format))[inverse]
+
+
+def _distinct(values):
+    """
+    Values to format and the position of each value among them: for
+    integers, flags and dates spanning fewer values than there are rows
+    (most columns), every value of their range, without sorting
+    """
+    if values.dtype.kind == "O":
+        # Python objects (e.g. category labels) are hashed rather than sorted
+        positions = {}
+        inverse = np.fromiter(
+            (positions.setdefault(value, len(positions)) for value in values),
+            dtype=np.intp,
+            count=len(values),
+        )
+        return np.array(list(positions) or [""], dtype=object), inverse
+    if values.dtype.kind in "biuM" and len(values):
+        numbers = values.astype(np.int64)
+        missing = np.isnat(values) if values.dtype.kind == "M" else None
+        known = numbers if missing is None else numbers[~missing]
+        if len(known) and int(known.max()) - int(known.min()) < len(values):
+            low = known.min()
+            span = int(known.max()) - int(low) + 1
+            distinct = np.arange(low, low + span).astype(values.dtype)
+            inverse = numbers - low
+            if missing is not None:
+                # Missing dates take an extra last position
+                distinct = np.append(distinct, values[missing][:1])
+                inverse[missing] = span
+            return distinct, inverse
+    return np.unique(values, return_inverse=True)
+
+
+def csv_lines(fields):
+    """The CSV lines of columns of fields (see `column_bytes`), as bytes"""
+    n_rows = len(fields[0])
+    comma = np.full((n_rows, 1), ord(","), dtype=np.uint8)
+    line_end = np.broadcast_to(np.frombuffer(b"\r\n", dtype=np.uint8), (n_rows, 2))
+    parts = []
+    for matrix in fields:
+        parts.extend([matrix, comma])
+    parts[-1] = line_end
+    matrix = np.hstack(parts)
+    return matrix[matrix != 0].tobytes()
+
+
+class CohortWriter:
+    """
+    Writes a cohort file (gzipped if `path` ends in .gz) one block of
+    patients at a time
+
+    `variables` are the columns written, after patient_id, and
+    `date_formats` optionally maps them to their `date_format`. Without a
+    `header` line, files can be written in parts to be concatenated (gzip
+    files concatenate into one).
+    """
+
+    def __init__(self, path, variables, date_formats=None, compresslevel=9, header=True):
+        self.variables = list(variables)
+        self.date_formats = date_formats or {}
+        self.rows = 0
+        self.raw = open(path, "wb")
+        self.file = self.raw
+        if str(path).endswith(".gz"):
+            # Neither a file name nor a time in the gzip header, so the same
+            # rows always give the same bytes
+            self.file = gzip.GzipFile(
+                filename="", mode="wb", compresslevel=compresslevel, fileobj=self.raw, mtime=0
+            )
+        if header:
+            names = [column_bytes([name]) for name in [PATIENT_ID, *self.variables]]
+            self.file.write(csv_lines(names))
+
+    def write(self, patient_ids, columns, population=None):
+        """
+        Append the rows of `patient_ids`, whose values are the named columns
+
+        `population`, a per-patient boolean mask, selects the patients written.
+        """
+        patient_ids = np.asarray(patient_ids)
+        if population is not None:
+            population = np.asarray(population).astype(bool)
+        for start in range(0, len(patient_ids), BLOCK_SIZE):
+            block = slice(start, start + BLOCK_SIZE)
+            selected = None if population is None else population[block]
+            values = [patient_ids[block]] + [
+                np.asarray(columns[variable])[block] for variable in self.variables
+            ]
+            if selected is not None:
+                values = [column[selected] for column in values]
+            if not len(values[0]):
+                continue
+            fields = [column_bytes(values[0])] + [
+                column_bytes(column, self.date_formats.get(variable))
+                for variable, column in zip(self.variables, values[1:])
+            ]
+            self.file.write(csv_lines(fields))
+            self.rows += len(values[0])
+
+    def close(self):
+        self.file.close()
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_cohort(path, patient_ids, columns, variables, population=None, date_formats=None):
+    """
+    Write the named columns to `path` (gzipped if it ends in .gz)
+
+    `population`, a per-patient boolean mask, selects the patients written,
+    and `date_formats` optionally maps variables to their `date_format`.
+    """
+    with CohortWriter(path, variables, date_formats) as writer:
+        writer.write(patient_ids, columns, population)
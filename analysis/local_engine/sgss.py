@@ -0,0 +1,224 @@
+# --- SGSS ---
+# Evaluation of every `with_test_result_in_sgss` variable from one sorted
+# array of specimens.
+#
+# covid_test_positive(_date), covid_positive_prev_90_days,
+# symptomatic_covid_test, sgtf and variant each query SGSS on their own. Here
+# each pair of SGSS tables a study definition uses is read once: positive and
+# negative specimens are concatenated and sorted by patient and specimen date,
+# and every variable is a vectorised reduction (first or last specimen in its
+# window, of the result it asks for) over that one array. Variables anchored
+# on other SGSS variables (such as the look-back windows anchored on
+# covid_test_positive_date) are evaluated after them.
+#
+# As in the backend, `restrict_to_earliest_specimen_date` chooses between the
+# SGSS_Positive/SGSS_Negative tables (earliest specimen of each episode) and
+# the SGSS_AllTests_* tables (every specimen), the former by default, as
+# with patients.with_test_result_in_sgss. Local tables use the column
+# names of the backend's subqueries: patient_id, date, sgtf, case_category,
+# variant, variant_detection_method and symptomatic. On the same date
+# positive specimens come before negative ones, then table order.
+
+import numpy as np
+
+from .clinical_events import date_run_starts, patient_positions
+from .dates import (
+    NAT,
+    bound_for,
+    evaluate_date_expression,
+    from_days,
+    in_window,
+    window_bounds,
+)
+
+QUERY_TYPE = "with_test_result_in_sgss"
+
+# (restrict_to_earliest_specimen_date, test result) -> TPP table
+SGSS_TABLES = {
+    (True, "positive"): "SGSS_Positive",
+    (True, "negative"): "SGSS_Negative",
+    (False, "positive"): "SGSS_AllTests_Positive",
+    (False, "negative"): "SGSS_AllTests_Negative",
+}
+
+# returning -> column of the source table (None: only the date is needed)
+RETURNING_COLUMNS = {
+    "binary_flag": None,
+    "date": None,
+    "s_gene_target_failure": "sgtf",
+    "case_category": "case_category",
+    "variant": "variant",
+    "variant_detection_method": "variant_detection_method",
+    "symptomatic": "symptomatic",
+}
+
+# Recoding of raw values, as done by the backend's CASE expressions
+VARIANT_VALUES = {
+    "(blank)": "",
+    "none": "",
+    "N/A": "",
+    "VOC-20DEC-01 detected": "VOC-20DEC-01",
+}
+SYMPTOMATIC_VALUES = {"N": "N", "U": "", "Y": "Y", "false": "N", "true": "Y"}
+
+# The backend selects '' for every other column of negative specimens
+NEGATIVE_COLUMNS = ("symptomatic",)
+
+
+class SpecimenIndex:
+    """
+    The positive and negative specimens of one pair of SGSS tables, sorted by
+    patient and specimen date
+    """
+
+    def __init__(self, positive, negative, patient_ids):
+        self.sources = (positive, negative)
+        patients, dates, is_positive, rows = [], [], [], []
+        for source, table in enumerate(self.sources):
+            table_patients = patient_positions(patient_ids, table["patient_id"])
+            known = np.flatnonzero(table_patients >= 0)
+            patients.append(table_patients[known])
+            dates.append(table["date"][known])
+            is_positive.append(np.full(len(known), source == 0))
+            rows.append(known)
+        patients, dates = np.concatenate(patients), np.concatenate(dates)
+        is_positive, rows = np.concatenate(is_positive), np.concatenate(rows)
+        order = np.lexsort((rows, ~is_positive, dates, patients))
+        self.patients = patients[order]
+        self.dates = dates[order]
+        self.is_positive = is_positive[order]
+        self.rows = rows[order]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def values(self, column, selected):
+        """Values of `column` of the source tables for the selected specimens"""
+        values = np.full(len(selected), "", dtype=object)
+        positive, negative = self.sources
+        from_positive = self.is_positive[selected]
+        if column in positive:
+            values[from_positive] = positive[column][self.rows[selected[from_positive]]]
+        if column in NEGATIVE_COLUMNS and column in negative:
+            from_negative = ~from_positive
+            values[from_negative] = negative[column][self.rows[selected[from_negative]]]
+        return values
+
+
+class SGSSEngine:
+    """
+    Evaluates many with_test_result_in_sgss variables from one SpecimenIndex
+    per pair of SGSS tables
+    """
+
+    def __init__(self, definitions):
+        self.definitions = dict(definitions)
+        for variable, query_args in self.definitions.items():
+            if query_args.get("pathogen") != "SARS-CoV-2":
+                raise ValueError(f"{variable}: unsupported pathogen {query_args.get('pathogen')}")
+            if query_args.get("test_result") not in ("positive", "negative", "any"):
+                raise ValueError(f"{variable}: unsupported test_result {query_args.get('test_result')}")
+            if query_args.get("returning", "binary_flag") not in RETURNING_COLUMNS:
+                raise ValueError(f"{variable}: unsupported `returning` value: {query_args['returning']}")
+        # Number of SpecimenIndex built (one per pair of tables used)
+        self.scans = 0
+
+    @classmethod
+    def from_covariate_definitions(cls, covariate_definitions, variables=None):
+        """All (or the named) SGSS variables of a study definition"""
+        return cls(
+            {
+                name: query_args
+                for name, (query_type, query_args) in covariate_definitions.items()
+                if query_type == QUERY_TYPE and (variables is None or name in variables)
+            }
+        )
+
+    @property
+    def variables(self):
+        return list(self.definitions)
+
+    def index(self, tables, patient_ids):
+        """A SpecimenIndex for each pair of tables the variables read"""
+        indexes = {}
+        for query_args in self.definitions.values():
+            restrict = _restricted(query_args)
+            if restrict not in indexes:
+                self.scans += 1
+                indexes[restrict] = SpecimenIndex(
+                    tables[SGSS_TABLES[restrict, "positive"]],
+                    tables[SGSS_TABLES[restrict, "negative"]],
+                    patient_ids,
+                )
+        return indexes
+
+    def columns(self, tables, patient_ids, date_columns, index_date=None):
+        """
+        Evaluate every variable, returning a dict of per-patient columns
+
+        Windows may refer to the columns in `date_columns` or to SGSS
+        variables defined earlier in the group.
+        """
+        indexes = self.index(tables, patient_ids)
+        columns = {}
+        for variable in self.definitions:
+            columns[variable] = self.column(
+                variable, indexes, {**date_columns, **columns}, len(patient_ids), index_date
+            )
+        return columns
+
+    def column(self, variable, indexes, date_columns, n_patients, index_date=None):
+        """One variable's per-patient column, from the indexes of `index`"""
+        query_args = self.definitions[variable]
+        specimens = indexes[_restricted(query_args)]
+        test_result = query_args["test_result"]
+        if test_result == "any":
+            selected = np.ones(len(specimens), dtype=bool)
+        else:
+            selected = specimens.is_positive == (test_result == "positive")
+        lower, upper = window_bounds(query_args)
+        lower = evaluate_date_expression(lower, date_columns, n_patients, index_date)
+        upper = evaluate_date_expression(upper, date_columns, n_patients, index_date)
+        patients = specimens.patients
+        selected &= in_window(
+            specimens.dates, bound_for(lower, patients), bound_for(upper, patients)
+        )
+        return _reduce_specimens(specimens, query_args, np.flatnonzero(selected), n_patients)
+
+
+def _restricted(query_args):
+    """Whether a variable reads the earliest specimens only (the default)"""
+    return bool(query_args.get("restrict_to_earliest_specimen_date", True))
+
+
+def _reduce_specimens(specimens, query_args, selected, n_patients):
+    """One value per patient from the selected (sorted) specimens"""
+    returning = query_args.get("returning", "binary_flag")
+    patients = specimens.patients[selected]
+    count = np.bincount(patients, minlength=n_patients)
+    if returning == "binary_flag":
+        return (count > 0).astype(int)
+    distinct, starts = np.unique(patients, return_index=True)
+    if query_args.get("find_first_match_in_period"):
+        picked = selected[starts]
+    else:
+        dates = specimens.dates[selected]
+        picked = selected[date_run_starts(patients, dates)[starts + count[distinct] - 1]]
+    if returning == "date":
+        values = np.full(n_patients, NAT)
+        values[distinct] = from_days(specimens.dates[picked])
+        return values
+    raw = specimens.values(RETURNING_COLUMNS[returning], picked)
+    if returning == "variant":
+        raw = np.array([VARIANT_VALUES.get(value, value) for value in raw], dtype=object)
+    elif returning == "symptomatic":
+        raw = np.array(
+            [
+                "" if value is None else SYMPTOMATIC_VALUES.get(value, value)
+                for value in raw
+            ],
+            dtype=object,
+        )
+    values = np.full(n_patients, "", dtype=object)
+    values[distinct] = raw
+    return values
@@ -0,0 +1,45 @@
+# --- STORE ---
+# Local tables saved to and loaded from a directory, one compressed .npz
+# file per TPP table plus patient_ids.npy, so an extraction can be rerun on
+# the same tables (synthetic ones, or an export of real ones) without
+# rebuilding them. Date columns are int32 day numbers (see dates.py);
+# datetime64 columns of stores saved before are converted on loading. A
+# store may also hold the codelist dates of past runs (see
+# codelist_dates.py), which aren't a table.
+
+import glob
+import os
+
+import numpy as np
+
+from .codelist_dates import CODELIST_DATES
+from .dates import to_days
+
+PATIENT_IDS = "patient_ids.npy"
+
+
+def save_tables(directory, tables, patient_ids):
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, PATIENT_IDS), np.asarray(patient_ids))
+    for name, table in tables.items():
+        np.savez_compressed(os.path.join(directory, f"{name}.npz"), **table)
+
+
+def load_tables(directory):
+    """The (tables, patient_ids) saved in `directory` by `save_tables`"""
+    patient_ids = np.load(os.path.join(directory, PATIENT_IDS))
+    tables = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.npz"))):
+        if os.path.basename(path) == CODELIST_DATES:
+            continue
+        name = os.path.splitext(os.path.basename(path))[0]
+        # String columns are object arrays, which are pickled
+        with np.load(path, allow_pickle=True) as table:
+            tables[name] = {column: _days(table[column]) for column in table.files}
+    return tables, patient_ids
+
+
+def _days(values):
+    if values.dtype.kind == "M":
+        return to_days(values)
+    return values
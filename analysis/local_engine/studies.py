@@ -0,0 +1,117 @@
+# --- STUDIES ---
+# Evaluation of several study definitions in one pass over the tables.
+#
+# study_definition.py and study_definition_ba2.py define almost the same
+# variables over different periods: the codelists, therapeutics and SGSS
+# queries are shared, only their dates (and a few ba2-only exclusions)
+# differ. Evaluated separately, every table is scanned once per study.
+# A StudyBatch walks the levels of all the studies' VariableGraphs together
+# and evaluates the variables of each level and query type, from every
+# study, as one group of the VariableEvaluator. Each variable brings the
+# columns of its own study, so e.g. a codelist is matched against the coded
+# events once for both periods while each period keeps its own windows.
+# Columns come back per study, to be written to their own output files.
+#
+# With `workers`, the groups of a level (one per query type, independent of
+# each other) are evaluated at the same time by a pool of threads, and their
+# columns merged in the order of the groups, so the columns are the same
+# whatever the number of workers. Threads rather than processes: the groups
+# share the evaluator's tables and caches (codelist dates, spell indexes),
+# which a process would have to receive a copy of, and most of their time
+# goes to NumPy sorts, searches and comparisons, which release the GIL.
+# Groups of a level never write the same entry of those caches: clinical
+# events and medications key codelist dates by their own tables, and only
+# admissions build spell indexes.
+
+import concurrent.futures
+import contextlib
+
+from .dependencies import VariableGraph
+from .evaluator import VariableEvaluator
+
+
+class StudyBatch:
+    """
+    Evaluates the variables of several study definitions together
+
+    `studies` maps study names (e.g. "study_definition") to their
+    covariate definitions, and `index_dates` optionally maps them to their
+    index dates. `workers` is the number of groups of a level evaluated at
+    the same time (1: one after the other).
+    """
+
+    def __init__(self, studies, index_dates=None, workers=1):
+        self.graphs = {name: VariableGraph(definitions) for name, definitions in studies.items()}
+        self.index_dates = dict(index_dates or {})
+        self.workers = workers
+        # Number of groups evaluated (each a single pass over its tables)
+        self.groups = 0
+
+    @classmethod
+    def from_studies(cls, studies, workers=1):
+        return cls(
+            {name: study.covariate_definitions for name, study in studies.items()},
+            {name: study.index_date for name, study in studies.items()},
+            workers,
+        )
+
+    def run(self, evaluate, variables=None):
+        """
+        Evaluate the named variables of each study (default: all) and their
+        dependencies, returning a dict of columns per study
+
+        `evaluate` is a VariableEvaluator (or has its `evaluate_group`), and
+        `variables` optionally maps study names to the variables they need.
+        """
+        variables = variables or {}
+        columns = {name: {} for name in self.graphs}
+        plans = {name: graph.plan(variables.get(name)) for name, graph in self.graphs.items()}
+        with self._executor() as executor:
+            for depth in range(max((len(levels) for levels in plans.values()), default=0)):
+                self._run_level(evaluate, plans, depth, columns, executor)
+        return columns
+
+    def _executor(self):
+        if self.workers <= 1:
+            return contextlib.nullcontext()
+        return concurrent.futures.ThreadPoolExecutor(self.workers)
+
+    def _run_level(self, evaluate, plans, depth, columns, executor=None):
+        """Evaluate the variables of one level of every study into `columns`"""
+        groups = {}
+        index_dates = {}
+        for name, levels in plans.items():
+            if depth >= len(levels):
+                continue
+            graph = self.graphs[name]
+            for variable in levels[depth]:
+                query_type, query_args = graph.definitions[variable]
+                inputs = {
+                    dependency: columns[name][dependency]
+                    for dependency in graph.dependencies[variable]
+                }
+                groups.setdefault(query_type, {})[name, variable] = (query_args, inputs)
+                index_dates[name, variable] = self.index_dates.get(name)
+        self.groups += len(groups)
+        if executor is None or len(groups) == 1:
+            results = [
+                evaluate.evaluate_group(query_type, group, index_dates)
+                for query_type, group in groups.items()
+            ]
+        else:
+            futures = [
+                executor.submit(evaluate.evaluate_group, query_type, group, index_dates)
+                for query_type, group in groups.items()
+            ]
+            results = [future.result() for future in futures]
+        for values in results:
+            for (name, variable), column in values.items():
+                columns[name][variable] = column
+
+
+def evaluate_studies(studies, tables, patient_ids, variables=None):
+    """
+    Columns of every study of `studies` (names mapped to StudyDefinitions),
+    from one set of tables
+    """
+    return StudyBatch.from_studies(studies).run(VariableEvaluator(tables, patient_ids), variables)
@@ -0,0 +1,299 @@
+# --- SYNTHETIC TABLES ---
+# Random TPP-like tables for the local engine, for benchmarks and for
+# trying out extractions (see local_extract.py) without patient data.
+#
+# A share of the coded rows use codes from the codelists of the study
+# definitions being evaluated, so every variable matches some patients;
+# values are otherwise uniform and carry no clinical meaning. Dates fall in
+# 2020-01-01 to 2022-06-18, covering every study period, and are day
+# numbers as the engine reads them (see dates.py).
+
+import numpy as np
+
+from .clinical_events import EVENT_TABLES, MEDICATION_TABLES
+from .dates import DAY_DTYPE, MISSING_DAY, to_days
+from .demographics import (
+    ADDRESSES,
+    BMI_CODE,
+    DEATHS,
+    ETHNICITY_GROUP_6,
+    PATIENT,
+    REGISTRATIONS,
+    SUS_ETHNICITY,
+)
+from .hospital_admissions import APCS
+from .sgss import SGSS_TABLES
+from .therapeutics import RISK_GROUP_COLUMNS, THERAPEUTICS
+from .vaccinations import VACCINATIONS
+
+START = np.datetime64("2020-01-01")
+DAYS = 900
+
+INTERVENTIONS = [
+    "Sotrovimab",
+    "Molnupiravir",
+    "Paxlovid",
+    "Remdesivir",
+    "Casirivimab and imdevimab ",
+    "Tocilizumab",
+]
+INDICATIONS = ["non_hospitalised", "hospitalised_with", "hospital_onset"]
+STATUSES = ["Approved", "Treatment Complete", "Treatment Not Started", "Treatment Stopped"]
+RISK_GROUPS = ["", "Downs syndrome", "solid cancer", "IMID", "liver disease"]
+
+REGIONS = [
+    "East",
+    "East Midlands",
+    "London",
+    "North East",
+    "North West",
+    "South East",
+    "South West",
+    "West Midlands",
+    "Yorkshire and The Humber",
+]
+STP_CODES = [f"E{54000005 + offset}" for offset in range(42)]
+VACCINES = {
+    "SARS-2 CORONAVIRUS": [
+        "COVID-19 mRNA Vaccine Comirnaty 30micrograms/0.3ml dose conc for susp for inj MDV (Pfizer)",
+        "COVID-19 Vac AstraZeneca (ChAdOx1 S recomb) 5x10000000000 viral particles/0.5ml dose "
+        "sol for inj MDV",
+        "COVID-19 mRNA Vaccine Spikevax (nucleoside modified) 0.1mg/0.5mL dose disp for inj MDV "
+        "(Moderna)",
+    ],
+    "INFLUENZA": ["Influenza vaccine"],
+}
+ADMISSION_METHODS = ["11", "12", "13", "21", "22", "23", "24", "25", "2A", "2B", "2D", "28"]
+
+
+def random_dates(rng, n_rows, start=START, days=DAYS):
+    """Day numbers of `n_rows` dates from `start` (a datetime64) to `days` later"""
+    return to_days(start) + rng.integers(0, days, n_rows).astype(DAY_DTYPE)
+
+
+def _random_codes(rng, codes, n_rows, share=0.25):
+    """`n_rows` codes, a `share` of them drawn from `codes`"""
+    n_matching = int(n_rows * share) if len(codes) else 0
+    codes = np.concatenate(
+        [
+            rng.choice(np.asarray(codes, dtype=object), n_matching),
+            rng.integers(10**8, 10**15, n_rows - n_matching).astype(str).astype(object),
+        ]
+    )
+    rng.shuffle(codes)
+    return codes
+
+
+def make_events(rng, patient_ids, n_rows, codes):
+    """Coded events, a share of them with codes from the study's codelists"""
+    return {
+        "patient_id": rng.choice(patient_ids, n_rows),
+        "date": random_dates(rng, n_rows),
+        "code": _random_codes(rng, codes, n_rows),
+    }
+
+
+def make_specimens(rng, patient_ids, n_rows):
+    return {
+        "patient_id": rng.choice(patient_ids, n_rows),
+        "date": random_dates(rng, n_rows),
+        "sgtf": rng.choice(["0", "1", "9", ""], n_rows).astype(object),
+        "case_category": rng.choice(["LFT_Only", "PCR_Only", "LFT_WithPCR"], n_rows).astype(object),
+        "variant": rng.choice(["", "VOC-20DEC-01 detected", "VOC-21NOV-01"], n_rows).astype(object),
+        "variant_detection_method": rng.choice(["", "Reflex Assay"], n_rows).astype(object),
+        "symptomatic": rng.choice(["Y", "N", "U", ""], n_rows).astype(object),
+    }
+
+
+def earliest_specimens(specimens):
+    """
+    The earliest specimen of each patient of a table of specimens (the
+    first in table order on the same date), as SGSS_Positive and
+    SGSS_Negative hold of SGSS_AllTests_Positive and SGSS_AllTests_Negative
+    """
+    patient_ids = specimens["patient_id"]
+    order = np.lexsort((np.arange(len(patient_ids)), specimens["date"], patient_ids))
+    _, firsts = np.unique(patient_ids[order], return_index=True)
+    rows = np.sort(order[firsts])
+    return {column: values[rows] for column, values in specimens.items()}
+
+
+def make_therapeutics(rng, patient_ids, n_rows):
+    start = np.datetime64("2021-12-01")
+    return {
+        "patient_id": rng.choice(patient_ids, n_rows),
+        "treatment_start_date": random_dates(rng, n_rows, start, 120),
+        "received": random_dates(rng, n_rows, start, 120),
+        "intervention": rng.choice(INTERVENTIONS, n_rows),
+        "covid_indication": rng.choice(INDICATIONS, n_rows, p=[0.8, 0.1, 0.1]),
+        "current_status": rng.choice(STATUSES, n_rows),
+        **{column: rng.choice(RISK_GROUPS, n_rows) for column in RISK_GROUP_COLUMNS},
+    }
+
+
+def make_admissions(rng, patient_ids, n_rows, icd10_codes, opcs4_codes):
+    admitted = random_dates(rng, n_rows)
+    diagnoses = [_random_codes(rng, icd10_codes, n_rows, share=0.3) for _ in range(3)]
+    n_diagnoses = rng.integers(1, 4, n_rows)
+    procedures = _random_codes(rng, opcs4_codes, n_rows, share=0.3)
+    return {
+        "patient_id": rng.choice(patient_ids, n_rows),
+        "admission_date": admitted,
+        "discharge_date": admitted + rng.integers(0, 21, n_rows).astype(DAY_DTYPE),
+        "patient_classification": rng.choice(
+            ["1", "2", "3", "4", "5"], n_rows, p=[0.6, 0.3, 0.04, 0.03, 0.03]
+        ).astype(object),
+        "admission_method": rng.choice(ADMISSION_METHODS, n_rows).astype(object),
+        "primary_diagnosis": diagnoses[0],
+        # Formatted as in TPP, each code following a separator
+        "diagnoses_all": np.array(
+            ["||" + " ,".join(codes[:count]) for *codes, count in zip(*diagnoses, n_diagnoses)],
+            dtype=object,
+        ),
+        "procedures_all": np.array(["||" + code for code in procedures], dtype=object),
+    }
+
+
+def make_patients(rng, patient_ids):
+    n_patients = len(patient_ids)
+    birth_months = np.datetime64("1910-01") + rng.integers(0, 95 * 12, n_patients).astype(
+        "timedelta64[M]"
+    )
+    return {
+        "patient_id": patient_ids.copy(),
+        "date_of_birth": to_days(birth_months),
+        "sex": rng.choice(["F", "M", "I", "U"], n_patients, p=[0.49, 0.49, 0.01, 0.01]).astype(
+            object
+        ),
+    }
+
+
+def make_deaths(rng, patient_ids, icd10_codes, share=0.05):
+    dead = np.sort(rng.choice(patient_ids, int(len(patient_ids) * share), replace=False))
+    n_rows = len(dead)
+    causes = [_random_codes(rng, icd10_codes, n_rows, share=0.3) for _ in range(2)]
+    return {
+        "patient_id": dead,
+        "date": random_dates(rng, n_rows),
+        "underlying_cause": causes[0],
+        "causes_all": np.array([",".join(codes) for codes in zip(*causes)], dtype=object),
+    }
+
+
+def make_registrations(rng, patient_ids):
+    """
+    A registration per patient (ended for 3% of them), following an earlier
+    one at another practice for a tenth of them
+    """
+    n_patients = len(patient_ids)
+    start = random_dates(rng, n_patients, np.datetime64("1990-01-01"), 365 * 30)
+    moved = rng.random(n_patients) < 0.1
+    ended = rng.random(n_patients) < 0.03
+    end = np.where(ended, random_dates(rng, n_patients), MISSING_DAY).astype(DAY_DTYPE)
+    previous = np.flatnonzero(moved)
+    patient = np.concatenate([patient_ids, patient_ids[previous]])
+    order = np.argsort(patient, kind="stable")
+    practices = rng.integers(1, 1000, len(patient))
+    return {
+        "patient_id": patient[order],
+        "start_date": np.concatenate([start, start[previous] - 3650])[order],
+        "end_date": np.concatenate([end, start[previous]])[order],
+        "practice_id": practices[order],
+        "stp_code": np.array(STP_CODES, dtype=object)[practices % len(STP_CODES)][order],
+        "region": np.array(REGIONS, dtype=object)[practices % len(REGIONS)][order],
+    }
+
+
+def make_addresses(rng, patient_ids):
+    n_patients = len(patient_ids)
+    return {
+        "patient_id": patient_ids.copy(),
+        "start_date": random_dates(rng, n_patients, np.datetime64("1990-01-01"), 365 * 30),
+        "end_date": np.full(n_patients, MISSING_DAY, dtype=DAY_DTYPE),
+        "imd": np.where(rng.random(n_patients) < 0.02, -1, rng.integers(1, 32845, n_patients)),
+        "rural_urban": rng.integers(1, 9, n_patients),
+        "msoa": np.array(
+            [f"E0200{number:04d}" for number in rng.integers(1, 6792, n_patients)], dtype=object
+        ),
+    }
+
+
+def make_sus_ethnicity(rng, patient_ids, n_rows):
+    codes = sorted(ETHNICITY_GROUP_6) + ["Z", "99"]
+    return {
+        "patient_id": rng.choice(patient_ids, n_rows),
+        "code": rng.choice(codes, n_rows).astype(object),
+    }
+
+
+def make_vaccinations(rng, patient_ids, n_rows):
+    diseases = rng.choice(list(VACCINES), n_rows, p=[0.8, 0.2])
+    products = np.array([rng.choice(VACCINES[disease]) for disease in diseases], dtype=object)
+    return {
+        "patient_id": rng.choice(patient_ids, n_rows),
+        "date": random_dates(rng, n_rows, np.datetime64("2020-12-08"), 550),
+        "target_disease": diseases.astype(object),
+        "product_name": products,
+    }
+
+
+def _codes_by_system(definitions, query_types):
+    codes = {}
+    for query_type, query_args in definitions.values():
+        if query_type not in query_types:
+            continue
+        for value in query_args.values():
+            system = getattr(value, "system", None)
+            if system is not None:
+                codes.setdefault(system, set()).update(
+                    item[0] if value.has_categories else item for item in value
+                )
+    return {system: sorted(system_codes) for system, system_codes in codes.items()}
+
+
+def make_tables(rng, patient_ids, n_rows, definitions):
+    """
+    Every table the local engine reads, for patients `patient_ids`, with
+    `n_rows` rows in each coded events table (and fewer in the others)
+    """
+    event_codes = _codes_by_system(definitions, ("with_these_clinical_events",))
+    tables = {
+        table: make_events(rng, patient_ids, n_rows, event_codes.get(system, []))
+        for system, table in EVENT_TABLES.items()
+    }
+    # Recorded BMIs, a tenth of the CTV3 events
+    coded = tables[EVENT_TABLES["ctv3"]]
+    bmi = rng.random(n_rows) < 0.1
+    coded["code"][bmi] = BMI_CODE
+    coded["numeric_value"] = np.where(bmi, np.round(rng.normal(27, 6, n_rows), 1), 0.0)
+
+    medication_codes = _codes_by_system(definitions, ("with_these_medications",))
+    medication_codes = sorted(set().union(*medication_codes.values())) if medication_codes else []
+    tables.update(
+        {
+            table: make_events(rng, patient_ids, n_rows // 4, medication_codes)
+            for table in set(MEDICATION_TABLES.values())
+        }
+    )
+    for result in ("positive", "negative"):
+        every_test = make_specimens(rng, patient_ids, n_rows // 10)
+        tables[SGSS_TABLES[False, result]] = every_test
+        tables[SGSS_TABLES[True, result]] = earliest_specimens(every_test)
+    tables[THERAPEUTICS] = make_therapeutics(rng, patient_ids, n_rows // 10)
+
+    hospital_codes = _codes_by_system(definitions, ("admitted_to_hospital",))
+    death_codes = _codes_by_system(definitions, ("with_these_codes_on_death_certificate",))
+    tables[APCS] = make_admissions(
+        rng,
+        patient_ids,
+        n_rows // 10,
+        hospital_codes.get("icd10", []),
+        hospital_codes.get("opcs4", []),
+    )
+    tables[PATIENT] = make_patients(rng, patient_ids)
+    tables[DEATHS] = make_deaths(rng, patient_ids, death_codes.get("icd10", []))
+    tables[REGISTRATIONS] = make_registrations(rng, patient_ids)
+    tables[ADDRESSES] = make_addresses(rng, patient_ids)
+    tables[SUS_ETHNICITY] = make_sus_ethnicity(rng, patient_ids, len(patient_ids))
+    tables[VACCINATIONS] = make_vaccinations(rng, patient_ids, len(patient_ids) * 2)
+    return tables
@@ -0,0 +1,238 @@
+# --- COVID THERAPEUTICS ---
+# Single scan evaluation of `with_covid_therapeutics` variables.
+#
+# study_definition.py queries the therapeutics table once per drug for the
+# treatment after the positive test and again for previous treatment (and
+# study_definition_ba2.py adds paxlovid_covid_rx and remdesivir_covid_rx).
+# Here the table is read once: each row's intervention is matched against
+# every drug, its indication and status classified, and the rows sorted per
+# patient by treatment start date. Every variable (and date_treated and
+# prev_treated, which only combine them) is then a reduction over its own
+# mask of that one sorted set of rows.
+#
+# Matching follows the TPP backend: interventions match case-insensitively
+# anywhere in the string (`LIKE '%drug%'`), statuses and indications are
+# compared after stripping whitespace, and rows with the same treatment start
+# date are ordered by Received, CurrentStatus and Intervention. As in the
+# backend's temporary therapeutics table, risk group columns are expected to
+# be formatted already ("Patients with" prefixes removed, " and " -> ",").
+
+import re
+
+import numpy as np
+
+from .clinical_events import date_run_starts, patient_positions
+from .dates import (
+    NAT,
+    bound_for,
+    evaluate_date_expression,
+    from_days,
+    in_window,
+    to_list,
+    window_bounds,
+)
+
+QUERY_TYPE = "with_covid_therapeutics"
+
+# TPP table of covid therapeutics
+THERAPEUTICS = "Therapeutics"
+
+RISK_GROUP_COLUMNS = ("mol1_high_risk_cohort", "sot02_risk_cohorts", "casim05_risk_cohort")
+
+SUPPORTED_RETURNING = ("binary_flag", "date", "therapeutic", "risk_group")
+
+# `prev_treated` style expressions: variables joined by OR
+_OR_EXPRESSION = re.compile(r"^\s*\w+(\s+OR\s+\w+)*\s*$", re.IGNORECASE)
+
+
+def _categorise(values):
+    """
+    Sorted distinct stripped, lower case values of a column of strings, and
+    the position of each row's value among them
+
+    These columns hold a handful of distinct values, so normalising those and
+    working with the integer positions is much cheaper than string operations
+    on every row.
+    """
+    distinct, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    labels, positions = np.unique(
+        np.char.lower(np.char.strip(distinct)), return_inverse=True
+    )
+    return labels, positions.reshape(-1)[inverse.reshape(-1)]
+
+
+class TherapeuticsExtractor:
+    """
+    Evaluates many with_covid_therapeutics variables with one pass over the
+    therapeutics table
+
+    `definitions` maps variable names to their (processed) cohortextractor
+    query arguments. `derived` optionally maps variable names to
+    ("aggregate_of", query_args) or ("categorised_as", query_args) over
+    variables of the group, such as date_treated (`minimum_of`) and
+    prev_treated (`satisfying`), which are evaluated from the group's columns.
+    """
+
+    def __init__(self, definitions, derived=None):
+        self.definitions = dict(definitions)
+        for variable, query_args in self.definitions.items():
+            returning = query_args.get("returning", "binary_flag")
+            if returning not in SUPPORTED_RETURNING:
+                raise ValueError(f"{variable}: unsupported `returning` value: {returning}")
+            if query_args.get("episode_defined_as"):
+                raise NotImplementedError(f"{variable}: episode_defined_as is not supported")
+        self.derived = dict(derived or {})
+        for variable, (query_type, query_args) in self.derived.items():
+            if not set(_sources_of(query_type, query_args)) <= set(self.definitions):
+                raise ValueError(f"{variable}: combines variables outside the group")
+        # Number of passes over the therapeutics table so far
+        self.scans = 0
+
+    @classmethod
+    def from_covariate_definitions(cls, covariate_definitions, variables=None):
+        """
+        All (or the named) therapeutics variables of a study definition, with
+        the minimum_of/satisfying variables which only combine them
+        """
+        definitions = {
+            name: query_args
+            for name, (query_type, query_args) in covariate_definitions.items()
+            if query_type == QUERY_TYPE and (variables is None or name in variables)
+        }
+        derived = {}
+        for name, (query_type, query_args) in covariate_definitions.items():
+            sources = _sources_of(query_type, query_args)
+            if sources and set(sources) <= set(definitions):
+                derived[name] = (query_type, query_args)
+        return cls(definitions, derived)
+
+    @property
+    def variables(self):
+        return list(self.definitions) + list(self.derived)
+
+    def scan(self, table, patient_ids):
+        """
+        The single pass: rows of known patients, ordered as the backend orders
+        them, with which drug each row's intervention matches and each row's
+        indication and status (as positions in their sorted labels)
+        """
+        self.scans += 1
+        patients = patient_positions(patient_ids, table["patient_id"])
+        rows = np.flatnonzero(patients >= 0)
+        patients = patients[rows]
+        categories = {
+            column: _categorise(table[column][rows])
+            for column in ("intervention", "current_status", "covid_indication")
+        }
+        # Rows are sorted by (patient, date) and then by the backend's tie
+        # breaks; np.lexsort takes its keys last key first
+        tie_breaks = [categories["intervention"][1], categories["current_status"][1]]
+        if "received" in table:
+            tie_breaks.append(table["received"][rows])
+        order = np.lexsort((rows, *tie_breaks, table["treatment_start_date"][rows], patients))
+        rows, patients = rows[order], patients[order]
+        categories = {
+            column: (labels, positions[order])
+            for column, (labels, positions) in categories.items()
+        }
+        return rows, patients, categories
+
+    def columns(self, table, patient_ids, date_columns, index_date=None):
+        """Evaluate every variable of the group, returning per-patient columns"""
+        scanned = self.scan(table, patient_ids)
+        columns = {
+            variable: self.column(variable, table, scanned, date_columns, len(patient_ids), index_date)
+            for variable in self.definitions
+        }
+        columns.update(self.combine(columns))
+        return columns
+
+    def column(self, variable, table, scanned, date_columns, n_patients, index_date=None):
+        """One variable's per-patient column, from the rows returned by `scan`"""
+        query_args = self.definitions[variable]
+        rows, patients, categories = scanned
+        dates = table["treatment_start_date"][rows]
+        interventions, intervention_positions = categories["intervention"]
+        selected = np.ones(len(rows), dtype=bool)
+        therapeutics = [
+            drug.strip().lower() for drug in to_list(query_args.get("with_these_therapeutics"))
+        ]
+        if therapeutics:
+            matching = np.array(
+                [any(drug in intervention for drug in therapeutics) for intervention in interventions],
+                dtype=bool,
+            )
+            selected &= matching[intervention_positions]
+        for column, argument in (
+            ("covid_indication", "with_these_indications"),
+            ("current_status", "with_these_statuses"),
+        ):
+            wanted = to_list(query_args.get(argument))
+            if wanted:
+                labels, positions = categories[column]
+                selected &= np.isin(labels, [value.strip().lower() for value in wanted])[positions]
+        lower, upper = window_bounds(query_args)
+        lower = evaluate_date_expression(lower, date_columns, n_patients, index_date)
+        upper = evaluate_date_expression(upper, date_columns, n_patients, index_date)
+        selected &= in_window(dates, bound_for(lower, patients), bound_for(upper, patients))
+        return _reduce_rows(table, query_args, rows[selected], patients[selected], n_patients)
+
+    def combine(self, columns):
+        """The derived variables, from the columns of the group's variables"""
+        return {
+            variable: _combine(query_type, query_args, columns)
+            for variable, (query_type, query_args) in self.derived.items()
+        }
+
+
+def _sources_of(query_type, query_args):
+    """Variables combined by an aggregate_of or `a OR b` categorised_as variable"""
+    if query_type == "aggregate_of":
+        return list(query_args["column_names"])
+    if query_type == "categorised_as":
+        definitions = query_args["category_definitions"]
+        expressions = [expression for expression in definitions.values() if expression != "DEFAULT"]
+        if set(definitions) == {0, 1} and len(expressions) == 1:
+            if _OR_EXPRESSION.match(expressions[0]):
+                return re.split(r"\s+OR\s+", expressions[0].strip(), flags=re.IGNORECASE)
+    return []
+
+
+def _combine(query_type, query_args, columns):
+    sources = [columns[name] for name in _sources_of(query_type, query_args)]
+    if query_type == "categorised_as":
+        return np.any([source != 0 for source in sources], axis=0).astype(int)
+    aggregate = np.fmin if query_args["aggregate_function"] == "MIN" else np.fmax
+    return aggregate.reduce(sources)
+
+
+def _reduce_rows(table, query_args, rows, patients, n_patients):
+    """One value per patient from their matching rows (sorted as the backend)"""
+    returning = query_args.get("returning", "binary_flag")
+    count = np.bincount(patients, minlength=n_patients)
+    if returning == "binary_flag":
+        return (count > 0).astype(int)
+    distinct, starts = np.unique(patients, return_index=True)
+    if query_args.get("find_first_match_in_period"):
+        picked = rows[starts]
+    else:
+        # The last row by treatment start date, ties going to the first row
+        dates = table["treatment_start_date"][rows]
+        ends = starts + count[distinct] - 1
+        picked = rows[date_run_starts(patients, dates)[ends]]
+    if returning == "date":
+        values = np.full(n_patients, NAT)
+        values[distinct] = from_days(table["treatment_start_date"][picked])
+        return values
+    values = np.full(n_patients, "", dtype=object)
+    if returning == "therapeutic":
+        values[distinct] = [
+            intervention.strip().replace(" and ", ",")
+            for intervention in table["intervention"][picked]
+        ]
+    else:
+        values[distinct] = [
+            ",".join(group for group in groups if group)
+            for groups in zip(*(table[column][picked] for column in RISK_GROUP_COLUMNS))
+        ]
+    return values
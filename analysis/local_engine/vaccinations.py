@@ -0,0 +1,92 @@
+# --- VACCINATIONS ---
+# Evaluation of `with_tpp_vaccination_record` variables, from the TPP
+# vaccination records.
+#
+# Each record names the vaccine's product and the disease it targets, which
+# variables match exactly (as the backend does through its vaccination
+# reference table). Records of known patients are sorted once per group of
+# variables, and each variable reduced from its own mask of them.
+
+import numpy as np
+
+from .clinical_events import patient_positions
+from .dates import (
+    NAT,
+    bound_for,
+    evaluate_date_expression,
+    from_days,
+    in_window,
+    to_list,
+    window_bounds,
+)
+
+QUERY_TYPE = "with_tpp_vaccination_record"
+
+# TPP table holding the vaccination records
+VACCINATIONS = "Vaccination"
+
+SUPPORTED_RETURNING = ("binary_flag", "date", "number_of_matches_in_period")
+
+
+class VaccinationsEngine:
+    """
+    Evaluates any with_tpp_vaccination_record variables with one pass over
+    the vaccination records
+    """
+
+    def __init__(self, definitions):
+        self.definitions = dict(definitions)
+        for variable, query_args in self.definitions.items():
+            returning = query_args.get("returning", "binary_flag")
+            if returning not in SUPPORTED_RETURNING:
+                raise ValueError(f"{variable}: unsupported `returning` value: {returning}")
+
+    def scan(self, table, patient_ids):
+        """Records of known patients, ordered by patient, date and row"""
+        patients = patient_positions(patient_ids, table["patient_id"])
+        rows = np.flatnonzero(patients >= 0)
+        patients = patients[rows]
+        order = np.lexsort((rows, table["date"][rows], patients))
+        return rows[order], patients[order]
+
+    def column(self, variable, table, scanned, date_columns, n_patients, index_date=None):
+        query_args = self.definitions[variable]
+        rows, patients = scanned
+        selected = np.ones(len(rows), dtype=bool)
+        for argument, column in (
+            ("target_disease_matches", "target_disease"),
+            ("product_name_matches", "product_name"),
+        ):
+            values = query_args.get(argument)
+            if values is not None:
+                selected &= np.isin(table[column][rows], to_list(values))
+        lower, upper = window_bounds(query_args)
+        lower = evaluate_date_expression(lower, date_columns, n_patients, index_date)
+        upper = evaluate_date_expression(upper, date_columns, n_patients, index_date)
+        dates = table["date"][rows]
+        selected &= in_window(dates, bound_for(lower, patients), bound_for(upper, patients))
+        patients, dates = patients[selected], dates[selected]
+
+        returning = query_args.get("returning", "binary_flag")
+        count = np.bincount(patients, minlength=n_patients)
+        if returning == "binary_flag":
+            return (count > 0).astype(int)
+        if returning == "number_of_matches_in_period":
+            return count
+        values = np.full(n_patients, NAT)
+        if len(patients):
+            distinct, starts = np.unique(patients, return_index=True)
+            if not query_args.get("find_first_match_in_period"):
+                starts = starts + count[distinct] - 1
+            values[distinct] = from_days(dates[starts])
+        return values
+
+    def columns(self, table, patient_ids, date_columns, index_date=None):
+        """Evaluate every variable of the group, returning per-patient columns"""
+        scanned = self.scan(table, patient_ids)
+        return {
+            variable: self.column(
+                variable, table, scanned, date_columns, len(patient_ids), index_date
+            )
+            for variable in self.definitions
+        }
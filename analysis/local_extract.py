@@ -0,0 +1,140 @@
+# --- LOCAL EXTRACT ---
+# Extracts the cohort of every period (see periods.py), or of the named ones,
+# offline with the local engine: the study definitions are evaluated from
+# local TPP-like tables in one StudyBatch and each period's cohort is
+# written to <output-dir>/input<suffix>.csv.gz, as cohortextractor writes
+# it (a patient_id column, then every variable but the population, for the
+# patients in the population).
+#
+# The tables are either loaded from a directory saved by local_engine/store.py
+# (--store) or generated (--synthetic, optionally saved with --save-store).
+# With --columns, only the columns of a consumer's manifest (see
+# column_manifest.py) are written and only the variables they need are
+# evaluated.
+#
+# The earliest and latest matching day of every codelist (see
+# local_engine/codelist_dates.py) are saved in the store, so reruns on it
+# answer "ever before/after" variables without scanning the coded events.
+#
+# With `--workers`, the independent groups of each dependency level (one per
+# query type) are evaluated by that many threads; the cohorts are the same
+# whatever the number of workers.
+#
+# Run from the root of the repository:
+#   python analysis/local_extract.py --synthetic 100000 --workers 4
+#   python analysis/local_extract.py --store output/tables --periods ba2 --columns analysis/data_process.R
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from local_engine.codelist_dates import CodelistDates  # noqa: E402
+from local_engine.evaluator import VariableEvaluator  # noqa: E402
+from local_engine.manifest import load_manifest, plan_columns  # noqa: E402
+from local_engine.output import write_cohort  # noqa: E402
+from local_engine.store import load_tables, save_tables  # noqa: E402
+from local_engine.studies import StudyBatch  # noqa: E402
+from local_engine.synthetic import make_tables  # noqa: E402
+from periods import cohort_filename, load_periods, study_name  # noqa: E402
+from study_definition_builder import build_study_definitions  # noqa: E402
+
+POPULATION = "population"
+
+
+def output_variables(graph):
+    """The variables cohortextractor writes, in definition order"""
+    return [
+        variable
+        for variable, (_, query_args) in graph.definitions.items()
+        if variable != POPULATION and not query_args.get("hidden")
+    ]
+
+
+def at_least_one(value):
+    """An argument's value as an int, if it is 1 or more"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {value}")
+    return number
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--periods", nargs="+", help="default: every period")
+    tables = parser.add_mutually_exclusive_group(required=True)
+    tables.add_argument("--store", help="directory of tables saved by local_engine/store.py")
+    tables.add_argument("--synthetic", type=int, metavar="N", help="generate tables of N patients")
+    parser.add_argument("--rows", type=int, help="rows per coded events table (default: 10 * N)")
+    parser.add_argument("--seed", type=int, default=20220211)
+    parser.add_argument("--save-store", help="save the generated tables to this directory")
+    parser.add_argument("--columns", help="column manifest (R cols_only(...) spec or YAML list)")
+    parser.add_argument("--output-dir", default="output")
+    parser.add_argument("--workers", type=at_least_one, default=1, help="groups evaluated at once")
+    args = parser.parse_args()
+
+    periods = load_periods()
+    if args.periods:
+        periods = {name: periods[name] for name in args.periods}
+    studies = build_study_definitions(periods.values())
+    batch = StudyBatch.from_studies(studies, args.workers)
+
+    start = time.perf_counter()
+    store = args.store or args.save_store
+    if args.store:
+        tables, patient_ids = load_tables(args.store)
+    else:
+        patient_ids = np.arange(1, args.synthetic + 1)
+        definitions = {}
+        for graph in batch.graphs.values():
+            definitions.update(graph.definitions)
+        rng = np.random.default_rng(args.seed)
+        tables = make_tables(rng, patient_ids, args.rows or 10 * args.synthetic, definitions)
+        if args.save_store:
+            save_tables(args.save_store, tables, patient_ids)
+    codelist_dates = CodelistDates(len(patient_ids))
+    if args.store:
+        codelist_dates = CodelistDates.load(args.store, patient_ids)
+    print(f"{len(patient_ids)} patients, {len(tables)} tables ({time.perf_counter() - start:.1f} s)")
+
+    written = {name: output_variables(graph) for name, graph in batch.graphs.items()}
+    variables = None
+    if args.columns:
+        manifest = load_manifest(args.columns)
+        plans = {name: plan_columns(graph, manifest, POPULATION) for name, graph in batch.graphs.items()}
+        written = {name: plan.written for name, plan in plans.items()}
+        variables = {name: plan.written + plan.in_memory for name, plan in plans.items()}
+
+    start = time.perf_counter()
+    evaluate = VariableEvaluator(tables, patient_ids, codelist_dates=codelist_dates)
+    columns = batch.run(evaluate, variables)
+    print(
+        f"evaluated in {time.perf_counter() - start:.1f} s ({batch.groups} groups, "
+        f"{len(codelist_dates)} codelist dates)"
+    )
+    if store:
+        codelist_dates.save(store, patient_ids)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for period in periods.values():
+        name = study_name(period)
+        graph = batch.graphs[name]
+        population = columns[name][POPULATION]
+        path = os.path.join(args.output_dir, cohort_filename(period))
+        write_cohort(
+            path,
+            patient_ids,
+            columns[name],
+            written[name],
+            population,
+            {variable: query_args.get("date_format") for variable, (_, query_args) in graph.definitions.items()},
+        )
+        print(f"{path}: {int(np.count_nonzero(population))} patients, {len(written[name])} columns")
+
+
+if __name__ == "__main__":
+    main()
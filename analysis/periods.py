@@ -0,0 +1,97 @@
+# --- PERIODS ---
+# Registry of the study periods, one per lib/design/study-dates*.json file:
+# study-dates.json is the BA.1 period ("ba1", whose files have no suffix, as
+# in data_process.R) and study-dates-<name>.json the period <name>, whose
+# study definition and cohort are study_definition_<name> and
+# input_<name>.csv.gz. Adding a period only takes a new dates file (and,
+# where it differs from the defaults, an entry in PERIOD_SETTINGS).
+
+import collections
+import glob
+import json
+import os
+
+DESIGN_DIR = os.path.join("lib", "design")
+
+# Name of the period of study-dates.json
+FIRST_PERIOD = "ba1"
+
+Period = collections.namedtuple(
+    "Period",
+    [
+        "name",
+        "start_date",
+        "end_date",
+        # "" for the first period, "_<name>" for the others
+        "suffix",
+        # Earliest date of the default date expectations
+        "default_earliest",
+        # Latest date of covid_test_positive_date's expectations
+        "test_latest",
+        # Whether patients treated with paxlovid or remdesivir (as recorded
+        # by the *_covid_rx variables) are excluded from the population
+        "covid_rx_exclusions",
+    ],
+)
+
+# Settings in which the periods differ from the defaults (start_date,
+# end_date and True). They are kept out of the study-dates files, which
+# data_process.R reads as dates only.
+PERIOD_SETTINGS = {
+    "ba1": {
+        "default_earliest": "2021-11-01",
+        "test_latest": "2022-02-01",
+        "covid_rx_exclusions": False,
+    },
+    "ba2": {"default_earliest": "2022-01-01"},
+}
+
+
+def period_name(path):
+    """The name of the period of a study-dates*.json file"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if stem == "study-dates":
+        return FIRST_PERIOD
+    if not stem.startswith("study-dates-"):
+        raise ValueError(f"Not a study dates file: {path}")
+    return stem[len("study-dates-") :]
+
+
+def read_period(path):
+    with open(path, "r") as f:
+        study_dates = json.load(f)
+    name = period_name(path)
+    settings = {
+        "default_earliest": study_dates["start_date"],
+        "test_latest": study_dates["end_date"],
+        "covid_rx_exclusions": True,
+        **PERIOD_SETTINGS.get(name, {}),
+    }
+    return Period(
+        name=name,
+        start_date=study_dates["start_date"],
+        end_date=study_dates["end_date"],
+        suffix="" if name == FIRST_PERIOD else f"_{name}",
+        **settings,
+    )
+
+
+def load_periods(design_dir=DESIGN_DIR):
+    """Every period with a dates file in `design_dir`, by start date"""
+    periods = [read_period(path) for path in glob.glob(os.path.join(design_dir, "study-dates*.json"))]
+    return {period.name: period for period in sorted(periods, key=lambda period: period.start_date)}
+
+
+def load_period(name, design_dir=DESIGN_DIR):
+    filename = "study-dates.json" if name == FIRST_PERIOD else f"study-dates-{name}.json"
+    return read_period(os.path.join(design_dir, filename))
+
+
+def study_name(period):
+    """The name of a period's study definition (e.g. study_definition_ba2)"""
+    return f"study_definition{period.suffix}"
+
+
+def cohort_filename(period):
+    """The name of a period's extracted cohort (e.g. input_ba2.csv.gz)"""
+    return f"input{period.suffix}.csv.gz"
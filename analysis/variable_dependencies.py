@@ -0,0 +1,52 @@
+# --- VARIABLE DEPENDENCIES ---
+# Prints the dependency DAG of the variables of a study definition, as
+# parsed from the date arguments and expressions that refer to other
+# variables (see local_engine/dependencies.py).
+#
+# Run from the root of the repository:
+#   python analysis/variable_dependencies.py --study-definition study_definition --explain
+#   python analysis/variable_dependencies.py --changed covid_test_positive_date
+
+import argparse
+import importlib
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from local_engine.dependencies import VariableGraph  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--study-definition", default="study_definition")
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="list every level with each variable's direct dependencies",
+    )
+    parser.add_argument(
+        "--changed",
+        action="append",
+        default=[],
+        metavar="VARIABLE",
+        help="list the variables to recompute when VARIABLE changes",
+    )
+    args = parser.parse_args()
+
+    study = importlib.import_module(args.study_definition).study
+    graph = VariableGraph.from_study(study)
+    print(graph.explain() if args.explain else graph.summary())
+    if args.changed:
+        unknown = [variable for variable in args.changed if variable not in graph.definitions]
+        if unknown:
+            parser.error(f"unknown variables: {', '.join(unknown)}")
+        recompute = graph.descendants(args.changed)
+        print("")
+        print(f"Changing {', '.join(args.changed)} recomputes {len(recompute)} variables:")
+        for variable in recompute:
+            print(f"  {variable}")
+
+
+if __name__ == "__main__":
+    main()
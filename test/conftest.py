@@ -0,0 +1,34 @@
+# Fixtures shared by the tests of the local engine (analysis/local_engine).
+#
+# Study definitions are imported as the backend imports them, with the
+# installed cohortextractor processing their variables, from the root of the
+# repository (their codelists are read from codelists/).
+
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, os.path.join(ROOT, "analysis"))
+
+
+def _import_study(name):
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    try:
+        return importlib.import_module(name).study
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(scope="session")
+def study():
+    return _import_study("study_definition")
+
+
+@pytest.fixture(scope="session")
+def study_ba2():
+    return _import_study("study_definition_ba2")
@@ -0,0 +1,280 @@
+import numpy as np
+import pytest
+from cohortextractor import codelist
+from local_engine.clinical_events import (
+    EVENT_TABLES,
+    MEDICATION_TABLES,
+    MEDICATIONS_QUERY_TYPE,
+    QUERY_TYPE,
+    ClinicalEventsClassifier,
+)
+from local_engine.codelist_dates import CodelistDates
+from local_engine.dates import (
+    MISSING_DAY,
+    evaluate_date_expression,
+    from_days,
+    parse_date_expression,
+    to_days,
+    window_bounds,
+)
+from local_engine.expressions import categorise
+
+N_PATIENTS = 300
+PATIENT_IDS = np.arange(1, N_PATIENTS + 1)
+FIRST_DAY = int(to_days(["2021-06-01"])[0])
+EVENT_TABLES_OF = {QUERY_TYPE: EVENT_TABLES, MEDICATIONS_QUERY_TYPE: MEDICATION_TABLES}
+
+
+def _codes(definitions, tables):
+    """The codes of the codelists whose events are in each of `tables`"""
+    codes = {}
+    for query_type, query_args in definitions.values():
+        codelist = query_args["codelist"]
+        table_name = tables[query_type][codelist.system]
+        codes.setdefault(table_name, set()).update(
+            item[0] if codelist.has_categories else item for item in codelist
+        )
+    return codes
+
+
+def _events(rng, codes, n_rows):
+    """
+    Events of a few months, so that patients have several on a day, half of
+    them with codes of the codelists and a few without a date
+    """
+    days = rng.integers(FIRST_DAY, FIRST_DAY + 240, n_rows).astype(np.int32)
+    days[rng.random(n_rows) < 0.02] = MISSING_DAY
+    codes = rng.choice(np.array(sorted(codes), dtype=object), n_rows)
+    return {
+        "patient_id": rng.integers(1, N_PATIENTS + 1, n_rows),
+        "date": days,
+        "code": np.where(rng.random(n_rows) < 0.5, codes, "0").astype(object),
+    }
+
+
+@pytest.fixture(scope="module")
+def events(study):
+    definitions = {
+        name: (query_type, query_args)
+        for name, (query_type, query_args) in study.covariate_definitions.items()
+        if query_type in EVENT_TABLES_OF
+    }
+    # Every returning value, including the code of the smoking codelist's
+    # events, and a flag without a window
+    _, smoking = definitions["most_recent_smoking_code"]
+    definitions["last_smoking_code"] = (QUERY_TYPE, {**smoking, "returning": "code"})
+    definitions["first_smoking_code"] = (
+        QUERY_TYPE,
+        {
+            **smoking,
+            "returning": "code",
+            "find_first_match_in_period": True,
+            "find_last_match_in_period": False,
+        },
+    )
+    definitions["any_smoking_code"] = (
+        QUERY_TYPE,
+        {**definitions["ever_smoked"][1], "between": (None, None)},
+    )
+    rng = np.random.default_rng(1)
+    tables = {
+        table_name: _events(rng, codes, 20_000)
+        for table_name, codes in _codes(definitions, EVENT_TABLES_OF).items()
+    }
+    positive = rng.integers(FIRST_DAY + 120, FIRST_DAY + 240, N_PATIENTS)
+    # less_vulnerable's window starts on this (value_from) date, when there is one
+    vulnerable = rng.integers(FIRST_DAY, FIRST_DAY + 240, N_PATIENTS).astype(np.int32)
+    vulnerable[rng.random(N_PATIENTS) < 0.5] = MISSING_DAY
+    columns = {
+        "covid_test_positive_date": from_days(positive),
+        "date_severely_clinically_vulnerable": from_days(vulnerable),
+    }
+    return definitions, tables, columns
+
+
+def _in_window(day, lower, upper):
+    if lower is None and upper is None:
+        return True
+    # A missing bound (e.g. of a patient without preg_36wks_date) matches
+    # nothing, as a comparison with NULL in SQL
+    return (
+        day != MISSING_DAY
+        and (lower is None or (lower != MISSING_DAY and day >= lower))
+        and (upper is None or (upper != MISSING_DAY and day <= upper))
+    )
+
+
+def _reference(query_args, table, columns):
+    """A variable's values, one patient and one event at a time, as the backend's"""
+    codelist = query_args["codelist"]
+    categories = dict(codelist) if codelist.has_categories else {}
+    codes = set(categories) if codelist.has_categories else set(codelist)
+    lower, upper = (
+        evaluate_date_expression(bound, columns, N_PATIENTS)
+        for bound in window_bounds(query_args)
+    )
+    events = {}
+    for row, (patient_id, day, code) in enumerate(
+        zip(table["patient_id"], table["date"], table["code"])
+    ):
+        if code in codes:
+            events.setdefault(patient_id - 1, []).append((int(day), row))
+    values = []
+    for patient in range(N_PATIENTS):
+        patient_lower = None if lower is None else lower[patient]
+        patient_upper = None if upper is None else upper[patient]
+        matching = sorted(
+            (day, row)
+            for day, row in events.get(patient, [])
+            if _in_window(day, patient_lower, patient_upper)
+        )
+        values.append(_reduce(query_args, table, matching, categories))
+    return values
+
+
+def _reduce(query_args, table, events, categories):
+    returning = query_args.get("returning", "binary_flag")
+    if returning == "binary_flag":
+        return int(bool(events))
+    if returning == "number_of_matches_in_period":
+        return len(events)
+    if not events:
+        return None if returning == "date" else ""
+    if query_args.get("find_first_match_in_period"):
+        day, row = events[0]
+    else:
+        # ORDER BY date DESC, id: the first event of the last day
+        day = events[-1][0]
+        row = min(row for event_day, row in events if event_day == day)
+    if returning == "date":
+        return None if day == MISSING_DAY else day
+    code = table["code"][row]
+    return categories.get(code, "") if returning == "category" else code
+
+
+def _comparable(values):
+    if values.dtype.kind == "M":
+        return [None if day == MISSING_DAY else int(day) for day in to_days(values)]
+    return values.tolist()
+
+
+def _evaluate(definitions, tables, columns, codelist_dates=None):
+    """
+    Every variable's column, evaluating those whose windows refer to other
+    variables (e.g. pregdel to preg_36wks_date) after them
+    """
+    columns = dict(columns)
+    pending = dict(definitions)
+    while pending:
+        ready = {
+            name: (query_type, query_args)
+            for name, (query_type, query_args) in pending.items()
+            if all(
+                parse_date_expression(bound)[0] in columns
+                for bound in window_bounds(query_args)
+                if bound is not None
+            )
+        }
+        assert ready
+        for query_type, event_tables in EVENT_TABLES_OF.items():
+            group = {name: args for name, (type_, args) in ready.items() if type_ == query_type}
+            if group:
+                classifier = ClinicalEventsClassifier(group, event_tables)
+                dates = None if codelist_dates is None else codelist_dates[query_type]
+                columns.update(classifier.columns(tables, PATIENT_IDS, columns, None, dates))
+        for name in ready:
+            del pending[name]
+    return columns
+
+
+def _codelist_dates():
+    return {query_type: CodelistDates(N_PATIENTS) for query_type in EVENT_TABLES_OF}
+
+
+@pytest.mark.parametrize("with_codelist_dates", [False, True])
+def test_variables_match_one_event_at_a_time(events, with_codelist_dates):
+    definitions, tables, columns = events
+    returning = {query_args.get("returning") for _, query_args in definitions.values()}
+    assert returning == {"binary_flag", "number_of_matches_in_period", "date", "code", "category"}
+    codelist_dates = _codelist_dates() if with_codelist_dates else None
+    values = _evaluate(definitions, tables, columns, codelist_dates)
+    for name, (query_type, query_args) in definitions.items():
+        table = tables[EVENT_TABLES_OF[query_type][query_args["codelist"].system]]
+        assert _comparable(values[name]) == _reference(query_args, table, values), name
+
+
+def test_codelist_dates_are_reused(events):
+    definitions, tables, columns = events
+    codelist_dates = _codelist_dates()
+    first = _evaluate(definitions, tables, columns, codelist_dates)
+    assert all(len(dates) for dates in codelist_dates.values())
+    # Now partly answered from the days recorded by the first run
+    second = _evaluate(definitions, tables, columns, codelist_dates)
+    for name in definitions:
+        assert _comparable(first[name]) == _comparable(second[name]), name
+
+
+def _smoking_events(rows):
+    """CTV3 events from (patient_id, date, code) rows"""
+    patient_ids, dates, codes = zip(*rows)
+    return {
+        EVENT_TABLES["ctv3"]: {
+            "patient_id": np.array(patient_ids),
+            "date": to_days(list(dates)),
+            "code": np.array(codes, dtype=object),
+        }
+    }
+
+
+def test_smoking_status_on_a_day_with_several_codes(study):
+    definitions = study.covariate_definitions
+    classifier = ClinicalEventsClassifier.from_covariate_definitions(
+        definitions, ["most_recent_smoking_code", "ever_smoked"]
+    )
+    # "1372." is a smoker (S) code and "1377." an ex-smoker (E) one
+    tables = _smoking_events(
+        [
+            (1, "2021-10-01", "1377."),
+            (1, "2021-12-01", "1372."),
+            (1, "2021-12-01", "1377."),
+            (2, "2021-12-01", "1377."),
+            (2, "2021-12-01", "1372."),
+            (2, "2022-01-05", "1372."),
+        ]
+    )
+    columns = {"covid_test_positive_date": np.array(["2022-01-01"] * 3, dtype="datetime64[D]")}
+    values = classifier.columns(tables, np.array([1, 2, 3]), columns)
+    # The first code (in table order) of the latest day, as the backend
+    assert values["most_recent_smoking_code"].tolist() == ["S", "E", ""]
+    assert values["ever_smoked"].tolist() == [1, 1, 0]
+    smoking_status = categorise(
+        definitions["smoking_status"][1]["category_definitions"], {**columns, **values}, 3
+    )
+    assert smoking_status.tolist() == ["S", "E", "M"]
+
+
+def test_more_variables_than_bits_in_a_word():
+    # Variable masks span several 64-bit words
+    definitions = {
+        f"code_{n}": {
+            "codelist": codelist([str(1000 + n), str(1000 + n + 1)], system="snomed"),
+            "returning": "number_of_matches_in_period",
+        }
+        for n in range(150)
+    }
+    tables = {
+        EVENT_TABLES["snomed"]: {
+            "patient_id": np.array([1, 1, 2]),
+            "date": to_days(["2021-01-01", "2021-02-01", "2021-03-01"]),
+            "code": np.array(["1070", "1071", "1149"], dtype=object),
+        }
+    }
+    values = ClinicalEventsClassifier(definitions).columns(tables, np.array([1, 2]), {})
+    counts = {name: column.tolist() for name, column in values.items() if column.any()}
+    assert counts == {
+        "code_69": [1, 0],
+        "code_70": [2, 0],
+        "code_71": [1, 0],
+        "code_148": [0, 1],
+        "code_149": [0, 1],
+    }
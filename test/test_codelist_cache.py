@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+
+import codelist_cache
+import pytest
+from cohortextractor import codelistlib
+
+SHA = "a" * 40
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """A workspace with a codelist recorded in codelists/codelists.json"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("CODELIST_CACHE_DIR", str(tmp_path / "cache"))
+    (tmp_path / "codelists").mkdir()
+    _record_sha(SHA)
+    (tmp_path / "codelists" / "plain.csv").write_text("code,category\nA01,1\nA02,2\n")
+    return tmp_path
+
+
+def _record_sha(sha):
+    path = codelist_cache.CODELISTS_JSON
+    previous = os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+    with open(path, "w") as f:
+        json.dump({"files": {"plain.csv": {"sha": sha}}}, f)
+    # A later edit, whatever the resolution of the file system's timestamps
+    mtime = max(os.stat(path).st_mtime_ns, previous + 10**9)
+    os.utime(path, ns=(mtime, mtime))
+
+
+def _parsed(monkeypatch):
+    """Record the codelists parsed from their CSV file"""
+    parsed = []
+    parse = codelistlib.codelist_from_csv
+
+    def recording(filename, *args, **kwargs):
+        parsed.append(filename)
+        return parse(filename, *args, **kwargs)
+
+    monkeypatch.setattr(codelistlib, "codelist_from_csv", recording)
+    return parsed
+
+
+def _load(**kwargs):
+    return codelist_cache.codelist_from_csv("codelists/plain.csv", "icd10", **kwargs)
+
+
+def test_entries_are_read_back(workspace, monkeypatch):
+    parsed = _parsed(monkeypatch)
+    for category_column in (None, "category"):
+        expected = codelistlib.codelist_from_csv(
+            "codelists/plain.csv", "icd10", category_column=category_column
+        )
+        parsed.clear()
+        first = _load(category_column=category_column)
+        second = _load(category_column=category_column)
+        assert parsed == ["codelists/plain.csv"]
+        for codes in (first, second):
+            assert codes == expected
+            assert codes.system == "icd10"
+            assert codes.has_categories == bool(category_column)
+
+
+def test_entries_are_keyed_on_the_recorded_sha(workspace, monkeypatch):
+    path = codelist_cache.cache_path("codelists/plain.csv", "code")
+    assert os.path.basename(path).startswith(SHA)
+    _load()
+    _record_sha("b" * 40)
+    parsed = _parsed(monkeypatch)
+    assert codelist_cache.cache_path("codelists/plain.csv", "code") != path
+    _load()
+    assert parsed == ["codelists/plain.csv"]
+
+
+def test_unrecorded_codelists_are_keyed_on_their_contents(workspace):
+    (workspace / "codelists" / "other.csv").write_text("code\nB01\n")
+    sha = hashlib.sha1(b"code\nB01\n").hexdigest()
+    path = codelist_cache.cache_path("codelists/other.csv", "code")
+    assert os.path.basename(path).startswith(sha)
+
+
+def test_edited_codelists_are_parsed_again(workspace, monkeypatch):
+    _load()
+    (workspace / "codelists" / "plain.csv").write_text("code,category\nA01,1\nA03,3\nA04,4\n")
+    parsed = _parsed(monkeypatch)
+    assert list(_load()) == ["A01", "A03", "A04"]
+    assert parsed == ["codelists/plain.csv"]
+
+
+def test_invalid_entries_are_parsed_again(workspace, monkeypatch):
+    _load()
+    with open(codelist_cache.cache_path("codelists/plain.csv", "code"), "wb") as f:
+        f.write(b"OSCL")
+    parsed = _parsed(monkeypatch)
+    assert list(_load()) == ["A01", "A02"]
+    assert parsed == ["codelists/plain.csv"]
+
+
+def test_empty_cache_dir_disables_the_cache(workspace, monkeypatch):
+    monkeypatch.setenv("CODELIST_CACHE_DIR", "")
+    parsed = _parsed(monkeypatch)
+    _load()
+    _load()
+    assert len(parsed) == 2
+    assert not (workspace / "cache").exists()
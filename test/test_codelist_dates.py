@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+import pytest
+from cohortextractor import codelist
+from local_engine.codelist_dates import CODELIST_DATES, CodelistDates, table_fingerprint
+from local_engine.dates import DAY_DTYPE, MISSING_DAY, to_days
+from local_engine.event_index import EventIndex
+
+PATIENT_IDS = np.array([3, 7, 11])
+CODES = codelist(["123", "456"], system="snomed")
+
+
+def _events(codes=("123", "456", "123")):
+    return {
+        "patient_id": np.array([3, 3, 7]),
+        "date": to_days(["2021-01-01", "2021-06-01", "2021-03-01"]),
+        "code": np.array(codes, dtype=object),
+    }
+
+
+def _codelist_dates(events=None):
+    """CodelistDates of CODES over `events`, with their key"""
+    events = _events() if events is None else events
+    dates = CodelistDates(len(PATIENT_IDS))
+    key = dates.key("CodedEvent_SNOMED", events, CODES)
+    patients = np.searchsorted(PATIENT_IDS, events["patient_id"])
+    rows = np.arange(len(patients))
+    dates.add(key, EventIndex(patients, events["date"], rows, len(PATIENT_IDS)))
+    return dates, key
+
+
+def test_earliest_and_latest_days():
+    dates, key = _codelist_dates()
+    assert key in dates and len(dates) == 1
+    january, march, june = to_days(["2021-01-01", "2021-03-01", "2021-06-01"])
+    assert dates.earliest[key].tolist() == [january, march, MISSING_DAY]
+    assert dates.latest[key].tolist() == [june, march, MISSING_DAY]
+
+
+def test_variables_answered_by_the_days():
+    dates, key = _codelist_dates()
+    upper = np.full(3, to_days("2021-02-01"), dtype=DAY_DTYPE)
+    flag = {"returning": "binary_flag"}
+    assert dates.answers(key, flag, None, upper)
+    assert dates.column(key, flag, None, upper).tolist() == [1, 0, 0]
+    assert dates.column(key, flag, upper, None).tolist() == [1, 1, 0]
+    last = {"returning": "date"}
+    assert dates.column(key, last, upper, None).astype(str).tolist() == [
+        "2021-06-01",
+        "2021-03-01",
+        "NaT",
+    ]
+    # A window with both bounds, or none (which events without a date
+    # match), needs the events themselves
+    assert not dates.answers(key, flag, upper, upper)
+    assert not dates.answers(key, flag)
+    assert not dates.answers(key, last, None, upper)
+    assert not dates.answers("unknown", flag, None, upper)
+
+
+def test_keys_change_with_the_table():
+    dates, key = _codelist_dates()
+    _, edited_key = _codelist_dates(_events(("123", "123", "456")))
+    assert edited_key != key
+    assert table_fingerprint(_events()) == table_fingerprint(_events())
+    other_codes = CodelistDates(3).key("CodedEvent_SNOMED", _events(), codelist(["123"], "snomed"))
+    assert other_codes != key
+
+
+def test_saved_for_the_same_patients(tmp_path):
+    dates, key = _codelist_dates()
+    dates.save(tmp_path, PATIENT_IDS)
+    loaded = CodelistDates.load(tmp_path, PATIENT_IDS)
+    assert list(loaded.earliest) == [key]
+    assert loaded.earliest[key].tolist() == dates.earliest[key].tolist()
+    assert loaded.latest[key].tolist() == dates.latest[key].tolist()
+
+
+def test_not_loaded_for_other_patients(tmp_path):
+    dates, _ = _codelist_dates()
+    dates.save(tmp_path, PATIENT_IDS)
+    # The same number of patients, with other ids
+    assert not len(CodelistDates.load(tmp_path, np.array([3, 7, 12])))
+    assert not len(CodelistDates.load(tmp_path, np.array([3, 7])))
+    assert not len(CodelistDates.load(tmp_path / "missing", PATIENT_IDS))
+    with pytest.raises(ValueError):
+        dates.save(tmp_path, np.array([3, 7]))
+
+
+def test_not_loaded_without_the_patients_hash(tmp_path):
+    dates, key = _codelist_dates()
+    np.savez_compressed(
+        os.path.join(tmp_path, CODELIST_DATES),
+        keys=np.array([key]),
+        earliest=dates.earliest[key].reshape(-1, 1),
+        latest=dates.latest[key].reshape(-1, 1),
+    )
+    assert not len(CodelistDates.load(tmp_path, PATIENT_IDS))
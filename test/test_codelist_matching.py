@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+from cohortextractor import codelist
+from codelist_matching import (
+    NOT_A_CODE,
+    IntegerCodelist,
+    PrefixIndex,
+    encode_numeric_codes,
+    separated_codes,
+)
+
+
+def test_encode_numeric_codes():
+    encoded = encode_numeric_codes(["22298006", "", "X1234", "-5", "1" * 19, "0"])
+    assert encoded.tolist() == [22298006, NOT_A_CODE, NOT_A_CODE, NOT_A_CODE, NOT_A_CODE, 0]
+    assert encode_numeric_codes(np.array([3, 4], dtype=np.int32)).dtype == np.int64
+
+
+def test_membership_matches_a_set_of_strings():
+    rng = np.random.default_rng(1)
+    codes = rng.integers(10**8, 10**15, 5_000)
+    integer_codelist = IntegerCodelist(codes.astype(str), "snomed")
+    events = np.concatenate(
+        [rng.choice(codes, 2_000), rng.integers(10**8, 10**15, 20_000), [0, 10**17]]
+    )
+    strings = events.astype(str).astype(object)
+    strings[:10] = ["", "X", "1.5", "-1", "a1", "", " ", "1e5", "Y", "Z"]
+    string_set = set(codes.astype(str))
+    expected = np.array([code in string_set for code in strings])
+    assert expected.sum() > 1_900
+    assert np.array_equal(integer_codelist.contains(strings), expected)
+    assert np.array_equal(integer_codelist.contains(events[10:]), expected[10:])
+
+
+def test_categories_of_a_codelist():
+    codes = codelist([("123", "S"), ("456", "E"), ("77", "E")], system="snomed")
+    codes.has_categories = True
+    integer_codelist = IntegerCodelist.from_codelist(codes)
+    assert len(integer_codelist) == 3
+    assert "123" in integer_codelist and 456 in integer_codelist and "789" not in integer_codelist
+    assert integer_codelist.categories_of(["456", "789", "123", "x"]).tolist() == ["E", "", "S", ""]
+
+
+def test_duplicate_codes_keep_their_first_category():
+    integer_codelist = IntegerCodelist(["5", "123", "5"], "snomed", categories=["A", "B", "C"])
+    assert integer_codelist.codes.tolist() == [5, 123]
+    assert integer_codelist.categories_of(["5", "123"]).tolist() == ["A", "B"]
+
+
+def test_empty_codelist_matches_nothing():
+    integer_codelist = IntegerCodelist([], "dmd")
+    assert not integer_codelist.contains(["1", "2"]).any()
+
+
+def test_invalid_codelists():
+    with pytest.raises(ValueError):
+        IntegerCodelist(["123"], "ctv3")
+    with pytest.raises(ValueError):
+        IntegerCodelist(["123", "XaX"], "snomed")
+    with pytest.raises(ValueError):
+        IntegerCodelist(["123"], "snomed").categories_of(["123"])
+
+
+def _icd10(*codes):
+    return codelist(list(codes), system="icd10")
+
+
+def test_codes_match_by_prefix():
+    index = PrefixIndex({"covid": _icd10("U071", "U072"), "u07": _icd10("U07"), "j": _icd10("J")})
+    matrix = index.classify(["U071", "U0711", "U07", "U073", "J12", "", "XU071"])
+    assert matrix.tolist() == [
+        [True, True, False],
+        [True, True, False],
+        [False, True, False],
+        [False, True, False],
+        [False, False, True],
+        [False, False, False],
+        [False, False, False],
+    ]
+    assert index.matches(["U072", "U07"], "covid").tolist() == [True, False]
+
+
+def test_prefix_index_matches_startswith():
+    rng = np.random.default_rng(1)
+    alphabet = list("ABCU0127")
+    codes = ["".join(rng.choice(alphabet, rng.integers(1, 5))) for _ in range(3_000)]
+    codelists = {f"codelist{n}": _icd10(*rng.choice(codes, 20)) for n in range(10)}
+    matrix = PrefixIndex(codelists).classify(codes)
+    for position, codelist_codes in enumerate(codelists.values()):
+        expected = [any(code.startswith(prefix) for prefix in codelist_codes) for code in codes]
+        assert matrix[:, position].tolist() == expected
+
+
+def test_codes_of_several_codes_follow_a_separator():
+    assert separated_codes("||A01 ,U071 ,J12") == ["A01", "U071", "J12"]
+    assert separated_codes("U071,A01") == ["A01"]
+    assert separated_codes("") == []
+    index = PrefixIndex({"covid": _icd10("U071"), "a": _icd10("A0")})
+    matrix = index.classify_all(["||A01 ,U071", "U071,A01", "||J12", "U071"])
+    assert matrix.tolist() == [[True, True], [False, True], [False, False], [False, False]]
+
+
+def test_prefix_index_of_a_study_definition(study):
+    index = PrefixIndex.from_covariate_definitions(study.covariate_definitions, "icd10")
+    assert index.system == "icd10"
+    assert "any_covid_hosp_prev_90_days.with_these_diagnoses" in index.names
+    assert "covid_hosp_admission_date0.with_these_primary_diagnoses" in index.names
+    assert not any(name.endswith(".with_these_procedures") for name in index.names)
+
+
+def test_codelists_of_one_hierarchical_system():
+    with pytest.raises(ValueError):
+        PrefixIndex({"snomed": codelist(["123"], system="snomed")})
+    with pytest.raises(ValueError):
+        PrefixIndex({"icd10": _icd10("A01"), "opcs4": codelist(["X891"], system="opcs4")})
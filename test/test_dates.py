@@ -0,0 +1,147 @@
+import calendar
+import datetime
+
+import numpy as np
+import pytest
+from local_engine.dates import (
+    DAY_DTYPE,
+    MISSING_DAY,
+    add_months,
+    bound_for,
+    earliest,
+    evaluate_date_expression,
+    from_days,
+    in_window,
+    latest,
+    parse_date_expression,
+    shift_days,
+    to_days,
+    to_list,
+    window_bounds,
+)
+
+
+def _add_months(date, months):
+    """DATEADD(month, ...): the same day of the month, or the month's last"""
+    month = date.year * 12 + date.month - 1 + months
+    year, month = divmod(month, 12)
+    day = min(date.day, calendar.monthrange(year, month + 1)[1])
+    return datetime.date(year, month + 1, day)
+
+
+def test_days_round_trip():
+    dates = np.array(["1970-01-01", "2022-02-28", "NaT", "1900-03-01"], dtype="datetime64[D]")
+    days = to_days(dates)
+    assert days.dtype == DAY_DTYPE
+    assert days.tolist() == [0, 19_051, MISSING_DAY, -25_508]
+    assert np.array_equal(from_days(days), dates, equal_nan=True)
+    assert to_days(["2020-01-02"]).tolist() == [18_263]
+
+
+def test_months_clamp_to_the_end_of_the_month():
+    dates = np.array(
+        ["2022-01-31", "2020-01-31", "2021-03-31", "2020-02-29"], dtype="datetime64[D]"
+    )
+    assert add_months(dates, 1).astype(str).tolist() == [
+        "2022-02-28",
+        "2020-02-29",
+        "2021-04-30",
+        "2020-03-29",
+    ]
+    assert add_months(dates, -1).astype(str).tolist() == [
+        "2021-12-31",
+        "2019-12-31",
+        "2021-02-28",
+        "2020-01-29",
+    ]
+    # A year from a leap day
+    leap_day = to_days(["2020-02-29"])
+    assert shift_days(leap_day, 1, "years").tolist() == to_days(["2021-02-28"]).tolist()
+
+
+def test_months_match_a_date_at_a_time():
+    rng = np.random.default_rng(1)
+    days = rng.integers(to_days("2019-01-01"), to_days("2023-01-01"), 2_000).astype(DAY_DTYPE)
+    for months in (-18, -6, -1, 1, 3, 12, 25):
+        expected = [
+            _add_months(datetime.date(1970, 1, 1) + datetime.timedelta(int(day)), months)
+            for day in days
+        ]
+        shifted = shift_days(days, months, "months")
+        assert shifted.dtype == DAY_DTYPE
+        assert from_days(shifted).astype(datetime.date).tolist() == expected
+
+
+def test_missing_days_stay_missing():
+    days = np.array([MISSING_DAY, 0, MISSING_DAY], dtype=DAY_DTYPE)
+    for offset, unit in ((-90, "days"), (5, "days"), (6, "months"), (-1, "years")):
+        shifted = shift_days(days, offset, unit)
+        assert shifted[[0, 2]].tolist() == [MISSING_DAY, MISSING_DAY]
+        assert shifted[1] != MISSING_DAY
+    assert shift_days(days, 0, "days") is days
+
+
+def test_date_expressions():
+    assert parse_date_expression("covid_vax_1 + 19 days") == ("covid_vax_1", 19, "days")
+    assert parse_date_expression("covid_test_positive_date - 1 day") == (
+        "covid_test_positive_date",
+        -1,
+        "days",
+    )
+    assert parse_date_expression("index_date - 6 months") == ("index_date", -6, "months")
+    assert parse_date_expression("start_date + 1 year") == ("start_date", 1, "years")
+    assert parse_date_expression("2020-06-08") == ("2020-06-08", 0, "days")
+    with pytest.raises(ValueError):
+        parse_date_expression("covid_vax_1 + 19 fortnights")
+    with pytest.raises(ValueError):
+        parse_date_expression("covid_vax_1 +")
+    with pytest.raises(NotImplementedError):
+        parse_date_expression("first_day_of_month(index_date)")
+
+
+def test_evaluated_date_expressions():
+    columns = {"tested": np.array(["2022-01-31", "NaT"], dtype="datetime64[D]")}
+    assert evaluate_date_expression(None, columns, 2) is None
+    assert evaluate_date_expression("tested + 1 month", columns, 2).tolist() == [
+        to_days("2022-02-28"),
+        MISSING_DAY,
+    ]
+    index = evaluate_date_expression("index_date - 90 days", columns, 2, "2022-01-31")
+    assert index.tolist() == [to_days("2021-11-02")] * 2
+    assert evaluate_date_expression("index_date", columns, 2, "tested").tolist() == [
+        to_days("2022-01-31"),
+        MISSING_DAY,
+    ]
+    with pytest.raises(ValueError):
+        evaluate_date_expression("index_date", columns, 2)
+    with pytest.raises(ValueError):
+        evaluate_date_expression("vaccinated + 1 day", columns, 2)
+
+
+def test_windows():
+    assert window_bounds({"between": ["a", "b"], "on_or_after": "c"}) == ("a", "b")
+    assert window_bounds({"on_or_before": "b"}) == (None, "b")
+    days = np.array([10, 20, MISSING_DAY, 30], dtype=DAY_DTYPE)
+    assert in_window(days, None, None).tolist() == [True, True, False, True]
+    assert in_window(days, DAY_DTYPE(20), None).tolist() == [False, True, False, True]
+    assert in_window(days, DAY_DTYPE(10), DAY_DTYPE(20)).tolist() == [True, True, False, False]
+    # A missing bound matches nothing
+    upper = np.array([20, MISSING_DAY, 20, 40], dtype=DAY_DTYPE)
+    assert in_window(days, None, upper).tolist() == [True, False, False, True]
+    assert bound_for(upper, np.array([3, 3, 0])).tolist() == [40, 40, 20]
+    assert bound_for(None, np.array([0])) is None
+    assert bound_for(DAY_DTYPE(5), np.array([0])) == 5
+
+
+def test_earliest_and_latest_ignore_missing_days():
+    first = np.array([10, MISSING_DAY, MISSING_DAY], dtype=DAY_DTYPE)
+    second = np.array([5, 7, MISSING_DAY], dtype=DAY_DTYPE)
+    assert earliest([first, second]).tolist() == [5, 7, MISSING_DAY]
+    assert latest([first, second]).tolist() == [10, 7, MISSING_DAY]
+    assert np.isnat(from_days(latest([first, second]))[2])
+
+
+def test_query_arguments_as_lists():
+    assert to_list(None) == []
+    assert to_list("1") == ["1"]
+    assert to_list(("1", "2")) == ["1", "2"]
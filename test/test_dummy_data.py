@@ -0,0 +1,118 @@
+import gzip
+
+import numpy as np
+import pytest
+from local_engine.dummy_data import DummyGenerator, shard_sizes
+from local_engine.expressions import compile_expression, truth
+
+
+def test_satisfying_variables_are_evaluated(study):
+    generator = DummyGenerator.from_study(study, today="2022-06-01")
+    satisfying = [
+        variable
+        for variable, (query_type, query_args) in study.covariate_definitions.items()
+        if query_type == "categorised_as"
+        and query_args["return_expectations"].get("category", {}).get("ratios") == {1: 1, 0: 0}
+    ]
+    assert "pregnancy" in satisfying and "population" in satisfying
+    assert all(generator.evaluated(variable) for variable in satisfying)
+
+
+def test_pregnancy_follows_its_expression(study):
+    generator = DummyGenerator.from_study(study, today="2022-06-01")
+    columns = generator.columns(20_000, np.random.default_rng(1), ["pregnancy"])
+    pregnant = columns["pregnancy"] == 1
+    assert pregnant.any()
+    assert (columns["sex"][pregnant] == "F").all()
+    assert (columns["preg_age"][pregnant] <= 50).all()
+    assert truth(columns["preg_36wks_date"][pregnant]).all()
+    assert not truth(columns["pregdel"][pregnant]).any()
+    # Everyone satisfying the expression is pregnant, not just some of them
+    expected = (
+        (columns["sex"] == "F")
+        & (columns["preg_age"] <= 50)
+        & truth(columns["preg_36wks_date"])
+        & ~truth(columns["pregdel"])
+    )
+    assert np.array_equal(pregnant, expected)
+
+
+def test_population_is_evaluated_whatever_its_expectations(study):
+    definitions = dict(study.covariate_definitions)
+    query_type, query_args = definitions["population"]
+    definitions["population"] = (
+        query_type,
+        {**query_args, "return_expectations": {"category": {"ratios": {1: 0.5, 0: 0.5}}}},
+    )
+    generator = DummyGenerator(definitions, study.default_expectations, study.index_date)
+    assert not generator.evaluated("population")
+    generator = DummyGenerator(
+        definitions, study.default_expectations, study.index_date, population="population"
+    )
+    assert generator.evaluated("population")
+
+
+def test_sample_only_holds_the_population(study_ba2):
+    generator = DummyGenerator.from_study(study_ba2, today="2022-06-01", population="population")
+    # NOT prev_treated is drawn given the population through its own flags
+    assert generator.given["sotrovimab_covid_prev"] is False
+    assert generator.given["covid_test_positive"] is True
+    tally = {}
+    columns = generator.sample(5_000, np.random.default_rng(1), tally=tally)
+    assert len(columns["population"]) == 5_000
+    assert tally["kept"] >= 5_000
+    expression = study_ba2.covariate_definitions["population"][1]["category_definitions"][1]
+    assert compile_expression(expression).evaluate(columns, 5_000).all()
+    assert ((columns["age"] >= 18) & (columns["age"] < 110)).all()
+    assert not columns["prev_treated"].any()
+    assert not columns["has_died"].any()
+
+
+def test_cohorts_are_written_a_chunk_at_a_time(study, tmp_path):
+    generator = DummyGenerator.from_study(study, today="2022-06-01")
+    variables = ["age", "sex", "covid_test_positive_date"]
+    path = tmp_path / "input.csv.gz"
+    rows = generator.write(path, 1_000, np.random.default_rng(1), variables, chunk_size=300)
+    assert rows == 1_000
+    with gzip.open(path, "rt", newline="") as f:
+        lines = f.read().split("\r\n")
+    assert lines[0] == "patient_id,age,sex,covid_test_positive_date"
+    assert lines[-1] == ""
+    assert [int(line.split(",")[0]) for line in lines[1:-1]] == list(range(1, 1_001))
+
+
+def _ids(path):
+    with gzip.open(path, "rt", newline="") as f:
+        return [int(line.split(",")[0]) for line in f.read().split("\r\n")[1:-1]]
+
+
+def test_shards_are_reproducible(study, tmp_path):
+    generator = DummyGenerator.from_study(study, today="2022-06-01")
+    variables = ["age", "sex", "covid_test_positive_date", "pregnancy"]
+    digests = {}
+    for name, seed, shards in (("a", 1, 3), ("b", 1, 3), ("c", 2, 3), ("d", 1, 2)):
+        path = tmp_path / f"{name}.csv.gz"
+        assert generator.write_shards(path, 1_000, seed, variables, shards, chunk_size=200) == 1_000
+        assert _ids(path) == list(range(1, 1_001))
+        digests[name] = path.read_bytes()
+    # The same for the same seed and number of shards only
+    assert digests["a"] == digests["b"]
+    assert digests["a"] != digests["c"]
+    assert digests["a"] != digests["d"]
+
+
+def test_one_shard_is_a_plain_write(study, tmp_path):
+    generator = DummyGenerator.from_study(study, today="2022-06-01")
+    variables = ["age", "sex"]
+    generator.write_shards(tmp_path / "shards.csv.gz", 500, 1, variables, 1)
+    rng = np.random.default_rng(np.random.SeedSequence(1).spawn(1)[0])
+    generator.write(tmp_path / "plain.csv.gz", 500, rng, variables)
+    assert (tmp_path / "shards.csv.gz").read_bytes() == (tmp_path / "plain.csv.gz").read_bytes()
+    with pytest.raises(ValueError):
+        generator.write_shards(tmp_path / "none.csv.gz", 500, 1, variables, 0)
+
+
+def test_shard_sizes():
+    assert shard_sizes(10, 3) == [4, 3, 3]
+    assert shard_sizes(2, 4) == [1, 1, 0, 0]
+    assert sum(shard_sizes(1_000_003, 8)) == 1_000_003
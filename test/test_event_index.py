@@ -0,0 +1,83 @@
+import numpy as np
+from local_engine.dates import MISSING_DAY
+from local_engine.event_index import EventIndex
+
+
+def _expected(patients, days, rows, lower, upper, n_patients):
+    """First/last row and count per patient, one event at a time"""
+    first, last, count = [], [], []
+    for patient in range(n_patients):
+        events = [
+            (day, row)
+            for event_patient, day, row in zip(patients, days, rows)
+            if event_patient == patient
+            and (lower is None or (day != MISSING_DAY and day >= lower[patient]))
+            and (upper is None or (day != MISSING_DAY and day <= upper[patient]))
+        ]
+        count.append(len(events))
+        if not events:
+            first.append(-1)
+            last.append(-1)
+            continue
+        first.append(min(events)[1])
+        # The latest day, then the first row in table order
+        last_day = max(day for day, _ in events)
+        last.append(min(row for day, row in events if day == last_day))
+    return first, last, count
+
+
+def test_windows_match_one_event_at_a_time():
+    rng = np.random.default_rng(1)
+    n_patients, n_rows = 200, 3_000
+    patients = rng.integers(0, n_patients, n_rows)
+    # Few distinct days, so most patients have several events on a day
+    days = rng.integers(19_000, 19_030, n_rows).astype(np.int32)
+    days[rng.random(n_rows) < 0.05] = MISSING_DAY
+    rows = rng.permutation(n_rows)
+    index = EventIndex(patients, days, rows, n_patients)
+    lower = rng.integers(19_000, 19_030, n_patients).astype(np.int32)
+    upper = lower + rng.integers(-2, 20, n_patients).astype(np.int32)
+    for window in ((None, None), (lower, None), (None, upper), (lower, upper)):
+        expected = _expected(patients, days, rows, *window, n_patients)
+        actual = index.first_last_count(*index.window(*window))
+        for expected_values, actual_values in zip(expected, actual):
+            assert actual_values.tolist() == expected_values
+
+
+def test_last_match_of_a_day_is_its_first_event():
+    # Two events on the last day: the backend orders by date DESC, then id
+    index = EventIndex(
+        np.array([0, 0, 0]), np.array([10, 12, 12], dtype=np.int32), np.array([0, 3, 1]), 1
+    )
+    first, last, count = index.first_last_count(*index.window())
+    assert (first.tolist(), last.tolist(), count.tolist()) == ([0], [1], [3])
+    first, last, _ = index.first_last_count(*index.window(None, np.int32(11)))
+    assert (first.tolist(), last.tolist()) == ([0], [0])
+
+
+def test_events_without_a_date_only_match_without_a_window():
+    days = np.array([MISSING_DAY, 15, MISSING_DAY], dtype=np.int32)
+    index = EventIndex(np.array([0, 0, 1]), days, np.array([0, 1, 2]), 3)
+    _, _, count = index.first_last_count(*index.window())
+    assert count.tolist() == [2, 1, 0]
+    for window in ((np.int32(0), None), (None, np.int32(20)), (np.int32(0), np.int32(20))):
+        _, _, count = index.first_last_count(*index.window(*window))
+        assert count.tolist() == [1, 0, 0]
+    earliest, latest = index.first_last_days()
+    assert earliest.tolist() == [15, MISSING_DAY, MISSING_DAY]
+    assert latest.tolist() == [15, MISSING_DAY, MISSING_DAY]
+
+
+def test_missing_bounds_match_nothing():
+    index = EventIndex(np.array([0, 1]), np.array([15, 15], dtype=np.int32), np.array([0, 1]), 2)
+    upper = np.array([20, MISSING_DAY], dtype=np.int32)
+    _, _, count = index.first_last_count(*index.window(None, upper))
+    assert count.tolist() == [1, 0]
+
+
+def test_subsets_answer_their_own_events():
+    days = np.array([10, 11, 12, 13], dtype=np.int32)
+    index = EventIndex(np.array([0, 0, 1, 1]), days, np.array([0, 1, 2, 3]), 2)
+    subset = index.subset(np.array([False, True, True, False]))
+    first, last, count = subset.first_last_count(*subset.window(np.int32(11), None))
+    assert (first.tolist(), last.tolist(), count.tolist()) == ([1, 2], [1, 2], [1, 1])
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from local_engine.evaluator import VariableEvaluator
+from local_engine.expressions import truth
+from local_engine.studies import StudyBatch
+from local_engine.synthetic import make_tables
+
+N_PATIENTS = 10_000
+
+
+@pytest.fixture(scope="module")
+def columns(study):
+    patient_ids = np.arange(1, N_PATIENTS + 1)
+    tables = make_tables(
+        np.random.default_rng(1), patient_ids, 10 * N_PATIENTS, study.covariate_definitions
+    )
+    batch = StudyBatch.from_studies({"study": study})
+    return batch.run(VariableEvaluator(tables, patient_ids))["study"]
+
+
+def test_population_satisfies_its_conditions(columns):
+    population = columns["population"] == 1
+    assert population.any()
+    expected = (
+        (columns["age"] >= 18)
+        & (columns["age"] < 110)
+        & ~truth(columns["has_died"])
+        & np.isin(columns["sex"], ["M", "F"])
+        & (columns["stp"] != "")
+        & (columns["imd"] != -1)
+        & truth(columns["registered_eligible"])
+        & truth(columns["covid_test_positive"])
+        & ~truth(columns["covid_positive_prev_90_days"])
+        & ~truth(columns["any_covid_hosp_prev_90_days"])
+        & ~truth(columns["prev_treated"])
+        & truth(columns["high_risk_group"])
+    )
+    assert np.array_equal(population, expected)
+
+
+def test_population_tested_positive_in_the_period(columns):
+    population = columns["population"] == 1
+    dates = columns["covid_test_positive_date"][population]
+    assert not np.isnat(dates).any()
+    assert (dates >= np.datetime64("2021-12-16")).all()
+    assert (dates <= np.datetime64("2022-02-10")).all()
+
+
+def test_pregnancy_follows_its_expression(columns):
+    expected = (
+        (columns["sex"] == "F")
+        & (columns["preg_age"] <= 50)
+        & truth(columns["preg_36wks_date"])
+        & ~truth(columns["pregdel"])
+    )
+    assert np.array_equal(columns["pregnancy"] == 1, expected)
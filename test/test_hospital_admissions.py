@@ -0,0 +1,204 @@
+import numpy as np
+import pytest
+from local_engine.dates import (
+    MISSING_DAY,
+    NAT,
+    from_days,
+    parse_date_expression,
+    to_days,
+    window_bounds,
+)
+from local_engine.hospital_admissions import CODE_COLUMNS, QUERY_TYPE, AdmissionsEngine
+from local_engine.synthetic import make_admissions
+
+# (patient_id, admitted, discharged, primary diagnosis, diagnoses, method, classification)
+SPELLS = [
+    (1, "2022-01-20", "2022-01-25", "U071", "||U071", "21", "1"),
+    (1, "2022-01-01", "2022-01-05", "U071", "||U071 ,J12", "21", "1"),
+    (1, "2022-01-15", "2022-01-15", "U072", "||U072", "21", "2"),
+    (1, "2022-01-10", "2022-01-12", "I21", "||I21", "11", "1"),
+    (2, "2021-11-15", "2021-11-20", "A01", "||A01 ,U071", "22", "1"),
+    (2, "2021-12-01", "2021-12-03", "K35", "||K35", "11", "1"),
+    (2, "2022-01-03", "2022-01-04", "K35", "||K35", "21", "1"),
+]
+PATIENT_IDS = np.array([1, 2, 3])
+TESTED = {"covid_test_positive_date": np.array(["2022-01-01"] * 3, dtype="datetime64[D]")}
+
+
+def _apcs(spells):
+    patient_ids, admitted, discharged, primary, diagnoses, methods, classifications = zip(*spells)
+    return {
+        "patient_id": np.array(patient_ids),
+        "admission_date": to_days(list(admitted)),
+        "discharge_date": to_days(list(discharged)),
+        "primary_diagnosis": np.array(primary, dtype=object),
+        "diagnoses_all": np.array(diagnoses, dtype=object),
+        "procedures_all": np.full(len(spells), "", dtype=object),
+        "admission_method": np.array(methods, dtype=object),
+        "patient_classification": np.array(classifications, dtype=object),
+    }
+
+
+def _dates(*dates):
+    return np.array(dates, dtype="datetime64[D]")
+
+
+def _columns(study, variables, date_columns=TESTED):
+    definitions = study.covariate_definitions
+    engine = AdmissionsEngine({variable: definitions[variable][1] for variable in variables})
+    return engine.columns(_apcs(SPELLS), PATIENT_IDS, date_columns)
+
+
+def test_outcome_admissions(study):
+    columns = _columns(
+        study,
+        [
+            "covid_hosp_admission_date0",
+            "covid_hosp_admission_date2",
+            "covid_hosp_admission_first_date7_27",
+            "allcause_hosp_admission_first_date7_27",
+            "allcause_hosp_admission_first_diagnosis7_27",
+            "allcause_hosp_admission_diagnosis2",
+        ],
+    )
+    assert np.array_equal(
+        columns["covid_hosp_admission_date0"], _dates("2022-01-01", NAT, NAT), equal_nan=True
+    )
+    # Patient 2's admission of day 2 isn't for COVID-19
+    assert np.isnat(columns["covid_hosp_admission_date2"]).all()
+    assert columns["allcause_hosp_admission_diagnosis2"].tolist() == ["", "K35", ""]
+    # The day case (classification "2") of day 14 isn't an admission
+    assert np.array_equal(
+        columns["covid_hosp_admission_first_date7_27"],
+        _dates("2022-01-20", NAT, NAT),
+        equal_nan=True,
+    )
+    assert np.array_equal(
+        columns["allcause_hosp_admission_first_date7_27"],
+        _dates("2022-01-10", NAT, NAT),
+        equal_nan=True,
+    )
+    assert columns["allcause_hosp_admission_first_diagnosis7_27"].tolist() == ["I21", "", ""]
+
+
+def test_discharge_after_admission(study):
+    admitted = _columns(study, ["covid_hosp_admission_date0"])
+    columns = _columns(study, ["covid_hosp_discharge_first_date0_7"], {**TESTED, **admitted})
+    assert np.array_equal(
+        columns["covid_hosp_discharge_first_date0_7"],
+        _dates("2022-01-05", NAT, NAT),
+        equal_nan=True,
+    )
+
+
+def test_admissions_before_the_test(study):
+    columns = _columns(study, ["any_covid_hosp_prev_90_days", "discharged_date"])
+    # Any diagnosis matches, not just the primary one
+    assert columns["any_covid_hosp_prev_90_days"].tolist() == [0, 1, 0]
+    # The last emergency admission up to (and on) the day of the test,
+    # whatever its diagnosis: patient 2's elective admission of December
+    # doesn't count
+    assert np.array_equal(
+        columns["discharged_date"], _dates("2022-01-05", "2021-11-20", NAT), equal_nan=True
+    )
+
+
+def test_codes_follow_a_separator(study):
+    # As the backend's LIKE '%[^A-Za-z0-9]U071%', a value's first code only
+    # matches after a separator
+    spells = [
+        (1, "2021-11-15", "2021-11-20", "U071", "U071 ,A01", "22", "1"),
+        (2, "2021-11-15", "2021-11-20", "U071", "||U071 ,A01", "22", "1"),
+        (3, "2021-11-15", "2021-11-20", "A01", "A01,U071", "22", "1"),
+    ]
+    definitions = study.covariate_definitions
+    engine = AdmissionsEngine(
+        {"any_covid_hosp_prev_90_days": definitions["any_covid_hosp_prev_90_days"][1]}
+    )
+    columns = engine.columns(_apcs(spells), PATIENT_IDS, TESTED)
+    assert columns["any_covid_hosp_prev_90_days"].tolist() == [0, 1, 1]
+
+
+def _synthetic_admissions(definitions, n_patients):
+    """
+    Random spells, most of them within a month of random positive tests (some
+    patients without one), with diagnoses and procedures from the codelists
+    of `definitions`, primary diagnoses the most often
+    """
+    rng = np.random.default_rng(1)
+    codes = {}
+    for query_args in definitions.values():
+        for argument in CODE_COLUMNS:
+            if query_args.get(argument):
+                codes.setdefault(argument, set()).update(query_args[argument])
+    icd10_codes = sorted(codes["with_these_diagnoses"])
+    icd10_codes += sorted(codes["with_these_primary_diagnoses"]) * len(icd10_codes)
+    patient_ids = np.arange(1, n_patients + 1)
+    apcs = make_admissions(
+        rng, patient_ids, 10 * n_patients, icd10_codes, sorted(codes["with_these_procedures"])
+    )
+    tested = to_days("2022-01-01") + rng.integers(0, 30, n_patients).astype(np.int32)
+    tested[rng.random(n_patients) < 0.1] = MISSING_DAY
+    spell_tested = tested[apcs["patient_id"] - 1]
+    admitted = spell_tested + rng.integers(-5, 35, len(spell_tested)).astype(np.int32)
+    admitted[rng.random(len(admitted)) < 0.02] = MISSING_DAY
+    apcs["admission_date"] = np.where(
+        spell_tested == MISSING_DAY, apcs["admission_date"], admitted
+    ).astype(np.int32)
+    return apcs, patient_ids, {"covid_test_positive_date": from_days(tested)}
+
+
+def _evaluate_admissions(definitions, apcs, patient_ids, columns, index_date, day_buckets):
+    """Every variable's column, evaluating those anchored on other variables after them"""
+    columns = dict(columns)
+    pending = dict(definitions)
+    while pending:
+        ready = {
+            variable: query_args
+            for variable, query_args in pending.items()
+            if not any(
+                parse_date_expression(bound)[0] in pending
+                for bound in window_bounds(query_args)
+                if bound is not None
+            )
+        }
+        assert ready
+        engine = AdmissionsEngine(ready, day_buckets=day_buckets)
+        columns.update(engine.columns(apcs, patient_ids, columns, index_date))
+        for variable in ready:
+            del pending[variable]
+    return columns
+
+
+@pytest.mark.parametrize("study_name", ["study", "study_ba2"])
+def test_day_buckets_match_every_spell(study_name, request):
+    study = request.getfixturevalue(study_name)
+    definitions = {
+        variable: query_args
+        for variable, (query_type, query_args) in study.covariate_definitions.items()
+        if query_type == QUERY_TYPE
+    }
+    bucketed = AdmissionsEngine(definitions).day_windows
+    assert "covid_hosp_admission_date0" in bucketed
+    assert "allcause_hosp_admission_diagnosis6" in bucketed
+    assert "covid_any_hosp_admission_first_date7_27" in bucketed
+    assert "covid_hosp_discharge_first_date0_7" in bucketed
+    assert "discharged_date" not in bucketed
+    # The outcomes: windows from the positive test, or from an admission after it
+    outcomes = {"covid_test_positive_date"}
+    for variable, (reference, _, _) in bucketed.items():
+        if reference in outcomes:
+            outcomes.add(variable)
+    apcs, patient_ids, columns = _synthetic_admissions(definitions, 500)
+    expected, actual = (
+        _evaluate_admissions(definitions, apcs, patient_ids, columns, study.index_date, buckets)
+        for buckets in (False, True)
+    )
+    for variable in definitions:
+        values = expected[variable]
+        if values.dtype.kind == "M":
+            assert np.array_equal(values, actual[variable], equal_nan=True), variable
+            values = ~np.isnat(values)
+        else:
+            assert values.tolist() == actual[variable].tolist(), variable
+        assert values.any() or variable not in outcomes, variable
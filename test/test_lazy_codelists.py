@@ -0,0 +1,103 @@
+import concurrent.futures
+import copy
+import importlib
+import pickle
+import time
+
+import codelist_cache
+import pytest
+from cohortextractor import codelistlib
+from conftest import ROOT
+from lazy_codelists import LazyCodelist, codelist_from_csv, combine_codelists
+
+
+@pytest.fixture
+def csv_files(tmp_path, monkeypatch):
+    monkeypatch.setenv("CODELIST_CACHE_DIR", "")
+    (tmp_path / "plain.csv").write_text("code,term\nA01,one\nA02,two\n")
+    (tmp_path / "other.csv").write_text("code,term\nB01,three\n")
+    (tmp_path / "categorised.csv").write_text("code,category\nX1,S\nX2,E\n")
+    return tmp_path
+
+
+def test_codes_are_read_on_first_access(csv_files):
+    codes = codelist_from_csv(str(csv_files / "plain.csv"), system="icd10")
+    assert not codes.is_loaded
+    assert codes.system == "icd10" and not codes.has_categories
+    assert not codes.is_loaded
+    assert len(codes) == 2
+    assert codes.is_loaded
+    assert list(codes) == ["A01", "A02"]
+
+
+def test_same_codes_as_cohortextractor(csv_files):
+    for filename, category_column in (("plain.csv", None), ("categorised.csv", "category")):
+        path = str(csv_files / filename)
+        lazy = codelist_from_csv(path, system="ctv3", category_column=category_column)
+        eager = codelistlib.codelist_from_csv(path, system="ctv3", category_column=category_column)
+        assert lazy == eager
+        assert lazy.has_categories == eager.has_categories
+
+
+def test_missing_file_fails_straight_away(csv_files):
+    with pytest.raises(FileNotFoundError):
+        codelist_from_csv(str(csv_files / "missing.csv"), system="icd10")
+
+
+def test_combined_codelists_load_on_use(csv_files):
+    first = codelist_from_csv(str(csv_files / "plain.csv"), system="icd10")
+    second = codelist_from_csv(str(csv_files / "other.csv"), system="icd10")
+    combined = combine_codelists(first, second)
+    assert not (combined.is_loaded or first.is_loaded or second.is_loaded)
+    assert sorted(combined) == ["A01", "A02", "B01"]
+
+
+def test_combining_checks_systems_straight_away(csv_files):
+    first = codelist_from_csv(str(csv_files / "plain.csv"), system="icd10")
+    second = codelist_from_csv(str(csv_files / "other.csv"), system="snomed")
+    with pytest.raises(ValueError):
+        combine_codelists(first, second)
+    categorised = codelist_from_csv(
+        str(csv_files / "categorised.csv"), system="icd10", category_column="category"
+    )
+    with pytest.raises(ValueError):
+        combine_codelists(first, categorised)
+    assert not (first.is_loaded or second.is_loaded or categorised.is_loaded)
+
+
+def test_pickled_as_a_loaded_codelist(csv_files):
+    codes = codelist_from_csv(
+        str(csv_files / "categorised.csv"), system="ctv3", category_column="category"
+    )
+    for copied in (pickle.loads(pickle.dumps(codes)), copy.deepcopy(codes)):
+        assert not isinstance(copied, LazyCodelist)
+        assert list(copied) == [("X1", "S"), ("X2", "E")]
+        assert copied.system == "ctv3" and copied.has_categories
+
+
+def test_importing_codelists_reads_no_file(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    read = []
+    monkeypatch.setattr(
+        codelist_cache, "codelist_from_csv", lambda *args, **kwargs: read.append(args)
+    )
+    codelists = importlib.reload(importlib.import_module("codelists"))
+    lazy = [value for value in vars(codelists).values() if isinstance(value, LazyCodelist)]
+    assert lazy
+    assert not read
+    assert not any(codes.is_loaded for codes in lazy)
+
+
+def test_threads_see_every_code():
+    loads = []
+
+    def slow_loader():
+        loads.append(1)
+        time.sleep(0.2)
+        return ["A01", "A02"]
+
+    codes = LazyCodelist(slow_loader, system="icd10")
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        lengths = list(executor.map(lambda _: len(codes), range(4)))
+    assert lengths == [2, 2, 2, 2]
+    assert len(loads) == 1
@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+import pytest
+from conftest import ROOT
+from local_engine.dependencies import VariableGraph
+from local_engine.evaluator import VariableEvaluator
+from local_engine.manifest import (
+    columns_from_r_spec,
+    columns_from_yaml,
+    load_manifest,
+    plan_columns,
+)
+from local_engine.studies import StudyBatch
+from local_engine.synthetic import make_tables
+
+DATA_PROCESS = os.path.join(ROOT, "analysis", "data_process.R")
+
+R_SCRIPT = """
+library(readr)
+data <- read_csv(
+  "output/input.csv.gz",
+  col_types = cols_only(
+    # Identifier
+    patient_id = col_integer(),
+    age = col_integer(),
+    # sex = col_character(),
+    covid_test_positive_date = col_date(format = "%Y-%m-%d"),
+    stp = col_character(), # a comment with a ) in it
+    region = col_factor(levels = c("East (of England)", "London")),
+    age = col_integer(),
+  ),
+  na = character()
+)
+other <- read_csv("other.csv", col_types = cols_only(ignored = col_integer()))
+"""
+
+
+def _write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def test_columns_of_an_r_spec(tmp_path):
+    # Commented out columns are skipped, and duplicates read once
+    assert columns_from_r_spec(_write(tmp_path, "read.R", R_SCRIPT)) == [
+        "patient_id",
+        "age",
+        "covid_test_positive_date",
+        "stp",
+        "region",
+    ]
+
+
+def test_r_scripts_without_a_spec(tmp_path):
+    with pytest.raises(ValueError):
+        columns_from_r_spec(_write(tmp_path, "none.R", "data <- read_csv('input.csv')\n"))
+    with pytest.raises(ValueError):
+        columns_from_r_spec(_write(tmp_path, "open.R", "cols_only(\n  age = col_integer(\n"))
+
+
+def test_columns_of_a_yaml_list(tmp_path):
+    path = _write(tmp_path, "columns.yaml", "- patient_id\n- age\n- stp\n- age\n")
+    assert columns_from_yaml(path) == ["patient_id", "age", "stp"]
+    for text in ("age: 1\n", "- age\n- [stp]\n"):
+        with pytest.raises(ValueError):
+            columns_from_yaml(_write(tmp_path, "invalid.yml", text))
+
+
+def test_manifests_by_extension(tmp_path):
+    assert load_manifest(_write(tmp_path, "read.r", R_SCRIPT))[0] == "patient_id"
+    assert load_manifest(_write(tmp_path, "columns.yml", "- stp\n")) == ["stp"]
+    with pytest.raises(ValueError):
+        load_manifest(_write(tmp_path, "columns.txt", "stp\n"))
+
+
+def test_data_process_manifest(study):
+    manifest = load_manifest(DATA_PROCESS)
+    assert manifest[:3] == ["patient_id", "age", "sex"]
+    graph = VariableGraph.from_study(study)
+    plan = plan_columns(graph, manifest)
+    assert plan.written == manifest[1:]
+    # Inputs of written variables (or of the population) are only evaluated
+    assert "population" in plan.in_memory
+    assert "preg_36wks_date" in plan.in_memory
+    assert "downs_syndrome_nhsd_snomed" in plan.in_memory
+    assert "bmi_value" not in plan.written
+    needed = set(plan.written) | set(plan.in_memory)
+    assert set(graph.ancestors(sorted(needed))) <= needed
+    assert set(plan.skipped) == set(graph.definitions) - needed
+    assert len(plan.written) + len(plan.in_memory) + len(plan.skipped) == len(graph.definitions)
+
+
+def test_unknown_columns(study):
+    with pytest.raises(ValueError, match="not_a_variable"):
+        plan_columns(VariableGraph.from_study(study), ["patient_id", "age", "not_a_variable"])
+
+
+def test_pruned_extraction_writes_the_same_columns(study):
+    graph = VariableGraph.from_study(study)
+    plan = plan_columns(graph, load_manifest(DATA_PROCESS))
+    patient_ids = np.arange(1, 2_001)
+    tables = make_tables(
+        np.random.default_rng(1), patient_ids, 20_000, study.covariate_definitions
+    )
+    batch = StudyBatch.from_studies({"study": study})
+    every = batch.run(VariableEvaluator(tables, patient_ids))["study"]
+    pruned = batch.run(
+        VariableEvaluator(tables, patient_ids), {"study": plan.written + plan.in_memory}
+    )["study"]
+    assert not set(pruned) & set(plan.skipped)
+    for variable in plan.written + ["population"]:
+        assert every[variable].astype(str).tolist() == pruned[variable].astype(str).tolist()
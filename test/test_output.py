@@ -0,0 +1,108 @@
+import csv
+import gzip
+import io
+
+import numpy as np
+import pytest
+from local_engine import output
+from local_engine.output import CohortWriter, format_column, write_cohort
+
+TEXT = ["plain", "", "a,b", 'say "hi"', "two\nlines", "cr\rlf", "café", " padded ", '"', ","]
+
+
+def _columns(n_patients, rng):
+    days = rng.integers(0, 60, n_patients).astype("timedelta64[D]")
+    dates = np.datetime64("2021-12-16") + days
+    dates[rng.random(n_patients) < 0.2] = np.datetime64("NaT")
+    values = rng.normal(27, 6, n_patients).round(1)
+    values[rng.random(n_patients) < 0.1] = np.nan
+    return {
+        "age": rng.integers(-5, 110, n_patients),
+        "flag": rng.random(n_patients) < 0.5,
+        "bmi": values,
+        "tested": dates,
+        "tested_month": dates,
+        "text": rng.choice(np.array(TEXT, dtype=object), n_patients),
+        "category": rng.choice(np.array(["S", "E", None], dtype=object), n_patients),
+    }
+
+
+DATE_FORMATS = {"tested_month": "YYYY-MM"}
+
+
+def _rows(columns, rows):
+    return {name: values[rows] for name, values in columns.items()}
+
+
+def _expected(patient_ids, columns, population=None):
+    """The file as the csv module writes the same values"""
+    text = io.StringIO(newline="")
+    writer = csv.writer(text)
+    writer.writerow(["patient_id", *columns])
+    for row, patient_id in enumerate(patient_ids):
+        if population is not None and not population[row]:
+            continue
+        fields = [int(patient_id)]
+        for name, values in columns.items():
+            value = values[row]
+            if name == "flag":
+                value = int(value)
+            elif isinstance(value, np.datetime64):
+                value = "" if np.isnat(value) else str(value)[: 7 if name in DATE_FORMATS else 10]
+            elif isinstance(value, float):
+                value = "" if np.isnan(value) else repr(value)
+            fields.append(value)
+        writer.writerow(fields)
+    return text.getvalue().encode()
+
+
+def test_same_bytes_as_the_csv_module(tmp_path, monkeypatch):
+    # Blocks of a few patients, some of them without anyone in the population
+    monkeypatch.setattr(output, "BLOCK_SIZE", 7)
+    rng = np.random.default_rng(1)
+    patient_ids = np.arange(1, 201) * 1_000
+    columns = _columns(200, rng)
+    population = rng.random(200) < 0.7
+    population[7:14] = False
+    path = tmp_path / "input.csv"
+    with CohortWriter(path, list(columns), DATE_FORMATS) as writer:
+        for rows in (slice(0, 100), slice(100, 200)):
+            writer.write(patient_ids[rows], _rows(columns, rows), population[rows])
+    assert writer.rows == population.sum()
+    expected = _expected(patient_ids, columns, population)
+    assert b"\r\n" in expected and b'"a,b"' in expected and b'"say ""hi"""' in expected
+    assert path.read_bytes() == expected
+
+
+def test_gzipped_files_are_reproducible(tmp_path):
+    columns = _columns(50, np.random.default_rng(1))
+    patient_ids = np.arange(1, 51)
+    for name in ("first.csv.gz", "second.csv.gz"):
+        write_cohort(tmp_path / name, patient_ids, columns, list(columns), None, DATE_FORMATS)
+    first = (tmp_path / "first.csv.gz").read_bytes()
+    assert first == (tmp_path / "second.csv.gz").read_bytes()
+    assert gzip.decompress(first) == _expected(patient_ids, columns)
+
+
+def test_parts_concatenate_into_one_file(tmp_path):
+    columns = _columns(30, np.random.default_rng(1))
+    patient_ids = np.arange(1, 31)
+    parts = []
+    for part, rows in enumerate((slice(0, 10), slice(10, 30))):
+        path = tmp_path / f"{part}.csv.gz"
+        with CohortWriter(path, list(columns), DATE_FORMATS, header=not part) as writer:
+            writer.write(patient_ids[rows], _rows(columns, rows))
+        parts.append(path.read_bytes())
+    assert gzip.decompress(b"".join(parts)) == _expected(patient_ids, columns)
+
+
+def test_formatted_values():
+    dates = np.array(["2022-01-05", "NaT"], dtype="datetime64[D]")
+    assert format_column(dates).tolist() == ["2022-01-05", ""]
+    assert format_column(dates, "YYYY-MM").tolist() == ["2022-01", ""]
+    assert format_column(dates, "YYYY").tolist() == ["2022", ""]
+    assert format_column(np.array([True, False])).tolist() == ["1", "0"]
+    assert format_column(np.array([1.5, np.nan])).tolist() == ["1.5", ""]
+    assert format_column(np.array(["E", None], dtype=object)).tolist() == ["E", ""]
+    with pytest.raises(KeyError):
+        format_column(dates, "DD/MM/YYYY")
@@ -0,0 +1,79 @@
+import numpy as np
+from local_engine.dates import NAT, to_days
+from local_engine.sgss import SGSSEngine
+
+
+def _specimens(rows):
+    """A table of specimens from (patient_id, date, sgtf) rows"""
+    patient_ids, dates, sgtf = zip(*rows)
+    n_rows = len(rows)
+    return {
+        "patient_id": np.array(patient_ids),
+        "date": to_days(list(dates)),
+        "sgtf": np.array(sgtf, dtype=object),
+        "case_category": np.full(n_rows, "PCR_Only", dtype=object),
+        "variant": np.full(n_rows, "", dtype=object),
+        "variant_detection_method": np.full(n_rows, "", dtype=object),
+        "symptomatic": np.full(n_rows, "Y", dtype=object),
+    }
+
+
+# Patient 1 was first tested in the period, patient 2 in an earlier episode
+# (so SGSS_Positive only holds their test of October) and patient 3 never
+ALL_POSITIVE = _specimens(
+    [
+        (1, "2021-12-20", "1"),
+        (1, "2021-12-22", "0"),
+        (2, "2021-10-01", "1"),
+        (2, "2022-01-05", "0"),
+    ]
+)
+TABLES = {
+    "SGSS_AllTests_Positive": ALL_POSITIVE,
+    "SGSS_AllTests_Negative": _specimens([(3, "2022-01-02", "")]),
+    "SGSS_Positive": _specimens([(1, "2021-12-20", "1"), (2, "2021-10-01", "1")]),
+    "SGSS_Negative": _specimens([(3, "2022-01-02", "")]),
+}
+PATIENT_IDS = np.array([1, 2, 3])
+
+
+def _columns(definitions):
+    return SGSSEngine(definitions).columns(TABLES, PATIENT_IDS, {})
+
+
+def test_restriction_of_the_study_definition(study):
+    definitions = study.covariate_definitions
+    assert definitions["covid_test_positive_date"][1]["restrict_to_earliest_specimen_date"] is False
+    assert definitions["sgtf"][1]["restrict_to_earliest_specimen_date"] is True
+    engine = SGSSEngine.from_covariate_definitions(
+        definitions, ["covid_test_positive", "covid_test_positive_date", "sgtf"]
+    )
+    columns = engine.columns(TABLES, PATIENT_IDS, {})
+    assert columns["covid_test_positive"].tolist() == [1, 1, 0]
+    expected = np.array(["2021-12-20", "2022-01-05", NAT], dtype="datetime64[D]")
+    assert np.array_equal(columns["covid_test_positive_date"], expected, equal_nan=True)
+    # Patient 2's earliest specimen wasn't taken on their positive test date
+    assert columns["sgtf"].tolist() == ["1", "", ""]
+    assert engine.scans == 2
+
+
+def test_earliest_specimens_by_default(study):
+    query_args = dict(study.covariate_definitions["covid_test_positive_date"][1])
+    del query_args["restrict_to_earliest_specimen_date"]
+    # The last specimen, which SGSS_AllTests_Positive would have later
+    query_args.update(
+        between=(None, None), find_first_match_in_period=False, find_last_match_in_period=True
+    )
+    default = _columns({"date": query_args})["date"]
+    restricted = _columns({"date": {**query_args, "restrict_to_earliest_specimen_date": True}})
+    expected = np.array(["2021-12-20", "2021-10-01", NAT], dtype="datetime64[D]")
+    assert np.array_equal(default, expected, equal_nan=True)
+    assert np.array_equal(restricted["date"], expected, equal_nan=True)
+
+
+def test_any_result_reads_both_tables(study):
+    query_args = dict(study.covariate_definitions["symptomatic_covid_test"][1])
+    query_args["between"] = ("2022-01-01", None)
+    columns = _columns({"symptomatic_covid_test": query_args})
+    # Negative specimens carry their symptomatic column too
+    assert columns["symptomatic_covid_test"].tolist() == ["", "Y", "Y"]
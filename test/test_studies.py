@@ -0,0 +1,139 @@
+import threading
+
+import numpy as np
+import pytest
+from local_engine.evaluator import VariableEvaluator
+from local_engine.studies import StudyBatch, evaluate_studies
+from local_engine.synthetic import make_tables
+
+N_PATIENTS = 2_000
+
+
+@pytest.fixture(scope="module")
+def batch_tables(study, study_ba2):
+    studies = {"study_definition": study, "study_definition_ba2": study_ba2}
+    definitions = {**study.covariate_definitions, **study_ba2.covariate_definitions}
+    patient_ids = np.arange(1, N_PATIENTS + 1)
+    tables = make_tables(np.random.default_rng(1), patient_ids, 10 * N_PATIENTS, definitions)
+    return studies, tables, patient_ids
+
+
+def _run(studies, tables, patient_ids, workers=1, variables=None):
+    batch = StudyBatch.from_studies(studies, workers)
+    return batch, batch.run(VariableEvaluator(tables, patient_ids), variables)
+
+
+def _same_columns(first, second):
+    assert first.keys() == second.keys()
+    for name, columns in first.items():
+        assert columns.keys() == second[name].keys()
+        for variable, values in columns.items():
+            # Compared as strings, so NaT == NaT
+            assert values.dtype == second[name][variable].dtype, variable
+            assert values.astype(str).tolist() == second[name][variable].astype(str).tolist()
+
+
+def test_batch_evaluates_each_study_as_on_its_own(batch_tables):
+    studies, tables, patient_ids = batch_tables
+    batch, columns = _run(*batch_tables)
+    separate = {}
+    separate_groups = 0
+    for name, study in studies.items():
+        single, study_columns = _run({name: study}, tables, patient_ids)
+        separate.update(study_columns)
+        separate_groups += single.groups
+    _same_columns(separate, columns)
+    # The studies' variables of a level and query type share a group
+    assert batch.groups < separate_groups
+
+
+def test_evaluate_studies(batch_tables):
+    studies, tables, patient_ids = batch_tables
+    _same_columns(_run(*batch_tables)[1], evaluate_studies(studies, tables, patient_ids))
+
+
+def test_only_the_variables_needed_are_evaluated(batch_tables):
+    studies, tables, patient_ids = batch_tables
+    variables = {"study_definition": ["pregnancy"], "study_definition_ba2": ["sex"]}
+    _, columns = _run(*batch_tables, variables=variables)
+    assert set(columns["study_definition"]) == {
+        "pregnancy",
+        "sex",
+        "preg_age",
+        "preg_36wks_date",
+        "pregdel",
+        "covid_test_positive_date",
+    }
+    assert set(columns["study_definition_ba2"]) == {"sex"}
+    _, every = _run(*batch_tables)
+    for name, study_columns in columns.items():
+        for variable, values in study_columns.items():
+            assert values.astype(str).tolist() == every[name][variable].astype(str).tolist()
+
+
+class _RecordingEvaluator:
+    """Records the groups it evaluates, returning each key's index date"""
+
+    def __init__(self):
+        self.groups = []
+
+    def evaluate_group(self, query_type, variables, index_dates=None):
+        self.groups.append((query_type, variables, index_dates))
+        return {key: np.array([index_dates[key]]) for key in variables}
+
+
+def test_groups_hold_the_variables_of_every_study():
+    definitions = {
+        "tested": ("with_these_clinical_events", {"returning": "date"}),
+        "flag": (
+            "with_these_clinical_events",
+            {"returning": "binary_flag", "on_or_after": "tested"},
+        ),
+    }
+    batch = StudyBatch(
+        {"ba1": definitions, "ba2": definitions}, {"ba1": "2021-12-16", "ba2": "2022-02-11"}
+    )
+    evaluate = _RecordingEvaluator()
+    columns = batch.run(evaluate)
+    assert batch.groups == 2
+    assert [sorted(variables) for _, variables, _ in evaluate.groups] == [
+        [("ba1", "tested"), ("ba2", "tested")],
+        [("ba1", "flag"), ("ba2", "flag")],
+    ]
+    # Each variable brings its own study's inputs and index date
+    _, flags, index_dates = evaluate.groups[1]
+    assert flags["ba1", "flag"][1]["tested"].tolist() == ["2021-12-16"]
+    assert flags["ba2", "flag"][1]["tested"].tolist() == ["2022-02-11"]
+    assert index_dates == {("ba1", "flag"): "2021-12-16", ("ba2", "flag"): "2022-02-11"}
+    assert columns["ba2"]["flag"].tolist() == ["2022-02-11"]
+
+
+def test_workers_evaluate_the_same_columns(batch_tables):
+    serial_batch, serial = _run(*batch_tables)
+    parallel_batch, parallel = _run(*batch_tables, workers=4)
+    assert parallel_batch.groups == serial_batch.groups
+    _same_columns(serial, parallel)
+
+
+class _BarrierEvaluator:
+    """Evaluates a group only once every group of its level has started"""
+
+    def __init__(self, n_groups, timeout=10):
+        self.barrier = threading.Barrier(n_groups, timeout=timeout)
+
+    def evaluate_group(self, query_type, variables, index_dates=None):
+        self.barrier.wait()
+        return {key: np.zeros(1) for key in variables}
+
+
+def test_groups_of_a_level_run_at_the_same_time():
+    definitions = {
+        "flag": ("with_these_clinical_events", {"returning": "binary_flag"}),
+        "sex": ("sex", {}),
+        "age": ("age_as_of", {"reference_date": "2022-01-01"}),
+    }
+    columns = StudyBatch({"study": definitions}, workers=3).run(_BarrierEvaluator(3))
+    assert list(columns["study"]) == ["flag", "sex", "age"]
+    # One after the other, the first group waits for the others in vain
+    with pytest.raises(threading.BrokenBarrierError):
+        StudyBatch({"study": definitions}).run(_BarrierEvaluator(3, timeout=0.1))